@@ -45,13 +45,22 @@ setup(
     package_dir={"": "src"},
     classifiers=classifiers,
     entry_points={
-        "console_scripts": ["biocam_emulator = biocam_emulator.emulator:main"]
+        "console_scripts": [
+            "biocam_emulator = biocam_emulator.emulator:main",
+            "biocam_summary_archive = biocam_emulator.archive:main",
+            "biocam_fleet = biocam_emulator.fleet:main",
+            "biocam_replay = biocam_emulator.replay:main",
+            "biocam_verify = biocam_emulator.verify:main",
+            "biocam_scenarios = biocam_emulator.scenario:main",
+            "biocam_bench = biocam_emulator.bench:main",
+        ]
     },
     package_data={"biocam_emulator": ["data/*"]},
     include_package_data=True,
     license="BSD-3-Clause",
     install_requires=[
         "numpy>=1.23.4",
+        "pyserial>=3.5",
         "setuptools>=59.6.0",
     ],
     project_urls={"Bug Reports": GITHUB_URL + "/issues", "Source": GITHUB_URL},
@@ -0,0 +1,152 @@
+"""
+Packed summary archive
+
+Summaries are stored as raw bytes in a single file instead of one hex text file
+per summary. The file starts with a fixed header, followed by an index with the
+offset and length of every summary and the concatenated summary bytes:
+
+    magic "BCSA" | version u32 | count u64          (16 bytes header)
+    offset u64 | length u64                          (count times)
+    raw summary bytes
+
+All the integers are little endian. The archive is memory-mapped, so opening it
+does not read the summaries, and they are only hex-encoded when sent.
+"""
+
+import argparse
+import binascii
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+
+ARCHIVE_MAGIC = b"BCSA"
+ARCHIVE_VERSION = 1
+
+_HEADER = struct.Struct("<4sIQ")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u8")])
+
+
+class SummaryArchiveException(Exception):
+    """Exceptions raised from this module."""
+
+
+class SummaryArchive:
+    def __init__(self, path):
+        """Read-only, memory-mapped summary archive.
+
+        :param path: path to the archive file
+        """
+
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise SummaryArchiveException(str(self.path) + " is not an archive")
+        magic, version, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self.close()
+            raise SummaryArchiveException(
+                str(self.path) + " is not a version 1 summary archive"
+            )
+        # The index is small, copy it so that the mapping can always be closed.
+        self.index = np.frombuffer(
+            self._mmap, dtype=INDEX_DTYPE, count=count, offset=_HEADER.size
+        ).copy()
+        self._view = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def sizes(self):
+        """Size in bytes of every summary."""
+
+        return self.index["length"]
+
+    def raw(self, idx):
+        """Summary idx as a read-only memoryview of the archive."""
+
+        offset = int(self.index["offset"][idx])
+        return self._view[offset : offset + int(self.index["length"][idx])]
+
+    def hex(self, idx):
+        """Summary idx as upper case hex bytes, as sent by BioCam."""
+
+        return binascii.b2a_hex(self.raw(idx)).upper()
+
+    def close(self):
+        """Unmap and close the archive file."""
+
+        self.index = None
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+def write_archive(path, summaries):
+    """Write a list of summaries (bytes-like objects) to an archive file."""
+
+    summaries = list(summaries)
+    index = np.zeros(len(summaries), dtype=INDEX_DTYPE)
+    index["length"] = [len(s) for s in summaries]
+    data_offset = _HEADER.size + index.nbytes
+    if len(summaries) > 0:
+        index["offset"] = data_offset + np.concatenate(
+            ([0], np.cumsum(index["length"][:-1]))
+        )
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(summaries)))
+        f.write(index.tobytes())
+        for summary in summaries:
+            f.write(summary)
+
+
+def read_text_folder(input_folder):
+    """Read the hex text summaries of a data folder.
+
+    Returns the sorted list of files and the decoded bytes of each one.
+    """
+
+    input_folder = Path(input_folder)
+    files = sorted(input_folder.glob("image_summary_*.txt")) + sorted(
+        input_folder.glob("representative_image_*.txt")
+    )
+    summaries = [bytes.fromhex(f.read_text().strip()) for f in files]
+    return files, summaries
+
+
+def convert_folder(input_folder, output_path):
+    """Pack the hex text summaries of a data folder into an archive."""
+
+    files, summaries = read_text_folder(input_folder)
+    write_archive(output_path, summaries)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack BioCam hex text summaries into a summary archive"
+    )
+    parser.add_argument("input_folder", type=Path, help="folder with the .txt files")
+    parser.add_argument("output", type=Path, help="archive to write (.bca)")
+    args = parser.parse_args()
+
+    files = convert_folder(args.input_folder, args.output)
+    print("Packed", len(files), "summaries into", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+"""
+Benchmark suite
+
+Reproducible measurements of the serial loop of the emulator, driven from the
+vehicle side either in-process (MemoryTransport) or through a real pty pair of
+VirtualSerialPorts:
+
+    ack_latency         round trip of a command and its acknowledgement
+    nav_ingest          highest nav rate processed as fast as it is sent
+    summary_throughput  transfer of all the summaries of a RemoteAwarenessData
+    outbox_drain        MessageOutbox put and paced drain rates
+    scaling             memory, threads and open files of a fleet of N
+
+Results are written as JSON. With a baseline (a previous results file), every
+metric is compared with it and the run fails when one got worse by more than
+the tolerance:
+
+    biocam_bench --output baseline.json
+    biocam_bench --output results.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import select
+import statistics
+import sys
+import threading
+import time
+import tty
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .emulator import BioCamEmulator
+from .outbox import PRIORITY_NAMES, MessageOutbox
+from .pacing import make_pacer
+from .transports import MemoryTransport, Transport
+from .virtual_serial_ports import VirtualSerialPorts
+
+BENCHMARK_VERSION = 1
+
+BENCHMARKS = (
+    "ack_latency",
+    "nav_ingest",
+    "summary_throughput",
+    "outbox_drain",
+    "scaling",
+)
+
+BENCH_TRANSPORTS = ("memory", "pty")
+
+# Commands of the latency benchmark, sent in turn
+COMMANDS = (b"*bc_start_mapping\n", b"*bc_stop_acquisition\n")
+
+SUMMARY_DONE = b"summary done\n"
+
+# Seconds to wait for a response before giving up
+RESPONSE_TIMEOUT = 10.0
+
+# Metric name endings telling which way is better, the other metrics are only
+# reported
+LOWER_IS_BETTER = ("_us", "_bytes", "threads", "open_fds")
+HIGHER_IS_BETTER = ("_per_second",)
+# Too noisy to compare
+REPORT_ONLY = ("max_us",)
+
+# Full run and --quick run settings
+SETTINGS = {
+    "full": {
+        "ack_count": 5000,
+        "nav_step_time": 1.0,
+        "nav_max_rate": 1024000,
+        "summaries": 2000,
+        "summary_repeats": 5,
+        "outbox_messages": 200000,
+        "scaling_sizes": (1, 10, 100),
+    },
+    "quick": {
+        "ack_count": 500,
+        "nav_step_time": 0.25,
+        "nav_max_rate": 256000,
+        "summaries": 300,
+        "summary_repeats": 2,
+        "outbox_messages": 20000,
+        "scaling_sizes": (1, 10),
+    },
+}
+
+
+class _DeviceTransport(Transport):
+    def __init__(self, path):
+        """Emulator side opened on an existing serial device, e.g. a pty slave."""
+
+        super().__init__()
+        self._fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self._fd)
+        self.port = path
+
+
+class BenchLink:
+    def __init__(self, transport="memory", summaries=None):
+        """Emulator served by an event loop thread, and the vehicle side of
+        its link.
+
+        :param transport: "memory" for an in-process socket pair, "pty" for a
+            pty pair of VirtualSerialPorts
+        :param summaries: folder, archive or source of the summaries
+        """
+
+        self.ports = None
+        if transport == "memory":
+            emulator_transport = MemoryTransport()
+            self._client = emulator_transport.client
+            self._fd = self._client.fileno()
+        elif transport == "pty":
+            self.ports = VirtualSerialPorts(2)
+            self.ports.open()
+            self.ports.start()
+            emulator_transport = _DeviceTransport(self.ports.ports[0])
+            self._client = None
+            self._fd = os.open(self.ports.ports[1], os.O_RDWR | os.O_NOCTTY)
+            tty.setraw(self._fd)
+        else:
+            raise ValueError("Unknown benchmark transport " + str(transport))
+
+        # The link is not paced, the benchmarks measure the emulator itself
+        self.emulator = BioCamEmulator(
+            pacer=make_pacer("unlimited"),
+            seed=0,
+            summaries=summaries,
+            transport=emulator_transport,
+            verbose=False,
+        )
+        self.emulator.compute_summaries_delay = 0
+        self.emulator.get_summaries_delay = 0
+        self.emulator.start()
+        self._thread = threading.Thread(
+            target=self.emulator.loop.run_forever, name="bench", daemon=True
+        )
+        self._thread.start()
+        self._buffer = b""
+
+    def call(self, callback):
+        """Run callback on the event loop thread and return its result."""
+
+        result = []
+        done = threading.Event()
+
+        def run():
+            result.append(callback())
+            done.set()
+
+        self.emulator.loop.call_soon_threadsafe(run)
+        if not done.wait(RESPONSE_TIMEOUT):
+            raise TimeoutError("the event loop did not answer")
+        return result[0]
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view) :]
+
+    def _read(self, deadline):
+        timeout = deadline - time.perf_counter()
+        if timeout <= 0 or not select.select([self._fd], [], [], timeout)[0]:
+            raise TimeoutError("no response from the emulator")
+        return os.read(self._fd, 65536)
+
+    def readline(self, timeout=RESPONSE_TIMEOUT):
+        """Next line received, without the newline."""
+
+        deadline = time.perf_counter() + timeout
+        while b"\n" not in self._buffer:
+            self._buffer += self._read(deadline)
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+    def read_until(self, marker, timeout=RESPONSE_TIMEOUT):
+        """Read up to and including marker, return the number of bytes read."""
+
+        deadline = time.perf_counter() + timeout
+        size = 0
+        tail = self._buffer
+        self._buffer = b""
+        while True:
+            end = tail.find(marker)
+            if end >= 0:
+                end += len(marker)
+                self._buffer = tail[end:]
+                return size + end
+            keep = len(marker) - 1
+            size += max(0, len(tail) - keep)
+            tail = tail[-keep:] + self._read(deadline)
+
+    def close(self):
+        self.emulator.loop.stop()
+        self._thread.join()
+        self.emulator.close()
+        if self._client is None:
+            os.close(self._fd)
+        if self.ports is not None:
+            self.ports.stop()
+            self.ports.close()
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    ]
+
+
+def bench_ack_latency(transport="memory", count=5000, warmup=200):
+    """Round trip of a command to its acknowledgement, one at a time."""
+
+    link = BenchLink(transport)
+    latencies = []
+    try:
+        for i in range(warmup + count):
+            start = time.perf_counter()
+            link.write(COMMANDS[i % 2])
+            while not link.readline().startswith(b"$bc"):
+                pass
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        link.close()
+    latencies.sort()
+    return {
+        "count": count,
+        "mean_us": statistics.fmean(latencies) * 1e6,
+        "p50_us": _percentile(latencies, 0.50) * 1e6,
+        "p95_us": _percentile(latencies, 0.95) * 1e6,
+        "p99_us": _percentile(latencies, 0.99) * 1e6,
+        "max_us": latencies[-1] * 1e6,
+        "acks_per_second": count / sum(latencies),
+    }
+
+
+def _nav_lines(first, count):
+    return b"".join(
+        b"nav %d %d depth 12.500\n" % (t, t) for t in range(first, first + count)
+    )
+
+
+def bench_nav_ingest(
+    transport="memory", step_time=1.0, start_rate=1000, max_rate=1024000, grace=0.2
+):
+    """Highest nav rate the emulator keeps up with.
+
+    The rate doubles every step_time seconds. A step is sustained when the lines
+    are sent at the target rate and all of them are processed within grace
+    seconds of the end of the step. Writes on the vehicle side block when the
+    link is full, so lines are never dropped on the way: a rate that is not
+    sustained shows up as lines processed late, or as the sender held back.
+    """
+
+    link = BenchLink(transport)
+    first_time = 1_700_000_000_000
+    steps = []
+    total = 0
+    try:
+        # Loads NumPy and the nav ingest before the first step
+        link.call(lambda: link.emulator.nav)
+        rate = start_rate
+        while rate <= max_rate:
+            count = int(rate * step_time)
+            data = _nav_lines(first_time + total, count)
+            line_size = len(data) // count
+            sent = 0
+            start = time.perf_counter()
+            while sent < count:
+                due = min(count, int((time.perf_counter() - start) * rate) + 1)
+                if due > sent:
+                    link.write(data[sent * line_size : due * line_size])
+                    sent = due
+                else:
+                    time.sleep(0.0005)
+            send_time = time.perf_counter() - start
+            total += count
+            deadline = time.perf_counter() + grace
+            while True:
+                received = link.call(lambda: sum(link.emulator.nav.received.values()))
+                if received >= total or time.perf_counter() > deadline:
+                    break
+                time.sleep(0.001)
+            step = {
+                "rate": rate,
+                "lines": count,
+                "sent_per_second": count / send_time,
+                "late_lines": total - received,
+                "sustained": (received >= total and count / send_time >= 0.9 * rate),
+            }
+            steps.append(step)
+            if not step["sustained"]:
+                break
+            rate *= 2
+        # The lines of the last step may still be in flight, count them once
+        # they are all processed
+        deadline = time.perf_counter() + RESPONSE_TIMEOUT
+        while True:
+            accepted, errors = link.call(
+                lambda: (
+                    sum(link.emulator.nav.accepted.values()),
+                    sum(link.emulator.nav.errors.values()),
+                )
+            )
+            if accepted + errors >= total or time.perf_counter() > deadline:
+                break
+            time.sleep(0.001)
+    finally:
+        link.close()
+    sustained = [s["rate"] for s in steps if s["sustained"]]
+    return {
+        "max_sustained_lines_per_second": max(sustained, default=0),
+        "lines": total,
+        "accepted": accepted,
+        "errors": errors,
+        "steps": steps,
+    }
+
+
+def bench_summary_throughput(transport="memory", summaries=2000, repeats=5):
+    """Transfer of all the summaries, from the request to "summary done"."""
+
+    from .synthetic import SyntheticSummaries
+
+    link = BenchLink(transport, summaries=SyntheticSummaries(summaries, seed=0))
+    durations = []
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            link.write(b"*bc_start_summaries -1 -1\n")
+            size = link.read_until(SUMMARY_DONE, timeout=60.0)
+            durations.append(time.perf_counter() - start)
+    finally:
+        link.close()
+    best = min(durations)
+    median = statistics.median(durations)
+    return {
+        "summaries": summaries,
+        "bytes": size,
+        "repeats": repeats,
+        "best_bytes_per_second": size / best,
+        "median_bytes_per_second": size / median,
+        "median_summaries_per_second": summaries / median,
+    }
+
+
+def bench_outbox_drain(messages=200000, budget=4096):
+    """Put and drain rates of the outbox, in budget bytes batches as paced."""
+
+    sizes = (16, 64, 120, 2000)
+    payloads = [b"x" * (sizes[i % len(sizes)] - 1) + b"\n" for i in range(messages)]
+    outbox = MessageOutbox()
+    start = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        outbox.put(payload, i % len(PRIORITY_NAMES))
+    put_time = time.perf_counter() - start
+    drained = 0
+    batches = 0
+    start = time.perf_counter()
+    while len(outbox):
+        drained += sum(len(m) for m in outbox.drain(budget, force_first=True))
+        batches += 1
+    drain_time = time.perf_counter() - start
+    return {
+        "messages": messages,
+        "bytes": drained,
+        "batches": batches,
+        "put_messages_per_second": messages / put_time,
+        "drain_messages_per_second": messages / drain_time,
+        "drain_bytes_per_second": drained / drain_time,
+    }
+
+
+def _rss():
+    """Resident memory of this process in bytes."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # Peak rather than current, in kilobytes on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _open_fds():
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return None
+
+
+def _warm_up(emulator):
+    # Creates what a running emulator holds: nav buffers and status telemetry
+    emulator.nav
+    emulator.report_status()
+
+
+def _scaling_run(num_emulators):
+    from .fleet import BioCamFleet
+
+    rss = _rss()
+    threads = threading.active_count()
+    fds = _open_fds()
+    fleet = BioCamFleet(num_emulators, link="unlimited", seed=0)
+    fleet.start()
+    thread = threading.Thread(target=fleet.loop.run_forever, daemon=True)
+    thread.start()
+    for emulator in fleet.emulators:
+        fleet.loop.call_soon_threadsafe(_warm_up, emulator)
+    time.sleep(0.2)
+    result = {
+        "instances": num_emulators,
+        "rss_bytes": _rss(),
+        "rss_per_instance_bytes": (_rss() - rss) / num_emulators,
+        "threads": threading.active_count(),
+        "added_threads": threading.active_count() - threads,
+        "open_fds": _open_fds(),
+        "added_open_fds": None if fds is None else _open_fds() - fds,
+    }
+    fleet.loop.stop()
+    thread.join()
+    fleet.close()
+    return result
+
+
+def bench_scaling(sizes=(1, 10, 100)):
+    """Memory, threads and open files of fleets of growing size, each one
+    measured in a new process."""
+
+    results = {}
+    for size in sizes:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[str(size)] = pool.submit(_scaling_run, size).result()
+    return results
+
+
+def run_benchmarks(names=BENCHMARKS, transports=BENCH_TRANSPORTS, quick=False):
+    """Run the benchmarks and return the results as a JSON compatible dict."""
+
+    settings = SETTINGS["quick" if quick else "full"]
+    results = {}
+    for name in names:
+        print("Running", name, file=sys.stderr)
+        if name == "ack_latency":
+            results[name] = {
+                t: bench_ack_latency(t, count=settings["ack_count"]) for t in transports
+            }
+        elif name == "nav_ingest":
+            results[name] = {
+                t: bench_nav_ingest(
+                    t,
+                    step_time=settings["nav_step_time"],
+                    max_rate=settings["nav_max_rate"],
+                )
+                for t in transports
+            }
+        elif name == "summary_throughput":
+            results[name] = {
+                t: bench_summary_throughput(
+                    t,
+                    summaries=settings["summaries"],
+                    repeats=settings["summary_repeats"],
+                )
+                for t in transports
+            }
+        elif name == "outbox_drain":
+            results[name] = bench_outbox_drain(settings["outbox_messages"])
+        elif name == "scaling":
+            results[name] = bench_scaling(settings["scaling_sizes"])
+        else:
+            raise ValueError("Unknown benchmark " + name)
+    return {
+        "version": BENCHMARK_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            k: list(v) if isinstance(v, tuple) else v for k, v in settings.items()
+        },
+        "results": results,
+    }
+
+
+def flatten(results, prefix=""):
+    """Numeric metrics of nested results, keyed by dotted path."""
+
+    metrics = {}
+    for key, value in results.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            metrics.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = value
+    return metrics
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare the metrics of two runs.
+
+    :param results: results of run_benchmarks()
+    :param baseline: results of a previous run
+    :param tolerance: fraction by which a metric may get worse
+    :return: list of comparisons of the metrics present in both runs
+    """
+
+    current = flatten(results["results"])
+    previous = flatten(baseline["results"])
+    comparisons = []
+    for name in sorted(current.keys() & previous.keys()):
+        if name.endswith(REPORT_ONLY):
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            higher_is_better = True
+        elif name.endswith(LOWER_IS_BETTER):
+            higher_is_better = False
+        else:
+            continue
+        old, new = previous[name], current[name]
+        if old == 0:
+            change = 0.0 if new == 0 else float("inf")
+        else:
+            change = (new - old) / abs(old)
+        worse = -change if higher_is_better else change
+        comparisons.append(
+            {
+                "metric": name,
+                "baseline": old,
+                "value": new,
+                "change": change,
+                "regression": worse > tolerance,
+            }
+        )
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BioCam emulator")
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=list(BENCHMARKS),
+        help="benchmarks to run (default: all)",
+    )
+    parser.add_argument(
+        "--transport",
+        nargs="+",
+        choices=BENCH_TRANSPORTS,
+        default=list(BENCH_TRANSPORTS),
+        help="links to drive the emulator through (default: memory pty)",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations, e.g. for CI"
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="write the results to this file"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=None,
+        help="results of a previous run to compare with",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fraction by which a metric may get worse than the baseline "
+        "(default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.transport, quick=args.quick)
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        results["comparison"] = compare(results, baseline, args.tolerance)
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + "\n")
+        print("Results written to", args.output, file=sys.stderr)
+
+    regressions = [c for c in results.get("comparison", []) if c["regression"]]
+    for c in results.get("comparison", []):
+        print(
+            "%-60s %14.4g %14.4g %+7.1f%%%s"
+            % (
+                c["metric"],
+                c["baseline"],
+                c["value"],
+                100 * c["change"],
+                "  REGRESSION" if c["regression"] else "",
+            ),
+            file=sys.stderr,
+        )
+    if regressions:
+        print(len(regressions), "regressions", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
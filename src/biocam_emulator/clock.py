@@ -0,0 +1,53 @@
+"""
+Virtual mission clock
+
+The emulator runs on a virtual clock that can go faster than real time, so
+that a whole mission (days of status reports, time requests and summaries) can
+be emulated in minutes. All the delays and periods of the emulator are given in
+virtual seconds.
+"""
+
+import time
+
+
+class VirtualClock:
+    def __init__(self, time_scale=1.0, start_time=None):
+        """Clock running time_scale times faster than real time.
+
+        :param time_scale: virtual seconds per real second, e.g. 1000
+        :param start_time: virtual epoch time in seconds at creation, defaults
+            to the current system time
+        """
+
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive")
+        self.time_scale = float(time_scale)
+        self._real_start = time.monotonic()
+        if start_time is None:
+            start_time = time.time()
+        self.start_time = start_time
+
+    def monotonic(self):
+        """Virtual seconds elapsed since the clock was created."""
+
+        return (time.monotonic() - self._real_start) * self.time_scale
+
+    def time(self):
+        """Virtual epoch time in seconds."""
+
+        return self.start_time + self.monotonic()
+
+    def time_ms(self):
+        """Virtual epoch time in milliseconds, as used by the protocol."""
+
+        return int(self.time() * 1000)
+
+    def to_real(self, seconds):
+        """Convert a virtual duration to real seconds."""
+
+        return seconds / self.time_scale
+
+    def to_virtual(self, seconds):
+        """Convert a real duration to virtual seconds."""
+
+        return seconds * self.time_scale
@@ -0,0 +1,273 @@
+"""
+Columnar data log
+
+Records what the emulator received and sent (nav samples, status reports and
+summary transfer events) for post-run analysis. Rows are handed over to a
+background thread, which writes them in columnar chunks, so logging never
+delays the event loop:
+
+    DIRECTORY/TABLE-SEGMENT-CHUNK.npz       (NumPy, one array per column)
+    DIRECTORY/TABLE-SEGMENT.parquet         (Parquet, one row group per chunk)
+
+A chunk is written every flush_interval seconds, and a new segment is started
+every rotate_interval seconds. load_log() reads a whole run back at once.
+
+The queue to the writer thread is bounded: rows handed over while it is full are
+dropped and counted in rows_dropped. If the writer thread fails (e.g. the disk
+is full), it prints a warning and logging stops, the rows handed over after that
+are dropped too, and the error is raised by close().
+"""
+
+import queue
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+LOG_FORMATS = ("auto", "npz", "parquet")
+
+_STOP = object()
+
+
+class DataLogException(Exception):
+    """Exceptions raised from this module."""
+
+
+def _columns(records):
+    """Flatten a NumPy structured array to a dict of 1D columns."""
+
+    columns = {}
+    for name in records.dtype.names:
+        column = records[name]
+        if column.ndim == 1:
+            columns[name] = column
+        else:
+            for i in range(column.shape[1]):
+                columns[name + "_" + str(i)] = column[:, i]
+    return columns
+
+
+class ColumnarLogWriter:
+    def __init__(
+        self,
+        directory,
+        log_format="auto",
+        flush_interval=10.0,
+        rotate_interval=3600.0,
+        max_chunk_rows=65536,
+        max_queue=65536,
+    ):
+        """Streaming columnar writer running in its own thread.
+
+        :param directory: output directory, created if needed
+        :param log_format: npz, parquet (needs pyarrow) or auto (parquet when
+            available)
+        :param flush_interval: seconds between chunk writes
+        :param rotate_interval: seconds between new segments
+        :param max_chunk_rows: rows of a table that trigger an early write
+        :param max_queue: batches and rows waiting for the writer thread
+        """
+
+        if log_format not in LOG_FORMATS:
+            raise ValueError("Unknown log format " + str(log_format))
+        if log_format == "auto":
+            log_format = "npz" if pa is None else "parquet"
+        if log_format == "parquet" and pa is None:
+            raise ValueError("The parquet log format needs pyarrow")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.log_format = log_format
+        self.flush_interval = flush_interval
+        self.rotate_interval = rotate_interval
+        self.max_chunk_rows = max_chunk_rows
+
+        self.rows_written = 0
+        self.chunks_written = 0
+        self.rows_dropped = 0
+
+        self._queue = queue.Queue(max_queue)
+        self._error = None
+        self._tables = {}
+        self._pending_rows = {}
+        self._segment = 0
+        self._chunk = {}
+        self._parquet_writers = {}
+        self._thread = Thread(target=self._run, name="datalog", daemon=True)
+        self._thread.start()
+
+    def append(self, table, records):
+        """Queue a NumPy structured array of rows. Can be called from any thread."""
+
+        self._put(table, records, len(records))
+
+    def append_row(self, table, **row):
+        """Queue a single row given as column=value keywords."""
+
+        self._put(table, row, 1)
+
+    def _put(self, table, rows, num_rows):
+        if self._error is not None:
+            self.rows_dropped += num_rows
+            return
+        try:
+            self._queue.put_nowait((table, rows))
+        except queue.Full:
+            self.rows_dropped += num_rows
+
+    def close(self):
+        """Write the pending rows and stop the writer thread.
+
+        Raises DataLogException if the writer thread failed.
+        """
+
+        if self._thread is None:
+            return
+        # The writer thread stops at the marker, or has stopped on an error
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise DataLogException("The data log writer failed") from self._error
+
+    def _run(self):
+        try:
+            self._serve()
+        except Exception as e:
+            self._error = e
+            print(
+                "Data log writer failed, logging stopped: " + repr(e), file=sys.stderr
+            )
+
+    def _serve(self):
+        next_flush = time.monotonic() + self.flush_interval
+        next_rotate = time.monotonic() + self.rotate_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                table, rows = item
+                self._tables.setdefault(table, []).append(rows)
+                num_rows = self._pending_rows.get(table, 0)
+                num_rows += len(rows) if isinstance(rows, np.ndarray) else 1
+                self._pending_rows[table] = num_rows
+                if num_rows >= self.max_chunk_rows:
+                    self._write_table(table)
+            now = time.monotonic()
+            if now >= next_flush:
+                self._write_all()
+                next_flush = now + self.flush_interval
+            if now >= next_rotate:
+                self._rotate()
+                next_rotate = now + self.rotate_interval
+        self._write_all()
+        self._close_parquet()
+
+    def _rotate(self):
+        self._write_all()
+        self._close_parquet()
+        self._segment += 1
+        self._chunk = {}
+
+    def _write_all(self):
+        for table in list(self._tables):
+            self._write_table(table)
+
+    def _write_table(self, table):
+        pending = self._tables.pop(table, None)
+        self._pending_rows.pop(table, None)
+        if not pending:
+            return
+        columns = self._merge(pending)
+        num_rows = len(next(iter(columns.values())))
+        if num_rows == 0:
+            return
+        if self.log_format == "npz":
+            chunk = self._chunk.get(table, 0)
+            self._chunk[table] = chunk + 1
+            path = self.directory / "{}-{:05d}-{:05d}.npz".format(
+                table, self._segment, chunk
+            )
+            np.savez(path, **columns)
+        else:
+            arrow_table = pa.table(columns)
+            writer = self._parquet_writers.get(table)
+            if writer is None:
+                path = self.directory / "{}-{:05d}.parquet".format(table, self._segment)
+                writer = pq.ParquetWriter(path, arrow_table.schema)
+                self._parquet_writers[table] = writer
+            writer.write_table(arrow_table)
+        self.rows_written += num_rows
+        self.chunks_written += 1
+
+    @staticmethod
+    def _merge(pending):
+        arrays = [p for p in pending if isinstance(p, np.ndarray)]
+        rows = [p for p in pending if isinstance(p, dict)]
+        columns = {}
+        if arrays:
+            for name, column in _columns(np.concatenate(arrays)).items():
+                columns[name] = column
+        if rows:
+            for name in rows[0]:
+                column = np.array([row[name] for row in rows])
+                if name in columns:
+                    column = np.concatenate((columns[name], column))
+                columns[name] = column
+        return columns
+
+    def _close_parquet(self):
+        for writer in self._parquet_writers.values():
+            writer.close()
+        self._parquet_writers = {}
+
+
+def load_log(directory):
+    """Load a whole data log.
+
+    Returns a dict of table name to dict of column name to NumPy array, with
+    the rows of all the segments and chunks in writing order.
+    """
+
+    directory = Path(directory)
+    parts = {}
+    for path in sorted(directory.glob("*.npz")) + sorted(directory.glob("*.parquet")):
+        if path.suffix == ".npz":
+            table = path.stem.rsplit("-", 2)[0]
+            with np.load(path) as data:
+                columns = {name: data[name] for name in data.files}
+        else:
+            if pq is None:
+                raise ValueError("Loading parquet logs needs pyarrow")
+            table = path.stem.rsplit("-", 1)[0]
+            arrow_table = pq.read_table(path)
+            columns = {
+                name: arrow_table.column(name).to_numpy()
+                for name in arrow_table.column_names
+            }
+        parts.setdefault(table, []).append(columns)
+
+    log = {}
+    for table, chunks in parts.items():
+        log[table] = {
+            name: np.concatenate([chunk[name] for chunk in chunks])
+            for name in chunks[0]
+        }
+    return log
@@ -7,14 +7,38 @@ This script simulates the BioCam command interface. It is intended to be used as
 a testbed for the BioCam serial interface.
 """
 
+import argparse
+import hashlib
+import os
 import time
 from pathlib import Path
-from threading import Event, Thread, Timer
 
-import numpy as np
-import serial
+from .clock import VirtualClock
+from .event_loop import EventLoop
+from .framing import LineFramer
+from .outbox import (
+    PRIORITY_ACK,
+    PRIORITY_STATUS,
+    PRIORITY_SUMMARY,
+    PRIORITY_TIME,
+    MessageOutbox,
+)
+from .pacing import LINK_PRESETS, make_pacer
+from .recorder import INBOUND, OUTBOUND, TrafficRecorder
+from .transfer import SummaryTransfer
+from .transports import PtyTransport, TcpServerTransport
 
-from .virtual_serial_ports import VirtualSerialPorts
+# With a link stage, the classes sent through it and those written to the port
+# straight away: acknowledgements and time requests stay on the serial line
+STAGED_PRIORITIES = (PRIORITY_STATUS, PRIORITY_SUMMARY)
+DIRECT_PRIORITIES = (PRIORITY_TIME, PRIORITY_ACK)
+
+# Summary IDs are two digits
+NUM_SUMMARY_IDS = 100
+
+# NumPy and the optional features (archives, synthetic summaries, data log,
+# Iridium model, metrics server) are imported when first used, so that the
+# port is ready in a few tens of milliseconds.
 
 """
 Maybe use state 9 and 10 as computing and sending.
@@ -35,7 +59,19 @@ state 10 for sending the summaries + 4 if laser is armed
 class BioCamStateMachine:
     def __init__(self, laser_armed=False):
         self.laser_armed = laser_armed
-        self.idle()
+        self.listeners = []
+        self._state = 1
+
+    def add_listener(self, callback):
+        """Call callback(old_state, new_state) on every state change"""
+        self.listeners.append(callback)
+
+    def _set_state(self, state):
+        old_state = self.state
+        self._state = state
+        if self.state != old_state:
+            for callback in self.listeners:
+                callback(old_state, self.state)
 
     @property
     def state(self):
@@ -49,82 +85,286 @@ class BioCamStateMachine:
             return 0
 
     def start_mapping(self):
-        self._state = 4
+        self._set_state(4)
 
     def camera_calibration(self):
-        self._state = 2
+        self._set_state(2)
 
     def laser_calibration(self):
-        self._state = 3
+        self._set_state(3)
 
     def start_summaries(self):
-        self._state = 9
+        self._set_state(9)
 
     def sending_summaries(self):
-        self._state = 10
+        self._set_state(10)
 
     def idle(self):
-        self._state = 1
+        self._set_state(1)
 
     def stop(self):
-        self._state = 0
+        self._set_state(0)
 
 
 class RemoteAwarenessData:
-    def __init__(self, input_folder):
-        self.input_folder = input_folder
-        self.load_data()
+    """Summaries BioCam can send.
+
+    The summaries come from a folder of hex text files, from a packed summary
+    archive (see archive.py) or from any object with the same interface as
+    SummaryArchive, e.g. SyntheticSummaries. Text folders are loaded once and
+    every entry is kept as the ready to send line "summary NN HEX\n" in bytes,
+    so sending a summary does not need any file access or encoding. Other
+    sources are only hex-encoded when sent, unless preload is set. The order of
+    the entries is shuffled with a seeded generator, pass the same seed to get
+    the same order.
+
+    IDs are the entry index, zero padded to two digits. With wrap_ids they roll
+    over from 99 to 00, as the protocol only allows two digits. By default only
+    the IDs of synthetic summaries wrap, and more than 100 synthetic summaries
+    with wrap_ids False is an error.
+
+    With lazy, nothing is read until a summary (or their number) is first
+    asked for.
+    """
+
+    def __init__(
+        self,
+        input_folder,
+        seed=None,
+        preload=None,
+        shuffle=True,
+        wrap_ids=None,
+        lazy=False,
+    ):
+        if isinstance(input_folder, (str, Path)):
+            self.input_folder = Path(input_folder)
+            self.source = None
+        else:
+            self.input_folder = None
+            self.source = input_folder
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), "little")
+        self.seed = seed
+        self.preload = preload
+        self.shuffle = shuffle
+        synthetic = False
+        if self.source is not None:
+            from .synthetic import SyntheticSummaries
+
+            synthetic = isinstance(self.source, SyntheticSummaries)
+        if wrap_ids is None:
+            wrap_ids = synthetic
+        elif synthetic and not wrap_ids and len(self.source) > NUM_SUMMARY_IDS:
+            raise ValueError(
+                "%d synthetic summaries need IDs above %d, wrap them"
+                % (len(self.source), NUM_SUMMARY_IDS - 1)
+            )
+        self.wrap_ids = wrap_ids
+        self._digests = None
+        # Entries, set by load_data()
+        self.data = None
+        self.sizes = None
+        self.payloads = None
+        self.lines = None
+        if not lazy:
+            self.load_data()
+
+    def _ensure_loaded(self):
+        if self.data is None:
+            self.load_data()
 
     def load_data(self):
+        import numpy as np
+
+        rng = np.random.default_rng(self.seed)
+        if self.input_folder is not None and self.input_folder.is_dir():
+            self._load_text_folder(rng)
+            return
+        if self.source is None:
+            from .archive import SummaryArchive
+
+            self.source = SummaryArchive(self.input_folder)
+        # Randomly sort the source entries in self.data
+        if self.shuffle:
+            self.data = rng.permutation(len(self.source))
+        else:
+            self.data = np.arange(len(self.source))
+        self.sizes = np.asarray(self.source.sizes)[self.data].astype(np.int64)
+        self.payloads = None
+        self.lines = None
+        if self.preload:
+            self.lines = [self._build_line(i) for i in range(len(self.data))]
+
+    def _load_text_folder(self, rng):
+        import numpy as np
+
         # Find all the files starting with "image_summary_XXX.txt" where XXX is a number
         self.image_summary_files = sorted(self.input_folder.glob("image_summary_*.txt"))
         self.representative_image_files = sorted(
             self.input_folder.glob("representative_image_*.txt")
         )
+        files = self.image_summary_files + self.representative_image_files
         # Randomly sort the files in self.data
-        self.data = np.random.permutation(
-            self.image_summary_files + self.representative_image_files
-        )
+        if self.shuffle:
+            files = [files[i] for i in rng.permutation(len(files))]
+        self.data = files
+
+        # Hex payloads, without the trailing newline
+        self.payloads = [path.read_bytes().strip() for path in self.data]
+        # Size of the raw (decoded) summaries in bytes
+        self.sizes = np.array([len(p) // 2 for p in self.payloads], dtype=np.int64)
+        self.lines = None
+        if self.preload is None or self.preload:
+            self.lines = [self._build_line(i) for i in range(len(self.data))]
+
+    def _hex(self, idx):
+        if self.payloads is not None:
+            return self.payloads[idx]
+        return self.source.hex(self.data[idx])
+
+    def summary_id(self, idx):
+        if self.wrap_ids:
+            return idx % NUM_SUMMARY_IDS
+        return idx
+
+    def _build_line(self, idx):
+        return b"summary %02d %s\n" % (self.summary_id(idx), self._hex(idx))
 
     def len(self):
+        self._ensure_loaded()
         return len(self.data)
 
-    def get(self, idx):
-        # Try opening the file
-        with open(self.data[idx], "r") as f:
-            # Read the file
-            data = f.read()
-        return data
+    def line(self, idx):
+        """Encoded "summary NN HEX\\n" line for summary idx"""
+        self._ensure_loaded()
+        if self.lines is not None:
+            return self.lines[idx]
+        return self._build_line(idx)
+
+    def raw(self, idx):
+        """Decoded bytes of summary idx"""
+        self._ensure_loaded()
+        if self.payloads is not None:
+            return bytes.fromhex(self.payloads[idx].decode("ascii"))
+        return bytes(self.source.raw(self.data[idx]))
+
+    def digest(self, idx):
+        """sha256 hex digest of the decoded bytes of summary idx"""
+        if self._digests is not None:
+            return self._digests[idx]
+        return hashlib.sha256(self.raw(idx)).hexdigest()
+
+    @property
+    def digests(self):
+        """sha256 hex digests of all the summaries, computed on first use"""
+        if self._digests is None:
+            self._digests = [self.digest(i) for i in range(self.len())]
+        return self._digests
+
+    @property
+    def content_hash(self):
+        """sha256 over the digests of all the summaries, in sending order"""
+        store_hash = hashlib.sha256()
+        for digest in self.digests:
+            store_hash.update(bytes.fromhex(digest))
+        return store_hash.hexdigest()
 
 
 class BioCamCommand:
-    def __init__(self, command, response=None, num_arguments=0):
-        self.command = "*" + command + "\n"
+    def __init__(self, command, response=None, num_arguments=0, handler=None):
+        """Command to BioCam and its acknowledgement.
+
+        :param command: command name, without the leading *
+        :param response: acknowledgement, "$" + command by default
+        :param num_arguments: number of arguments, -1 for any number
+        :param handler: called with the list of arguments when the command is
+            received, applies its effect on the emulator
+        """
+        self.name = command
+        self.verb = "*" + command
+        self.command = self.verb + "\n"
         self.response = "$" + command + "\n"
         self.num_arguments = num_arguments
         self.arguments = []
+        self.handler = handler
         if response is not None:
             self.response = response
 
-    def check_and_reply(self, command):
+    def reply(self, arguments):
+        """Acknowledgement for the given arguments, None if they are invalid"""
         if self.num_arguments == 0:
-            if command == self.command:
-                return self.response
+            if arguments:
+                return None
+            return self.response
+        if len(arguments) != self.num_arguments and self.num_arguments != -1:
             return None
-        split_command = command.split(" ")
-        if len(split_command) != (self.num_arguments + 1) and self.num_arguments != -1:
+        return self.response[:-1] + " " + " ".join(arguments) + "\n"
+
+    def dispatch(self, arguments):
+        """Acknowledge the command and run its handler"""
+        response = self.reply(arguments)
+        if response is None:
             return None
-        self.arguments = split_command[1:]
-        # Remove \n from the end
-        if len(self.arguments) > 0:
-            if self.arguments[-1].endswith("\n"):
-                self.arguments[-1] = self.arguments[-1].replace("\n", "")
-        return self.response[:-1] + " " + " ".join(split_command[1:]) + "\n"
+        self.arguments = arguments
+        if self.handler is not None:
+            self.handler(arguments)
+        return response
 
 
 class BioCamEmulator:
-    def __init__(self):
-        print("Starting BioCam emulator")
+    def __init__(
+        self,
+        pacer=None,
+        seed=None,
+        summaries=None,
+        wrap_ids=None,
+        clock=None,
+        loop=None,
+        transport=None,
+        remote_awareness_data=None,
+        verbose=True,
+        datalog=None,
+        recorder=None,
+        link_stage=None,
+        telemetry=None,
+        lazy_summaries=False,
+        start_on_attach=False,
+    ):
+        """BioCam emulator instance.
+
+        :param pacer: link pacer, RS232 57600 8N1 by default
+        :param seed: seed used to shuffle the summaries
+        :param summaries: folder, archive or source of the summaries to send
+        :param wrap_ids: roll summary IDs over from 99 to 00, by default only
+            for synthetic summaries
+        :param clock: VirtualClock of the mission, the clock of loop if given
+        :param loop: EventLoop to run on, can be shared by several emulators
+        :param transport: Transport to the vehicle, a new pty pair by default
+        :param remote_awareness_data: summary store, can be shared by several
+            emulators (summaries, seed and wrap_ids are then ignored)
+        :param verbose: print every message received and sent
+        :param datalog: ColumnarLogWriter recording nav, status and summary
+            transfers, closed with the emulator
+        :param recorder: TrafficRecorder capturing every frame received and
+            sent, closed with the emulator
+        :param link_stage: IridiumLink the summaries and status reports go
+            through before reaching the port
+        :param telemetry: StatusTelemetry drawing the status values, seeded
+            with the seed of the summaries by default
+        :param lazy_summaries: load the summaries when first asked for rather
+            than before the port is opened
+        :param start_on_attach: start the periodic tasks (image counters,
+            status and time requests) once the vehicle side is attached, i.e.
+            a TCP client connects or the first bytes are received, rather than
+            when the port is opened
+
+        Nothing runs until start() is called, or run() for a standalone
+        emulator that owns its event loop.
+        """
+        self._created_at = time.perf_counter()
+        self.startup_time = None
+        self.verbose = verbose
+        self.log("Starting BioCam emulator")
 
         self.num_images_cam0 = 0
         self.num_images_cam1 = 0
@@ -134,112 +374,344 @@ class BioCamEmulator:
         self.cam0_temperature = 0
         self.cam1_temperature = 0
         self.available_disk_space = 0
-        self.stop_thread = False
 
-        self.message_outbox = []
-        self.message_inbox = ""
+        self.message_outbox = MessageOutbox()
+        self.framer = LineFramer()
+        # Mission clock, all the periods and delays below are in its seconds
+        self._owns_loop = loop is None
+        if loop is None:
+            loop = EventLoop(clock=clock)
+        self.loop = loop
+        self.clock = loop.clock
+        # Outbound traffic is paced to the RS232 link unless told otherwise
+        if pacer is None:
+            pacer = make_pacer("rs232", clock=self.clock.monotonic)
+        self.pacer = pacer
+        self._flush_timer = None
 
-        # Get this file folder
-        input_folder = Path(__file__).parent / "data"
-        self.remote_awareness_data = RemoteAwarenessData(input_folder)
+        if remote_awareness_data is None:
+            # Summaries folder or archive, the bundled data folder by default
+            if summaries is None:
+                summaries = Path(__file__).parent / "data"
+            shuffle = True
+            if not isinstance(summaries, (str, Path)):
+                from .synthetic import SyntheticSummaries
+
+                shuffle = not isinstance(summaries, SyntheticSummaries)
+            remote_awareness_data = RemoteAwarenessData(
+                summaries,
+                seed=seed,
+                shuffle=shuffle,
+                wrap_ids=wrap_ids,
+                lazy=lazy_summaries,
+            )
+        self.remote_awareness_data = remote_awareness_data
+        if lazy_summaries:
+            self.log(
+                "Summaries loaded on first use (seed "
+                + str(self.remote_awareness_data.seed)
+                + ")"
+            )
+        else:
+            self.log(
+                "Loaded",
+                self.remote_awareness_data.len(),
+                "summaries (seed " + str(self.remote_awareness_data.seed) + ")",
+            )
 
         self.report_status_period = 60  # every 60 seconds
         self.request_time_period = 600  # every 10 minutes
-        self.state_thread_event = Event()
+        self.image_counters_period = 3  # every 3 seconds
+        self.compute_summaries_delay = 20  # before sending *bc_start_summaries
+        self.get_summaries_delay = 5  # before sending *bc_get_summaries
+        self.start_on_attach = start_on_attach
+        self.image_counters_timer = None
+        self.status_timer = None
+        self.time_timer = None
+
+        self.transport = transport
+        self.datalog = datalog
+        self.recorder = recorder
+        self.link_stage = link_stage
+        # Created on first use, they need NumPy
+        self._telemetry = telemetry
+        self._timesync = None
+        self._nav = None
+        self._received_at = 0.0
 
-        self.state_thread = Thread(
-            target=self.state_thread_fn, args=(self.state_thread_event,)
+        # Verb to handler, nav data and time replies are not acknowledged
+        self.dispatch_table = {"nav": self.on_nav, "*time": self.on_time}
+        self.verb_counts = {}
+        self.commands = []
+        for command in (
+            BioCamCommand("bc_start_mapping", handler=self.on_start_mapping),
+            BioCamCommand("bc_stop_acquisition", handler=self.on_stop_acquisition),
+            BioCamCommand(
+                "bc_start_camera_calibration",
+                handler=self.on_start_camera_calibration,
+            ),
+            BioCamCommand(
+                "bc_start_laser_calibration", handler=self.on_start_laser_calibration
+            ),
+            BioCamCommand("bc_shutdown", handler=self.on_shutdown),
+            BioCamCommand(
+                "bc_start_summaries", num_arguments=2, handler=self.on_start_summaries
+            ),
+            BioCamCommand(
+                "bc_get_summaries", num_arguments=-1, handler=self.on_get_summaries
+            ),
+            BioCamCommand("bc_stop_summaries", handler=self.on_stop_summaries),
+        ):
+            self.register_command(command)
+
+        self.summary_transfer = SummaryTransfer(
+            self.remote_awareness_data,
+            self.message_outbox,
+            self.loop,
+            self.flush_outbox,
+            listener=self.on_summary_transfer,
         )
-        self.status_timer_thread = Timer(self.report_status_period, self.report_status)
-        self.time_timer_thread = Timer(self.request_time_period, self.request_time)
+        self.mode = BioCamStateMachine()
+        self.state_transitions = {}
+        self.mode.add_listener(self.on_mode_change)
 
-        self.ports = VirtualSerialPorts(2, loopback=False, debug=True)
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
 
-        self.commands = [
-            BioCamCommand("bc_start_mapping"),
-            BioCamCommand("bc_stop_acquisition"),
-            BioCamCommand("bc_start_laser_calibration"),
-            BioCamCommand("bc_shutdown"),
-            BioCamCommand("bc_start_summaries", num_arguments=2),
-            BioCamCommand("bc_get_summaries", num_arguments=-1),
-            BioCamCommand("bc_stop_summaries"),
-        ]
+    @property
+    def port(self):
+        """Name of the port the vehicle side connects to"""
+        return self.transport.port
 
-        self.mode = BioCamStateMachine()
-        self.mode.idle()
+    @property
+    def telemetry(self):
+        """StatusTelemetry, seeded with the seed of the summaries and stepping at
+        the status period by default
+        """
+        if self._telemetry is None:
+            from .telemetry import StatusTelemetry
+
+            self._telemetry = StatusTelemetry(
+                seed=int(self.remote_awareness_data.seed),
+                period=self.report_status_period,
+            )
+        return self._telemetry
+
+    @property
+    def timesync(self):
+        """TimeSync following the time requests"""
+        if self._timesync is None:
+            from .timesync import TimeSync
+
+            self._timesync = TimeSync()
+        return self._timesync
+
+    @property
+    def nav(self):
+        """NavIngest of the nav data received"""
+        if self._nav is None:
+            from .nav import NavIngest
 
-        self.state_thread.start()
-        self.status_timer_thread.start()
-        self.time_timer_thread.start()
+            self._nav = NavIngest(
+                clock=self.clock, sink=None if self.datalog is None else self.log_nav
+            )
+        return self._nav
+
+    def start(self):
+        """Open the transport and start the periodic tasks on the event loop,
+        or once the vehicle side is attached with start_on_attach.
+        """
+        if self.transport is None:
+            self.transport = PtyTransport()
+        self.transport.open(
+            self.loop,
+            self.data_received,
+            self.start_periodic_tasks if self.start_on_attach else None,
+        )
+        if self.link_stage is not None:
+            self.link_stage.open(self.loop, self.write, self.flush_outbox)
+        if not self.start_on_attach:
+            self.start_periodic_tasks()
+        self.startup_time = time.perf_counter() - self._created_at
 
-        with VirtualSerialPorts(2) as ports:
-            self.port0 = ports[0]
-            self.port1 = ports[1]
+    def start_periodic_tasks(self):
+        """Start the image counters, status reports and time requests"""
+        if self.status_timer is not None:
+            return
+        self.log("Starting periodic tasks")
+        # Periodic tasks, all served by the event loop scheduler
+        self.image_counters_timer = self.loop.call_every(
+            self.image_counters_period, self.update_image_counters
+        )
+        self.status_timer = self.loop.call_every(
+            self.report_status_period, self.report_status
+        )
+        self.time_timer = self.loop.call_every(
+            self.request_time_period, self.request_time
+        )
 
-            print("Please use serial port:")
-            # print(self.port0)
-            print(self.port1)
+    def close(self):
+        """Stop the periodic tasks and close the transport"""
+        for timer in (
+            self.image_counters_timer,
+            self.status_timer,
+            self.time_timer,
+            self._flush_timer,
+        ):
+            if timer is not None:
+                timer.cancel()
+        if self.link_stage is not None:
+            self.link_stage.close()
+            self.log("Iridium link:", self.link_stage.stats())
+        if self.transport is not None:
+            self.transport.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self._owns_loop:
+            self.loop.close()
+        # Last, it raises the error of the data log writer if it failed
+        if self.datalog is not None:
+            if self._nav is not None:
+                self._nav.flush()
+            self.datalog.close()
 
+    def run(self):
+        """Start the emulator and serve it until interrupted"""
+        self.start()
+        # CPU time covers the interpreter start up and the imports too
+        self.log(
+            "Ready in %.1f ms (%.1f ms of CPU since the process started)"
+            % (self.startup_time * 1000, time.process_time() * 1000)
+        )
+        print("Please use serial port:")
+        print(self.port)
+        if isinstance(self.transport, PtyTransport):
             print(
                 "\nRecommended script to run in a separate terminal:\n\t",
-                "picocom -b 57600 -c --omap crlf " + self.port1,
-            )
-            self.serial0 = serial.Serial(
-                ports[0],
-                baudrate=57600,
-                timeout=0.1,
-                bytesize=8,
-                parity="N",
-                stopbits=1,
+                "picocom -b 57600 -c --omap crlf " + self.port,
             )
-            self.infinite_loop()
+        else:
+            print("(open it with pyserial's serial_for_url)")
+        self.infinite_loop()
 
     def infinite_loop(self):
-        while True:
-            try:
-                self.emulate_step()
-                time.sleep(1)
-            except KeyboardInterrupt:
-                print("Exiting")
-                self.state_thread_event.set()
-                self.status_timer_thread.cancel()
-                self.time_timer_thread.cancel()
-                break
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            print("Exiting")
+        finally:
+            self.close()
 
-    def emulate_step(self):
-        if len(self.message_outbox) > 0:
-            msg = self.message_outbox.pop(0)
-            self.serial0.write(msg.encode("utf-8"))
+    def emulate_step(self, timeout=None):
+        """Wait up to timeout seconds for the port or the outbox and serve them"""
+        self.loop.run_once(timeout)
 
-        command = self.serial0.readline()
-        # print("Received: " + str(command))
-        self.message_inbox += command.decode("utf-8")
-        # print("Message inbox: " + self.message_inbox)
+    def send(self, msg, priority=PRIORITY_STATUS):
+        """Queue a message for BioCam to send. Can be called from any thread"""
+        self.message_outbox.put(msg, priority)
+        self.loop.call_soon_threadsafe(self.flush_outbox)
 
-        if not command.endswith(b"\n"):
+    def flush_outbox(self):
+        """Write the queued messages the link can carry, highest priority first.
+
+        With a link stage, summaries and status reports are handed over to it
+        while its queue has room, and the flush runs again when a message
+        leaves it. If messages are left in the outbox, the flush is scheduled
+        again for when the pacer lets the next one through.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self.transport is None or self.transport.closed:
             return
+        self.summary_transfer.fill()
+        queued_summaries = self.message_outbox.depth(PRIORITY_SUMMARY)
+        budget = self.pacer.available()
+        force_first = self.pacer.full()
+        staged = []
+        stage_full = False
+        if self.link_stage is None:
+            msgs = self.message_outbox.drain(budget, force_first=force_first)
+        else:
+            msgs = self.message_outbox.drain(
+                budget, force_first=force_first, priorities=DIRECT_PRIORITIES
+            )
+            if budget is not None:
+                budget -= sum(len(msg) for msg in msgs)
+            room = self.link_stage.queue_size - len(self.link_stage)
+            if room > 0:
+                staged = self.message_outbox.drain(
+                    budget,
+                    force_first=force_first and not msgs,
+                    priorities=STAGED_PRIORITIES,
+                    limit=room,
+                )
+            stage_full = len(staged) >= room
+        if msgs or staged:
+            self.pacer.consume(sum(len(msg) for msg in msgs + staged))
+        if msgs:
+            self.write(msgs)
+        for msg in staged:
+            self.link_stage.put(msg)
+        # Summaries count as sent once written, requests finish there
+        self.summary_transfer.drained(
+            queued_summaries - self.message_outbox.depth(PRIORITY_SUMMARY)
+        )
+        # Generate the next summaries as the link drains the previous ones
+        self.summary_transfer.fill()
+        # A full link stage asks for the next flush itself
+        next_size = self.message_outbox.peek_size(
+            DIRECT_PRIORITIES if stage_full else None
+        )
+        if next_size is not None:
+            self._flush_timer = self.loop.call_later(
+                self.pacer.delay(next_size), self.flush_outbox
+            )
 
-        command = self.message_inbox
-        self.message_inbox = ""
-        if command == "":
+    def write(self, msgs):
+        """Write encoded messages to the port"""
+        if self.transport.closed:
+            return
+        delivered = self.transport.write(b"".join(msgs))
+        if self.recorder is not None:
+            for msg in msgs:
+                self.recorder.record(OUTBOUND, msg)
+        if not delivered:
             return
-        print("Received command: " + str(command))
+        # Time requests go first, stamp them as they are written
+        for msg in msgs:
+            if not msg.startswith(b"$time"):
+                break
+            self.timesync.request_sent()
+
+    def data_received(self, data):
+        """Handle every complete line received"""
+        self._received_at = time.perf_counter()
+        for line in self.framer.lines(data):
+            self.handle_line(line)
+        if self._nav is not None:
+            invalid = self._nav.flush()
+            if invalid:
+                self.log("Invalid nav data received in", invalid, "lines")
+        self.flush_outbox()
+
+    def handle_line(self, command):
+        self.log("Received command: " + str(command))
+        if self.recorder is not None:
+            self.recorder.record(INBOUND, command + "\n")
         response = self.check_command(command)
         if response is not None:
-            print("Sending response: " + response)
-            self.serial0.write(response.encode("utf-8"))
-
-    def state_thread_fn(self, event):
-        while True:
-            if self.mode.state > 1 and self.mode.state < 9:
-                if self.mode.state == 3 or self.mode.state == 7:
-                    self.num_images_cam0 += 1
-                else:
-                    self.num_images_cam0 += 20
-                self.num_images_cam1 += 1
-            if event.is_set():
-                break
-            time.sleep(3)
+            self.log("Sending response: " + response)
+            self.message_outbox.put(response, PRIORITY_ACK)
+
+    def update_image_counters(self):
+        if self.mode.state > 1 and self.mode.state < 9:
+            if self.mode.state == 3 or self.mode.state == 7:
+                self.num_images_cam0 += 1
+            else:
+                self.num_images_cam0 += 20
+            self.num_images_cam1 += 1
 
     def report_status(self):
         """BioCam sends its status every 60 seconds
@@ -248,46 +720,37 @@ class BioCamEmulator:
         available_disk_space\n
         status 8 00000312 00010852 55257 09258 42 34 35 0024591674256\n
         """
-        if self.mode.state == 4 or self.mode.state == 8:
-            self.score_cam0 = np.random.randint(
-                400, 1000
-            )  # max 65535, zero padded to 5 digits
-            self.score_cam1 = np.random.randint(
-                5000, 8000
-            )  # max 65535, zero padded to 5 digits
-        if self.mode.state in [2, 3, 4, 6, 7, 8]:
-            self.cam0_temperature = np.random.randint(30, 50)
-            self.cam1_temperature = np.random.randint(30, 50)
-        self.cpu_temperature = np.random.randint(30, 50)
-        self.available_disk_space = np.random.randint(
-            100000000000, 200000000000  # Zero-padded to 13 digits.
-        )  # < 2,000,000,000,000 (but might be bigger in the future).
-
-        msg = (
-            "status "
-            + str(self.mode.state)
-            + " "
-            + str(self.num_images_cam0)
-            + " "
-            + str(self.num_images_cam1)
-            + " "
-            + str(self.score_cam0)
-            + " "
-            + str(self.score_cam1)
-            + " "
-            + str(self.cpu_temperature)
-            + " "
-            + str(self.cam0_temperature)
-            + " "
-            + str(self.cam1_temperature)
-            + " "
-            + str(self.available_disk_space)
-            + "\n"
+        from .telemetry import format_status
+
+        (
+            self.score_cam0,
+            self.score_cam1,
+            self.cpu_temperature,
+            self.cam0_temperature,
+            self.cam1_temperature,
+            self.available_disk_space,
+        ) = values = self.telemetry.next(
+            self.mode.state, self.num_images_cam0, self.num_images_cam1
         )
-        print("Reporting state: " + msg)
-        self.message_outbox.append(msg)
-        self.status_timer_thread = Timer(self.report_status_period, self.report_status)
-        self.status_timer_thread.start()
+        msg = format_status(
+            self.mode.state, self.num_images_cam0, self.num_images_cam1, values
+        )
+        self.log("Reporting state: " + msg.decode())
+        self.send(msg)
+        if self.datalog is not None:
+            self.datalog.append_row(
+                "status",
+                time_ms=self.clock.time_ms(),
+                mode=self.mode.state,
+                num_images_cam0=self.num_images_cam0,
+                num_images_cam1=self.num_images_cam1,
+                score_cam0=self.score_cam0,
+                score_cam1=self.score_cam1,
+                cpu_temperature=self.cpu_temperature,
+                cam0_temperature=self.cam0_temperature,
+                cam1_temperature=self.cam1_temperature,
+                available_disk_space=self.available_disk_space,
+            )
 
     def request_time(self):
         """BioCam4000 sends
@@ -298,130 +761,422 @@ class BioCamEmulator:
             *time 1607105547000\n
             in milliseconds since epoch
         """
-        print("Requesting time: " + "$time\n")
-        self.message_outbox.append("$time\n")
-        self.time_timer_thread = Timer(self.request_time_period, self.request_time)
-        self.time_timer_thread.start()
-
-    def sending_summaries_timer_thread(self, start_idx, end_idx, idx_list=None):
-        self.mode.sending_summaries()
-
-        if idx_list is not None:
-            # Send summaries in idx_list
-            for idx in idx_list:
-                if idx > self.remote_awareness_data.len():
-                    continue
-                msg = f"summary {idx:02d} " + self.remote_awareness_data.get(int(idx))
-                self.message_outbox.append(msg)
-                time.sleep(1)
-            self.message_outbox.append("summary done\n")
+        self.log("Requesting time: " + "$time\n")
+        self.send("$time\n", PRIORITY_TIME)
+
+    def cancel_summaries(self):
+        """Cancel the summary requests and drop the queued summaries"""
+        dropped = self.summary_transfer.cancel()
+        self.log_summaries("stop", dropped)
+
+    def on_summary_transfer(self, event, request):
+        """Follow the summary transfer in the operation mode and the logs"""
+        if event == "start":
+            self.mode.sending_summaries()
+            self.log_summaries(request.kind, request.total)
+        elif event == "done":
+            stats = request.stats()
+            self.log(
+                "Summary request",
+                request.request_id,
+                "sent",
+                request.sent,
+                "summaries at",
+                round(stats["bytes_per_second"]),
+                "bytes/s",
+            )
+            self.log_summaries(
+                "done",
+                request.sent,
+                sent_bytes=request.sent_bytes,
+                bytes_per_second=stats["bytes_per_second"],
+            )
+        elif event == "idle":
             self.mode.idle()
+
+    def log_nav(self, datatype, records):
+        """Record a batch of accepted nav samples in the data log"""
+        self.datalog.append("nav_" + datatype, records)
+
+    def log_summaries(self, event, count, sent_bytes=0, bytes_per_second=0.0):
+        """Record a summary transfer event in the data log: a request started
+        ("start" or "get", with the number of summaries to send), finished
+        ("done", with the summaries and bytes sent) or was stopped ("stop",
+        with the summaries not sent)
+        """
+        if self.datalog is None:
+            return
+        self.datalog.append_row(
+            "summaries",
+            time_ms=self.clock.time_ms(),
+            event=event,
+            count=count,
+            sent_bytes=sent_bytes,
+            bytes_per_second=bytes_per_second,
+            outbox_depth=self.message_outbox.depth(PRIORITY_SUMMARY),
+        )
+
+    def check_command(self, msg):
+        """Handle a received line and return the acknowledgement, if any.
+
+        The line is tokenized once and dispatched on its first word: nav lines
+        go straight to the nav path, commands to their handler.
+        """
+        verb, _, rest = msg.rstrip("\r\n").partition(" ")
+        handler = self.dispatch_table.get(verb)
+        if handler is None:
+            self.verb_counts["unknown"] = self.verb_counts.get("unknown", 0) + 1
+            return None
+        self.verb_counts[verb] = self.verb_counts.get(verb, 0) + 1
+        return handler(rest)
+
+    def on_mode_change(self, old_state, new_state):
+        """Count the transitions of the state machine"""
+        key = (old_state, new_state)
+        self.state_transitions[key] = self.state_transitions.get(key, 0) + 1
+
+    def register_command(self, command):
+        """Add a command to the dispatch table"""
+        self.commands.append(command)
+        self.dispatch_table[command.verb] = lambda rest: command.dispatch(
+            rest.split(" ") if rest else []
+        )
+
+    def on_time(self, rest):
+        """*time reply, followed by a timestamp (13 digits) milliseconds since
+        epoch. Measures the round trip time and the offset of the vehicle clock
+        """
+        result = self.timesync.reply_received(rest, self._received_at)
+        if result is None:
+            self.log("Invalid or unexpected time reply received")
             return
+        rtt_ms, offset_ms = result
+        self.log("Time round trip " + str(round(rtt_ms, 3)) + " ms")
+        if self.datalog is not None:
+            self.datalog.append_row(
+                "time",
+                time_ms=self.clock.time_ms(),
+                rtt_ms=rtt_ms,
+                offset_ms=offset_ms,
+            )
 
-        # check start and end are within the range of the data
-        data_len = self.remote_awareness_data.len()
-        if start_idx < 0 or start_idx >= data_len:
-            start_idx = 0
-        if end_idx < 0 or end_idx > data_len:
-            end_idx = data_len
-
-        for i in range(start_idx, end_idx):
-            msg = f"summary {i:02d} " + self.remote_awareness_data.get(i)
-            self.message_outbox.append(msg)
-            time.sleep(1)
-        self.message_outbox.append("summary done\n")
+    def on_nav(self, rest):
+        """nav message update
+        Starts with 'nav' and followed by to millisecond timestamps (13 digits) and
+        a list of data that can either be:
+        position: (latitude-longitude in decimal degrees, 6 decimal places (fix))
+        orientation: (Euler angles in degrees, 3 decimal places (fix))
+        altitude: (in metres, 3 decimal places (fix). If no bottom-lock: 10000.000)
+        depth:  (in metres, 3 decimal places (fix))
+        velocities: (surge, sway (positive to the right), heave (positive in
+        downwards direction) in m/s, 3 decimal places (fix))
+
+        Lines are queued and validated in batches by the nav ingest stage, the
+        valid samples are kept in its ring buffers.
+        """
+        self.nav.add(rest)
+
+    def on_start_mapping(self, arguments):
+        self.mode.start_mapping()
+
+    def on_stop_acquisition(self, arguments):
         self.mode.idle()
 
-    def check_command(self, msg):
-        """Check if the received message is valid. Otherwise, print error in console"""
-        if msg.startswith("*time"):
-            # Check it's followed by a timestamp (13 digits) milliseconds since epoch
-            if len(msg) != 20:
-                print("Invalid timestamp received")
-        if msg.startswith("nav"):
-            """nav message update
-            Starts with 'nav' and followed by to millisecond timestamps (13 digits) and
-            a list of data that can either be:
-            position: (latitude-longitude in decimal degrees, 6 decimal places (fix))
-            orientation: (Euler angles in degrees, 3 decimal places (fix))
-            altitude: (in metres, 3 decimal places (fix). If no bottom-lock: 10000.000)
-            depth:  (in metres, 3 decimal places (fix))
-            velocities: (surge, sway (positive to the right), heave (positive in
-            downwards direction) in m/s, 3 decimal places (fix))
-
-            Check that data is valid and print error if not
-            """
-            parts = msg.split(" ")
-            ts1 = parts[1]
-            ts2 = parts[2]
-            datatype = parts[3]
-            data = parts[4:]
-            data[-1] = data[-1].replace("\n", "")
-            if len(ts1) != 13:
-                print("Invalid nav first timestamp received")
-            if len(ts2) != 13:
-                print("Invalid nav second timestamp received")
-            if datatype == "altitude":
-                if len(data) != 1:
-                    print("Invalid altitude nav data received")
-            if datatype == "depth":
-                if len(data) != 1:
-                    print("Invalid depth nav data received")
-            if datatype == "position":
-                if len(data) != 2:
-                    print("Invalid position nav data received")
-            if datatype == "orientation":
-                if len(data) != 3:
-                    print("Invalid orientation nav data received")
-            if datatype == "velocities":
-                if len(data) != 3:
-                    print("Invalid velocity nav data received")
-        for command in self.commands:
-            response = command.check_and_reply(msg)
-            if response is not None:
-                if command.command.startswith("*bc_start_mapping"):
-                    self.mode.start_mapping()
-                elif command.command.startswith("*bc_stop_acquisition"):
-                    self.mode.idle()
-                elif command.command.startswith("*bc_start_camera_calibration"):
-                    self.mode.camera_calibration()
-                elif command.command.startswith("*bc_start_laser_calibration"):
-                    self.mode.laser_calibration()
-                elif command.command.startswith("*bc_shutdown"):
-                    self.mode.stop()
-                elif command.command.startswith("*bc_start_summaries"):
-                    self.mode.start_summaries()
-                    try:
-                        start_idx = int(command.arguments[0])
-                        end_idx = int(command.arguments[1])
-                        self.start_summaries_timer = Timer(
-                            20,
-                            self.sending_summaries_timer_thread,
-                            args=(start_idx, end_idx),
-                        )
-                        self.start_summaries_timer.start()
-                    except Exception as e:
-                        print("Invalid arguments for summaries: ")
-                        print("\t - Received start_idx: " + command.arguments[0])
-                        print("\t - Received end_idx: " + command.arguments[1])
-                        print("Exception message: " + str(e))
-                elif command.command.startswith("*bc_get_summaries"):
-                    summary_idx_list = [int(x) for x in command.arguments[1:]]
-                    print(summary_idx_list)
-                    self.start_summaries_timer = Timer(
-                        5,
-                        self.sending_summaries_timer_thread,
-                        args=(None, None, summary_idx_list),
-                    )
-                    self.start_summaries_timer.start()
-                elif command.command == "*bc_stop_summaries\n":
-                    self.self.start_summaries_timer.cancel()
-                    self.mode.idle()
-                return response
+    def on_start_camera_calibration(self, arguments):
+        self.mode.camera_calibration()
+
+    def on_start_laser_calibration(self, arguments):
+        self.mode.laser_calibration()
+
+    def on_shutdown(self, arguments):
+        self.mode.stop()
+
+    def on_start_summaries(self, arguments):
+        try:
+            start_idx = int(arguments[0])
+            end_idx = int(arguments[1])
+        except ValueError as e:
+            self.log("Invalid arguments for summaries: ")
+            self.log("\t - Received start_idx: " + arguments[0])
+            self.log("\t - Received end_idx: " + arguments[1])
+            self.log("Exception message: " + str(e))
+            return
+        # Computing summaries, unless already sending some
+        if not self.summary_transfer.sending:
+            self.mode.start_summaries()
+        self.summary_transfer.request_range(
+            start_idx, end_idx, delay=self.compute_summaries_delay
+        )
+
+    def on_get_summaries(self, arguments):
+        try:
+            summary_idx_list = [int(x) for x in arguments]
+        except ValueError as e:
+            self.log("Invalid arguments for summaries: " + str(e))
+            return
+        self.log(summary_idx_list)
+        self.summary_transfer.request_list(
+            summary_idx_list, delay=self.get_summaries_delay
+        )
+
+    def on_stop_summaries(self, arguments):
+        self.cancel_summaries()
+        self.mode.idle()
 
 
 def main():
-    BioCamEmulator()
+    parser = argparse.ArgumentParser(description="BioCam serial emulator")
+    parser.add_argument(
+        "--link",
+        choices=sorted(LINK_PRESETS),
+        default="rs232",
+        help="link model used to pace outbound messages (default: rs232)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="seed used to shuffle the summaries (default: random)",
+    )
+    parser.add_argument(
+        "--summaries",
+        type=Path,
+        default=None,
+        help="folder of hex text summaries or packed summary archive to send "
+        "(default: bundled data folder)",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="COUNT",
+        default=None,
+        help="send COUNT generated summaries instead of recorded ones",
+    )
+    parser.add_argument(
+        "--synthetic-sizes",
+        # synthetic.SIZE_DISTRIBUTIONS, not imported to keep NumPy out of the
+        # start up
+        choices=["uniform", "normal", "fixed"],
+        default="uniform",
+        help="size distribution of the generated summaries (default: uniform)",
+    )
+    parser.add_argument(
+        "--wrap-ids",
+        action="store_true",
+        default=None,
+        help="roll summary IDs over from 99 to 00 (default: only for --synthetic)",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="virtual seconds per real second, e.g. 1000 to emulate a day of "
+        "mission in under a minute and a half (default: 1)",
+    )
+    parser.add_argument(
+        "--time-request-period",
+        type=float,
+        default=600.0,
+        metavar="SECONDS",
+        help="seconds between $time requests, e.g. 1 to measure how fast the "
+        "vehicle answers under load (default: 600)",
+    )
+    parser.add_argument(
+        "--iridium-queue",
+        type=int,
+        default=None,
+        metavar="SIZE",
+        help="send through a model of the Iridium modem queue holding SIZE "
+        "messages, with losses and retries",
+    )
+    parser.add_argument(
+        "--iridium-loss",
+        type=float,
+        default=0.1,
+        help="probability that an Iridium attempt fails (default: 0.1)",
+    )
+    parser.add_argument(
+        "--iridium-latency",
+        type=float,
+        default=10.0,
+        help="mean seconds an Iridium attempt takes (default: 10)",
+    )
+    parser.add_argument(
+        "--iridium-retries",
+        type=int,
+        default=4,
+        help="retries before an Iridium message is dropped (default: 4)",
+    )
+    parser.add_argument(
+        "--iridium-retry-interval",
+        type=float,
+        default=60.0,
+        help="mean seconds between Iridium retries (default: 60)",
+    )
+    parser.add_argument(
+        "--iridium-sequence-numbers",
+        action="store_true",
+        help='append the Iridium sequence number to every line sent, as " #SEQ"',
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["pty", "tcp"],
+        default="pty",
+        help="serve a pseudo-terminal, or a TCP server standing in for a serial "
+        "over IP gateway (default: pty)",
+    )
+    parser.add_argument(
+        "--tcp-address",
+        default="127.0.0.1:0",
+        metavar="HOST:PORT",
+        help="address the TCP transport listens on (default: any free port of "
+        "127.0.0.1)",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="record every frame received and sent to this file, see biocam_replay",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics, and "
+        "JSON on /metrics.json",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="write a JSON metrics snapshot to this file periodically",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10.0,
+        help="real seconds between JSON metrics snapshots (default: 10)",
+    )
+    parser.add_argument(
+        "--fast-start",
+        action="store_true",
+        help="same as --lazy-summaries --start-on-attach, e.g. for test runs "
+        "spawning many short-lived emulators",
+    )
+    parser.add_argument(
+        "--lazy-summaries",
+        action="store_true",
+        help="load the summaries when first requested rather than at start up",
+    )
+    parser.add_argument(
+        "--start-on-attach",
+        action="store_true",
+        help="start the status reports, image counters and time requests once "
+        "the vehicle side is attached (TCP client connected or first bytes "
+        "received) rather than when the port is opened",
+    )
+    parser.add_argument(
+        "--log-dir",
+        type=Path,
+        default=None,
+        help="record nav, status and summary transfers to columnar files in "
+        "this folder",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["auto", "npz", "parquet"],  # datalog.LOG_FORMATS
+        default="auto",
+        help="format of the data log, parquet needs pyarrow (default: auto)",
+    )
+    parser.add_argument(
+        "--log-flush-interval",
+        type=float,
+        default=10.0,
+        help="seconds between writes of the data log (default: 10)",
+    )
+    parser.add_argument(
+        "--log-rotate-interval",
+        type=float,
+        default=3600.0,
+        help="seconds between new data log files (default: 3600)",
+    )
+    args = parser.parse_args()
+    clock = VirtualClock(args.time_scale)
+    summaries = args.summaries
+    if args.synthetic is not None:
+        from .synthetic import SyntheticSummaries
+
+        summaries = SyntheticSummaries(
+            args.synthetic,
+            seed=0 if args.seed is None else args.seed,
+            size_distribution=args.synthetic_sizes,
+        )
+    datalog = None
+    if args.log_dir is not None:
+        from .datalog import ColumnarLogWriter
+
+        datalog = ColumnarLogWriter(
+            args.log_dir,
+            log_format=args.log_format,
+            flush_interval=args.log_flush_interval,
+            rotate_interval=args.log_rotate_interval,
+        )
+    transport = None
+    if args.transport == "tcp":
+        host, _, tcp_port = args.tcp_address.rpartition(":")
+        transport = TcpServerTransport(host or "127.0.0.1", int(tcp_port))
+    recorder = None
+    if args.record is not None:
+        recorder = TrafficRecorder(
+            args.record, clock=clock.monotonic, time_scale=clock.time_scale
+        )
+    link_stage = None
+    if args.iridium_queue is not None:
+        from .iridium import IridiumLink
+
+        link_stage = IridiumLink(
+            queue_size=args.iridium_queue,
+            loss_probability=args.iridium_loss,
+            latency_mean=args.iridium_latency,
+            latency_std=args.iridium_latency / 2,
+            max_retries=args.iridium_retries,
+            retry_interval_mean=args.iridium_retry_interval,
+            retry_interval_std=args.iridium_retry_interval / 6,
+            sequence_numbers=args.iridium_sequence_numbers,
+            seed=args.seed,
+        )
+    emulator = BioCamEmulator(
+        pacer=make_pacer(args.link, clock=clock.monotonic),
+        transport=transport,
+        clock=clock,
+        seed=args.seed,
+        summaries=summaries,
+        wrap_ids=args.wrap_ids,
+        datalog=datalog,
+        recorder=recorder,
+        link_stage=link_stage,
+        lazy_summaries=args.lazy_summaries or args.fast_start,
+        start_on_attach=args.start_on_attach or args.fast_start,
+    )
+    emulator.request_time_period = args.time_request_period
+    if args.metrics_port is not None or args.metrics_json is not None:
+        from .metrics import MetricsServer, write_json_snapshot
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(
+            [emulator], emulator.loop, port=args.metrics_port
+        )
+        metrics_server.start()
+        print("Metrics served at", metrics_server.url)
+    if args.metrics_json is not None:
+        emulator.loop.call_every(
+            args.metrics_interval * clock.time_scale,
+            write_json_snapshot,
+            args.metrics_json,
+            [emulator],
+        )
+    emulator.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+"""
+Event loop used by the BioCam emulator
+
+A small selector based reactor. File objects are registered together with a
+callback that runs as soon as they become readable (or writable), and other
+threads can hand work over to the loop with call_soon_threadsafe(), which wakes
+the selector up through a self-pipe instead of waiting for a polling period to
+expire. Delayed and periodic callbacks are kept in the heap of a Scheduler,
+whose next deadline bounds the select() timeout.
+
+An exception raised by a callback is handed to the exception handler of the
+loop, which prints it by default, and the loop keeps serving the other file
+objects and timers, so one bad line or timer does not stop every emulator
+sharing the loop.
+"""
+
+import os
+import sys
+import traceback
+from collections import deque
+from selectors import EVENT_READ, EVENT_WRITE
+from selectors import DefaultSelector as Selector
+from threading import Lock
+
+from .scheduler import Scheduler
+
+
+class EventLoop:
+    def __init__(self, clock=None):
+        """Single threaded I/O loop.
+
+        :param clock: VirtualClock used for the timers, real time if None
+
+        All the callbacks run in the thread calling run_forever() or run_once(),
+        so the code they run does not need any locking between them.
+        """
+
+        self.running = False
+        self.exception_handler = None
+        self.callback_errors = 0
+        self._selector = Selector()
+        self._ready = deque()
+        self._ready_lock = Lock()
+        self.scheduler = Scheduler(
+            clock=clock,
+            on_new_deadline=self.wakeup,
+            on_error=self.call_exception_handler,
+        )
+        self.clock = self.scheduler.clock
+
+        # Self-pipe used to interrupt select() from other threads.
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self.add_reader(self._wakeup_r, self._drain_wakeup)
+
+    def _update(self, fileobj, reader, writer):
+        # One registration per file object, with [reader, writer] callbacks.
+        try:
+            key = self._selector.get_key(fileobj)
+        except KeyError:
+            key = None
+        if key is None:
+            callbacks = [None, None]
+        else:
+            callbacks = key.data
+        if reader is not False:
+            callbacks[0] = reader
+        if writer is not False:
+            callbacks[1] = writer
+        events = (EVENT_READ if callbacks[0] else 0) | (
+            EVENT_WRITE if callbacks[1] else 0
+        )
+        if key is None:
+            if events:
+                self._selector.register(fileobj, events, callbacks)
+        elif events:
+            self._selector.modify(fileobj, events, callbacks)
+        else:
+            self._selector.unregister(fileobj)
+
+    def add_reader(self, fileobj, callback):
+        """Call callback() every time fileobj is readable."""
+
+        self._update(fileobj, callback, False)
+
+    def remove_reader(self, fileobj):
+        """Stop watching fileobj for reading."""
+
+        try:
+            self._update(fileobj, None, False)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def add_writer(self, fileobj, callback):
+        """Call callback() every time fileobj is writable."""
+
+        self._update(fileobj, False, callback)
+
+    def remove_writer(self, fileobj):
+        """Stop watching fileobj for writing."""
+
+        try:
+            self._update(fileobj, False, None)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Run callback(*args) in the loop thread as soon as possible."""
+
+        with self._ready_lock:
+            self._ready.append((callback, args))
+        self.wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) in the loop thread after delay (virtual) seconds.
+
+        Can be called from any thread. Returns a handle with a cancel() method.
+        """
+
+        return self.scheduler.call_later(delay, callback, *args)
+
+    def call_every(self, period, callback, *args, delay=None):
+        """Run callback(*args) in the loop thread every period (virtual) seconds."""
+
+        return self.scheduler.call_every(period, callback, *args, delay=delay)
+
+    def wakeup(self):
+        """Interrupt a blocking select() call."""
+
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except (BlockingIOError, OSError):
+            # The pipe is full (or closed), so the loop will wake up anyway.
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def call_exception_handler(self, callback, exception):
+        """Report an exception raised by callback.
+
+        Calls exception_handler(callback, exception) if set, and prints the
+        traceback to stderr otherwise.
+        """
+
+        self.callback_errors += 1
+        if self.exception_handler is not None:
+            self.exception_handler(callback, exception)
+            return
+        print("Exception in callback " + repr(callback), file=sys.stderr)
+        traceback.print_exception(
+            type(exception), exception, exception.__traceback__, file=sys.stderr
+        )
+
+    def _run(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.call_exception_handler(callback, e)
+
+    def _run_ready(self):
+        with self._ready_lock:
+            ready = self._ready
+            self._ready = deque()
+        for callback, args in ready:
+            self._run(callback, *args)
+
+    def run_once(self, timeout=None):
+        """Wait for events for at most timeout seconds and dispatch them."""
+
+        if self._ready:
+            timeout = 0
+        else:
+            next_timer = self.scheduler.next_timeout()
+            if next_timer is not None and (timeout is None or next_timer < timeout):
+                timeout = next_timer
+        for key, events in self._selector.select(timeout):
+            reader, writer = key.data
+            if events & EVENT_READ and reader is not None:
+                self._run(reader)
+            if events & EVENT_WRITE and writer is not None:
+                self._run(writer)
+        self._run_ready()
+        self.scheduler.run_due()
+
+    def run_forever(self):
+        """Dispatch events until stop() is called."""
+
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        """Make run_forever() return after the current iteration."""
+
+        self.running = False
+        self.wakeup()
+
+    def close(self):
+        """Cancel all the timers and release the selector and the wakeup pipe."""
+
+        self.running = False
+        self.scheduler.shutdown()
+        self._selector.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
@@ -0,0 +1,159 @@
+"""
+Fleet of BioCam emulators
+
+Runs N independent emulators in one process, e.g. one per vehicle of a fleet
+level test. All of them are served by a single event loop thread, with one
+scheduler and one pty pair each, and they share the summary store, so the
+number of threads does not grow with N.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from .clock import VirtualClock
+from .emulator import BioCamEmulator, RemoteAwarenessData
+from .event_loop import EventLoop
+from .metrics import MetricsServer
+from .pacing import LINK_PRESETS, make_pacer
+from .telemetry import StatusTelemetry, TelemetryModel
+
+
+class BioCamFleet:
+    def __init__(
+        self, num_emulators, time_scale=1.0, link="rs232", seed=None, summaries=None
+    ):
+        """Group of emulators sharing one event loop.
+
+        :param num_emulators: number of emulators to create
+        :param time_scale: virtual seconds per real second
+        :param link: link preset used to pace every emulator
+        :param seed: seed used to shuffle the shared summary store
+        :param summaries: folder, archive or source of the summaries
+        """
+
+        self.clock = VirtualClock(time_scale)
+        self.loop = EventLoop(clock=self.clock)
+        if summaries is None:
+            summaries = Path(__file__).parent / "data"
+        self.remote_awareness_data = RemoteAwarenessData(summaries, seed=seed)
+        # Status series shared by all the emulators, read from different offsets
+        self.telemetry_model = TelemetryModel(int(self.remote_awareness_data.seed))
+        self.emulators = [
+            BioCamEmulator(
+                pacer=make_pacer(link, clock=self.clock.monotonic),
+                loop=self.loop,
+                remote_awareness_data=self.remote_awareness_data,
+                verbose=False,
+                telemetry=StatusTelemetry(
+                    self.telemetry_model,
+                    offset=i * self.telemetry_model.size // max(1, num_emulators),
+                ),
+            )
+            for i in range(num_emulators)
+        ]
+
+    def __len__(self):
+        return len(self.emulators)
+
+    def start(self):
+        """Open the ports of all the emulators."""
+
+        for emulator in self.emulators:
+            emulator.start()
+
+    def manifest(self):
+        """Description of the fleet, with the port of every emulator."""
+
+        return {
+            "time_scale": self.clock.time_scale,
+            "seed": int(self.remote_awareness_data.seed),
+            "emulators": [
+                {"index": i, "port": emulator.port}
+                for i, emulator in enumerate(self.emulators)
+            ],
+        }
+
+    def run(self):
+        """Serve all the emulators until interrupted."""
+
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            print("Exiting", file=sys.stderr)
+        finally:
+            self.close()
+
+    def close(self):
+        for emulator in self.emulators:
+            emulator.close()
+        self.loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several BioCam emulators in a single process"
+    )
+    parser.add_argument("num_emulators", type=int, help="number of emulators")
+    parser.add_argument(
+        "--link",
+        choices=sorted(LINK_PRESETS),
+        default="rs232",
+        help="link model used to pace outbound messages (default: rs232)",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="virtual seconds per real second (default: 1)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="seed used to shuffle the summaries"
+    )
+    parser.add_argument(
+        "--summaries",
+        type=Path,
+        default=None,
+        help="folder of hex text summaries or packed summary archive to send",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics of all the emulators on "
+        "http://127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=None,
+        help="write the JSON manifest of the ports to this file instead of stdout",
+    )
+    args = parser.parse_args()
+
+    fleet = BioCamFleet(
+        args.num_emulators,
+        time_scale=args.time_scale,
+        link=args.link,
+        seed=args.seed,
+        summaries=args.summaries,
+    )
+    fleet.start()
+    manifest = json.dumps(fleet.manifest(), indent=2)
+    if args.manifest is None:
+        print(manifest, flush=True)
+    else:
+        args.manifest.write_text(manifest + "\n")
+        print("Manifest written to", args.manifest, file=sys.stderr)
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(
+            fleet.emulators, fleet.loop, port=args.metrics_port
+        )
+        metrics_server.start()
+        print("Metrics served at", metrics_server.url, file=sys.stderr)
+    fleet.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Line framing
+
+Every message of the BioCam protocol is a line of ASCII text ending with \\n.
+The framer takes the received bytes as they come, in chunks of any size, keeps
+them in a preallocated buffer and yields every complete line as a view of that
+buffer, without copying it. A partial line is kept until the rest arrives, and
+lines longer than the limit are dropped and counted as framing errors instead
+of growing the buffer.
+"""
+
+# Longest line accepted, well above the longest inbound message (a
+# bc_get_summaries command with a long list of IDs).
+MAX_LINE_LENGTH = 4096
+
+FRAMING_ERRORS = ("oversize", "decode")
+
+
+class LineFramer:
+    def __init__(self, max_line_length=MAX_LINE_LENGTH, buffer_size=65536):
+        """Incremental splitter of a byte stream into \\n terminated lines.
+
+        :param max_line_length: longest line kept, without the \\n
+        :param buffer_size: size of the preallocated receive buffer
+        """
+
+        self.max_line_length = max_line_length
+        self._buffer = bytearray(max(buffer_size, max_line_length + 1))
+        self._view = memoryview(self._buffer)
+        self._end = 0
+        # Set while the rest of an oversize line is skipped
+        self._discarding = False
+
+        self.bytes = 0
+        self.frames = 0
+        self.errors = dict.fromkeys(FRAMING_ERRORS, 0)
+
+    @property
+    def partial(self):
+        """Number of bytes of the incomplete line kept."""
+
+        return self._end
+
+    def feed(self, data):
+        """Add received bytes and yield the completed lines, without the \\n.
+
+        The lines are memoryviews of the internal buffer: they are only valid
+        until the next line is yielded, copy them to keep them.
+        """
+
+        data = memoryview(data)
+        self.bytes += len(data)
+        while data:
+            n = min(len(data), len(self._buffer) - self._end)
+            start = self._end
+            self._view[start : start + n] = data[:n]
+            self._end += n
+            data = data[n:]
+            yield from self._frames(start)
+
+    def lines(self, data):
+        """Like feed(), but yield the lines decoded as ASCII strings."""
+
+        for frame in self.feed(data):
+            try:
+                yield str(frame, "ascii")
+            except UnicodeDecodeError:
+                self.errors["decode"] += 1
+
+    def _frames(self, search_from):
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", search_from, self._end)
+            if end < 0:
+                break
+            if self._discarding:
+                self._discarding = False
+            elif end - start > self.max_line_length:
+                self.errors["oversize"] += 1
+            else:
+                self.frames += 1
+                yield self._view[start:end]
+            start = search_from = end + 1
+
+        # Move the incomplete line to the start of the buffer
+        remaining = self._end - start
+        if not self._discarding and remaining > self.max_line_length:
+            self.errors["oversize"] += 1
+            self._discarding = True
+        if self._discarding:
+            remaining = 0
+        self._view[:remaining] = self._view[start : start + remaining]
+        self._end = remaining
+
+    def stats(self):
+        return {
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "partial": self.partial,
+            "errors": dict(self.errors),
+        }
@@ -0,0 +1,223 @@
+"""
+Iridium SBD queue model
+
+Optional stage between the emulator outbox and its port, modelling the queue of
+the vehicle's Iridium modem. Only summaries and status reports go through it:
+command acknowledgements and time requests are exchanged with the vehicle on the
+serial line and are written to the port straight away.
+
+Messages wait in a bounded FIFO queue and are sent one at a time. Every attempt
+takes a random latency and is lost with a given probability; a lost message is
+retried after a random interval, and dropped after the last retry (by default 4
+retries, about 5 minutes). A message arriving while the queue is full is
+dropped, so the emulator only hands messages over while there is room and keeps
+the others in its outbox.
+
+Every message gets a sequence number when it enters the stage. Optionally, it is
+appended to the line as " #SEQ" so that the receiving side can tell which ones
+it got. This changes the protocol, so it is off by default:
+
+    summary 03 0A1B... #000042\\n
+
+Delivery statistics are kept as running counters per message kind, and the
+latency percentile over the last LATENCY_WINDOW delivered messages, so that
+memory stays bounded over a long mission. Times are in seconds of the mission
+clock.
+"""
+
+from collections import deque
+
+import numpy as np
+
+SEQUENCE_DIGITS = 6
+
+DROP_REASONS = ("queue_full", "retries")
+
+# Delivered messages per kind the latency percentile is computed over
+LATENCY_WINDOW = 1000
+
+
+def message_kind(msg):
+    """Kind of an outbound message, from its first word."""
+
+    if msg.startswith(b"summary"):
+        return "summary"
+    if msg.startswith(b"status"):
+        return "status"
+    if msg.startswith(b"$time"):
+        return "time"
+    return "ack"
+
+
+class IridiumLink:
+    def __init__(
+        self,
+        queue_size=50,
+        loss_probability=0.1,
+        latency_mean=10.0,
+        latency_std=5.0,
+        max_retries=4,
+        retry_interval_mean=60.0,
+        retry_interval_std=10.0,
+        sequence_numbers=False,
+        seed=None,
+    ):
+        """Lossy, bounded, retrying satellite queue.
+
+        :param queue_size: messages the queue holds, including the one in flight
+        :param loss_probability: probability that an attempt fails
+        :param latency_mean: mean seconds an attempt takes (normal, >= 0)
+        :param latency_std: standard deviation of the attempt time
+        :param max_retries: retries after the first attempt before dropping
+        :param retry_interval_mean: mean seconds before a retry (normal, >= 0)
+        :param retry_interval_std: standard deviation of the retry interval
+        :param sequence_numbers: append " #SEQ" to the delivered lines
+        :param seed: seed of the loss and timing draws
+        """
+
+        self.queue_size = queue_size
+        self.loss_probability = loss_probability
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.max_retries = max_retries
+        self.retry_interval_mean = retry_interval_mean
+        self.retry_interval_std = retry_interval_std
+        self.sequence_numbers = sequence_numbers
+        self._rng = np.random.default_rng(seed)
+
+        self.loop = None
+        self.deliver = None
+        self.on_space = None
+        self._queue = deque()
+        self._timer = None
+        self._next_sequence = 0
+
+        # Per message kind: counters, latency sums and recent latencies
+        self._kinds = {}
+        self.delivered = 0
+        self.dropped = dict.fromkeys(DROP_REASONS, 0)
+        self.attempts = 0
+
+    def open(self, loop, deliver, on_space=None):
+        """Start the stage.
+
+        :param loop: EventLoop running the attempts
+        :param deliver: called with the list of delivered lines, in bytes
+        :param on_space: called when a message leaves the queue, delivered or
+            dropped after its last retry
+        """
+
+        self.loop = loop
+        self.deliver = deliver
+        self.on_space = on_space
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, msg):
+        """Hand a message over to the modem, dropped if the queue is full."""
+
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        kind = message_kind(msg)
+        if self.sequence_numbers:
+            msg = b"%s #%0*d\n" % (msg.rstrip(b"\n"), SEQUENCE_DIGITS, sequence)
+        if len(self._queue) >= self.queue_size:
+            self.dropped["queue_full"] += 1
+            self._account(kind)
+            return
+        # Kind, time queued and attempts of the message
+        self._queue.append((msg, [kind, self.loop.clock.monotonic(), 0]))
+        if self._timer is None:
+            self._attempt()
+
+    def _draw(self, mean, std):
+        return max(0.0, float(self._rng.normal(mean, std))) if std else mean
+
+    def _attempt(self):
+        """Start sending the message at the head of the queue."""
+
+        self._timer = self.loop.call_later(
+            self._draw(self.latency_mean, self.latency_std), self._attempt_done
+        )
+
+    def _attempt_done(self):
+        self._timer = None
+        msg, record = self._queue[0]
+        kind, queued, attempts = record
+        attempts = record[2] = attempts + 1
+        self.attempts += 1
+        if self._rng.random() >= self.loss_probability:
+            self._queue.popleft()
+            self.delivered += 1
+            self._account(kind, self.loop.clock.monotonic() - queued, attempts)
+            self.deliver([msg])
+        elif attempts > self.max_retries:
+            self._queue.popleft()
+            self.dropped["retries"] += 1
+            self._account(kind)
+        else:
+            self._timer = self.loop.call_later(
+                self._draw(self.retry_interval_mean, self.retry_interval_std),
+                self._attempt,
+            )
+            return
+        if self._queue:
+            self._attempt()
+        if self.on_space is not None:
+            self.on_space()
+
+    def _account(self, kind, latency=None, attempts=0):
+        """Count a message done with, delivered when latency is given."""
+
+        counters = self._kinds.get(kind)
+        if counters is None:
+            counters = self._kinds[kind] = {
+                "messages": 0,
+                "delivered": 0,
+                "latency_sum": 0.0,
+                "latency_max": 0.0,
+                "attempts_sum": 0,
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            }
+        counters["messages"] += 1
+        if latency is None:
+            return
+        counters["delivered"] += 1
+        counters["latency_sum"] += latency
+        counters["latency_max"] = max(counters["latency_max"], latency)
+        counters["attempts_sum"] += attempts
+        counters["latencies"].append(latency)
+
+    def stats(self):
+        """Delivery rate and latency, in total and per message kind."""
+
+        stats = {
+            "queued": len(self._queue),
+            "attempts": self.attempts,
+            "delivered": self.delivered,
+            "dropped": dict(self.dropped),
+            "kinds": {},
+        }
+        for kind in sorted(self._kinds):
+            counters = self._kinds[kind]
+            delivered = counters["delivered"]
+            kind_stats = {
+                "messages": counters["messages"],
+                "delivered": delivered,
+                "delivery_rate": delivered / counters["messages"],
+            }
+            if delivered:
+                kind_stats["latency_mean"] = counters["latency_sum"] / delivered
+                kind_stats["latency_p95"] = float(
+                    np.percentile(counters["latencies"], 95)
+                )
+                kind_stats["latency_max"] = counters["latency_max"]
+                kind_stats["attempts_mean"] = counters["attempts_sum"] / delivered
+            stats["kinds"][kind] = kind_stats
+        return stats
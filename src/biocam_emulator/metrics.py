@@ -0,0 +1,404 @@
+"""
+Emulator metrics
+
+Snapshots of the counters the emulators already keep (link bytes and frames,
+commands by verb, nav lines by type and validation failures, outbox depth,
+summary transfer, scheduler lag, state machine transitions and time requests),
+served over HTTP in the Prometheus text format or as JSON, and optionally
+written to a JSON file at a fixed period:
+
+    GET /metrics        Prometheus text format
+    GET /metrics.json   JSON snapshot
+
+Snapshots are taken on the event loop thread, so the counters are never read
+while they are being updated, and nothing is computed until asked for. Taking
+one changes nothing: the nav ingest and time sync are only read if the emulator
+already created them, and pending nav lines are not parsed.
+"""
+
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .outbox import PRIORITY_NAMES
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds to wait for the event loop to take a snapshot
+SNAPSHOT_TIMEOUT = 2.0
+
+
+def collect(emulator):
+    """Snapshot of the metrics of one emulator, as a JSON compatible dict."""
+
+    transport = emulator.transport
+    outbox = emulator.message_outbox.stats()
+    scheduler = emulator.loop.scheduler
+    nav = emulator._nav
+    timesync = emulator._timesync
+    return {
+        "port": None if transport is None else transport.port,
+        "state": emulator.mode.state,
+        "link": {
+            "bytes_in": 0 if transport is None else transport.bytes_in,
+            "bytes_out": 0 if transport is None else transport.bytes_out,
+            "frames_in": emulator.framer.frames,
+            "frames_out": sum(c["sent"] for c in outbox["classes"].values()),
+            "framing_errors": dict(emulator.framer.errors),
+        },
+        "commands": dict(emulator.verb_counts),
+        "nav": {
+            "received": {} if nav is None else dict(nav.received),
+            "accepted": {} if nav is None else dict(nav.accepted),
+            "errors": {} if nav is None else dict(nav.errors),
+            "no_bottom_lock": 0 if nav is None else nav.no_bottom_lock,
+        },
+        "outbox": {
+            name: {
+                "depth": outbox["classes"][name]["depth"],
+                "sent": outbox["classes"][name]["sent"],
+                "sent_bytes": outbox["classes"][name]["sent_bytes"],
+                "max_wait": outbox["classes"][name]["max_wait"],
+            }
+            for name in PRIORITY_NAMES
+        },
+        "summaries": {
+            "sent": outbox["classes"]["summary"]["sent"],
+            "sent_bytes": outbox["classes"]["summary"]["sent_bytes"],
+            "queued": outbox["classes"]["summary"]["depth"],
+        },
+        "scheduler": {
+            "last_lag": scheduler.last_lag,
+            "max_lag": scheduler.max_lag,
+            "runs": scheduler.runs,
+            "timers": len(scheduler),
+            "callback_errors": emulator.loop.callback_errors,
+        },
+        "state_transitions": {
+            str(old) + "->" + str(new): count
+            for (old, new), count in emulator.state_transitions.items()
+        },
+        "time_sync": {
+            "requests": 0 if timesync is None else timesync.requests,
+            "replies": 0 if timesync is None else timesync.replies,
+            "lost": 0 if timesync is None else timesync.lost,
+        },
+        "iridium": (
+            None
+            if emulator.link_stage is None
+            else {
+                "queued": len(emulator.link_stage),
+                "attempts": emulator.link_stage.attempts,
+                "delivered": emulator.link_stage.delivered,
+                "dropped": dict(emulator.link_stage.dropped),
+            }
+        ),
+    }
+
+
+def snapshot(emulators, loop=None, timeout=SNAPSHOT_TIMEOUT):
+    """Snapshot of several emulators, taken on the event loop thread.
+
+    :param emulators: emulators sharing loop
+    :param loop: EventLoop serving them, None to read the counters directly,
+        e.g. when it is not running
+    :param timeout: seconds to wait for the loop
+    :return: list of snapshots, None if the loop did not answer in time
+    """
+
+    if loop is None:
+        return [collect(e) for e in emulators]
+    result = []
+    done = threading.Event()
+
+    def take():
+        result.extend(collect(e) for e in emulators)
+        done.set()
+
+    loop.call_soon_threadsafe(take)
+    if not done.wait(timeout):
+        return None
+    return result
+
+
+def _labels(**labels):
+    return "{" + ",".join(k + '="' + str(v) + '"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(snapshots):
+    """Prometheus text format of the snapshots of several emulators."""
+
+    metrics = {}
+
+    def add(name, kind, help_text, value, **labels):
+        metric = metrics.setdefault(name, (kind, help_text, []))
+        metric[2].append(_labels(**labels) + " " + repr(float(value)))
+
+    for index, snap in enumerate(snapshots):
+        emu = {"emulator": index}
+        add("biocam_state", "gauge", "Operation mode", snap["state"], **emu)
+        link = snap["link"]
+        for direction in ("in", "out"):
+            add(
+                "biocam_link_bytes_total",
+                "counter",
+                "Bytes through the link",
+                link["bytes_" + direction],
+                direction=direction,
+                **emu
+            )
+            add(
+                "biocam_link_frames_total",
+                "counter",
+                "Lines through the link",
+                link["frames_" + direction],
+                direction=direction,
+                **emu
+            )
+        for reason, count in link["framing_errors"].items():
+            add(
+                "biocam_framing_errors_total",
+                "counter",
+                "Received lines dropped by the framer",
+                count,
+                reason=reason,
+                **emu
+            )
+        for verb, count in snap["commands"].items():
+            add(
+                "biocam_commands_total",
+                "counter",
+                "Received lines by verb",
+                count,
+                verb=verb,
+                **emu
+            )
+        nav = snap["nav"]
+        for datatype in nav["received"]:
+            add(
+                "biocam_nav_received_total",
+                "counter",
+                "Nav lines received by data type",
+                nav["received"][datatype],
+                datatype=datatype,
+                **emu
+            )
+            add(
+                "biocam_nav_accepted_total",
+                "counter",
+                "Valid nav samples by data type",
+                nav["accepted"][datatype],
+                datatype=datatype,
+                **emu
+            )
+        for reason, count in nav["errors"].items():
+            add(
+                "biocam_nav_errors_total",
+                "counter",
+                "Invalid nav lines by reason",
+                count,
+                reason=reason,
+                **emu
+            )
+        add(
+            "biocam_nav_no_bottom_lock_total",
+            "counter",
+            "Altitude samples without bottom lock",
+            nav["no_bottom_lock"],
+            **emu
+        )
+        for name, queue in snap["outbox"].items():
+            add(
+                "biocam_outbox_depth",
+                "gauge",
+                "Messages waiting to be sent",
+                queue["depth"],
+                priority=name,
+                **emu
+            )
+            add(
+                "biocam_outbox_sent_total",
+                "counter",
+                "Messages sent",
+                queue["sent"],
+                priority=name,
+                **emu
+            )
+            add(
+                "biocam_outbox_sent_bytes_total",
+                "counter",
+                "Bytes of messages sent",
+                queue["sent_bytes"],
+                priority=name,
+                **emu
+            )
+            add(
+                "biocam_outbox_max_wait_seconds",
+                "gauge",
+                "Longest time a message waited in the outbox",
+                queue["max_wait"],
+                priority=name,
+                **emu
+            )
+        scheduler = snap["scheduler"]
+        add(
+            "biocam_scheduler_lag_seconds",
+            "gauge",
+            "Lateness of the last timer run",
+            scheduler["last_lag"],
+            **emu
+        )
+        add(
+            "biocam_scheduler_max_lag_seconds",
+            "gauge",
+            "Largest lateness of a timer run",
+            scheduler["max_lag"],
+            **emu
+        )
+        add(
+            "biocam_scheduler_runs_total",
+            "counter",
+            "Timer runs",
+            scheduler["runs"],
+            **emu
+        )
+        add(
+            "biocam_loop_callback_errors_total",
+            "counter",
+            "Event loop callbacks that raised an exception",
+            scheduler["callback_errors"],
+            **emu
+        )
+        for transition, count in snap["state_transitions"].items():
+            old, new = transition.split("->")
+            add(
+                "biocam_state_transitions_total",
+                "counter",
+                "Transitions of the operation mode",
+                count,
+                old=old,
+                new=new,
+                **emu
+            )
+        for name, count in snap["time_sync"].items():
+            add(
+                "biocam_time_" + name + "_total",
+                "counter",
+                "Time request exchanges",
+                count,
+                **emu
+            )
+
+        iridium = snap["iridium"]
+        if iridium is not None:
+            add(
+                "biocam_iridium_queued",
+                "gauge",
+                "Messages in the Iridium queue",
+                iridium["queued"],
+                **emu
+            )
+            add(
+                "biocam_iridium_attempts_total",
+                "counter",
+                "Iridium send attempts",
+                iridium["attempts"],
+                **emu
+            )
+            add(
+                "biocam_iridium_delivered_total",
+                "counter",
+                "Messages delivered over Iridium",
+                iridium["delivered"],
+                **emu
+            )
+            for reason, count in iridium["dropped"].items():
+                add(
+                    "biocam_iridium_dropped_total",
+                    "counter",
+                    "Messages dropped by the Iridium queue",
+                    count,
+                    reason=reason,
+                    **emu
+                )
+
+    lines = []
+    for name, (kind, help_text, samples) in metrics.items():
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " " + kind)
+        lines.extend(name + sample for sample in samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_json_snapshot(path, emulators):
+    """Write a snapshot of the emulators to a JSON file, replacing it
+    atomically. To be called on the event loop thread, e.g. with call_every.
+    """
+
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"emulators": [collect(e) for e in emulators]}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class MetricsServer:
+    def __init__(self, emulators, loop=None, host="127.0.0.1", port=9108):
+        """HTTP server of the metrics of several emulators, in its own thread.
+
+        :param emulators: emulators to report, sharing loop
+        :param loop: EventLoop serving them
+        :param host: address to listen on
+        :param port: TCP port to listen on, 0 for any free port
+        """
+
+        self.emulators = emulators
+        self.loop = loop
+        self._last_snapshot = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = render_prometheus(server.snapshot()).encode()
+                    content_type = PROMETHEUS_CONTENT_TYPE
+                elif self.path == "/metrics.json":
+                    body = json.dumps({"emulators": server.snapshot()}).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._httpd.server_address[1]
+        self.url = "http://" + host + ":" + str(self.port) + "/metrics"
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="metrics", daemon=True
+        )
+
+    def snapshot(self):
+        """Snapshot of the emulators, the last one if the loop is too busy to
+        answer: reading the counters from this thread would race with it.
+        """
+
+        result = snapshot(self.emulators, self.loop)
+        if result is None:
+            return self._last_snapshot
+        self._last_snapshot = result
+        return result
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,275 @@
+"""
+Navigation data ingest
+
+Nav lines are collected as they are received and parsed in batches: the fields
+of all the lines of a data type are validated at once with NumPy, and the valid
+samples are stored in a fixed size ring buffer per data type, from which rate,
+jitter and latency statistics can be queried.
+
+    nav system_time sensor_time datatype value [value ...]\\n
+"""
+
+import numpy as np
+
+# Number of values and decimal places of every nav data type
+NAV_FORMATS = {
+    "position": (2, 6),
+    "depth": (1, 3),
+    "altitude": (1, 3),
+    "orientation": (3, 3),
+    "velocities": (3, 3),
+}
+
+# Altitude sent when the DVL has no bottom-lock
+NO_BOTTOM_LOCK = "10000.000"
+
+TIMESTAMP_DIGITS = 13
+
+ERROR_REASONS = (
+    "unknown_datatype",
+    "field_count",
+    "timestamp",
+    "value_format",
+    "non_monotonic",
+)
+
+
+class RingBuffer:
+    def __init__(self, capacity, dtype):
+        """Fixed size buffer of NumPy records, the oldest are overwritten."""
+
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, records):
+        """Append an array of records."""
+
+        n = len(records)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            self._data[:] = records[-self.capacity :]
+            self._next = 0
+            self._count = self.capacity
+            return
+        end = self._next + n
+        if end <= self.capacity:
+            self._data[self._next : end] = records
+        else:
+            split = self.capacity - self._next
+            self._data[self._next :] = records[:split]
+            self._data[: n - split] = records[split:]
+        self._next = end % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def view(self):
+        """Copy of the stored records, oldest first."""
+
+        if self._count < self.capacity:
+            return self._data[: self._count].copy()
+        return np.concatenate((self._data[self._next :], self._data[: self._next]))
+
+    def last(self):
+        """Most recent record, None if empty."""
+
+        if self._count == 0:
+            return None
+        return self._data[self._next - 1]
+
+
+def _nav_dtype(num_values):
+    return np.dtype(
+        [
+            ("system_time", np.int64),
+            ("sensor_time", np.int64),
+            ("received_time", np.int64),
+            ("values", np.float64, (num_values,)),
+        ]
+    )
+
+
+def _valid_numbers(values, decimals):
+    """Mask of the strings formatted as [-]digits.decimals (fixed decimals)."""
+
+    # At most one leading minus sign
+    negative = np.char.startswith(values, "-")
+    unsigned = np.where(negative, np.char.replace(values, "-", "", count=1), values)
+    dot = np.char.find(unsigned, ".")
+    length = np.char.str_len(unsigned)
+    digits = np.char.isdigit(np.char.replace(unsigned, ".", "", count=1))
+    return digits & (dot > 0) & (length - dot - 1 == decimals)
+
+
+def _valid_timestamps(timestamps):
+    return (np.char.str_len(timestamps) == TIMESTAMP_DIGITS) & np.char.isdigit(
+        timestamps
+    )
+
+
+class NavIngest:
+    def __init__(self, clock=None, capacity=65536, batch_size=4096, sink=None):
+        """Batched nav parser with per data type ring buffers.
+
+        :param clock: VirtualClock stamping the reception of the samples
+        :param capacity: number of samples kept per data type
+        :param batch_size: lines kept before a batch is parsed automatically
+        :param sink: called with the data type and the array of every batch of
+            valid samples, e.g. to log them
+        """
+
+        self.clock = clock
+        self.sink = sink
+        self.batch_size = batch_size
+        self.buffers = {
+            datatype: RingBuffer(capacity, _nav_dtype(num_values))
+            for datatype, (num_values, _) in NAV_FORMATS.items()
+        }
+        self.received = dict.fromkeys(NAV_FORMATS, 0)
+        self.accepted = dict.fromkeys(NAV_FORMATS, 0)
+        self.no_bottom_lock = 0
+        self.errors = dict.fromkeys(ERROR_REASONS, 0)
+        self._pending = []
+
+    def add(self, rest):
+        """Queue a nav line, without the leading "nav " and the newline."""
+
+        self._pending.append(rest)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Parse the queued lines. Returns the number of invalid lines."""
+
+        if not self._pending:
+            return 0
+        lines = self._pending
+        self._pending = []
+        received_time = self.clock.time_ms() if self.clock is not None else 0
+
+        by_type = {}
+        invalid = 0
+        for line in lines:
+            parts = line.split(" ")
+            if len(parts) < 3:
+                self.errors["field_count"] += 1
+                invalid += 1
+                continue
+            if parts[2] not in NAV_FORMATS:
+                self.errors["unknown_datatype"] += 1
+                invalid += 1
+                continue
+            by_type.setdefault(parts[2], []).append(parts)
+
+        for datatype, rows in by_type.items():
+            invalid += self._ingest(datatype, rows, received_time)
+        return invalid
+
+    def _ingest(self, datatype, rows, received_time):
+        num_values, decimals = NAV_FORMATS[datatype]
+        self.received[datatype] += len(rows)
+
+        count_ok = np.fromiter(
+            (len(r) == num_values + 3 for r in rows), dtype=bool, count=len(rows)
+        )
+        self.errors["field_count"] += int((~count_ok).sum())
+        rows = [r for r, ok in zip(rows, count_ok) if ok]
+        if not rows:
+            return len(count_ok)
+
+        fields = np.array(rows, dtype=str)
+        ts_ok = _valid_timestamps(fields[:, 0]) & _valid_timestamps(fields[:, 1])
+        values = fields[:, 3:]
+        values_ok = _valid_numbers(values, decimals).all(axis=1)
+        self.errors["timestamp"] += int((~ts_ok).sum())
+        self.errors["value_format"] += int((ts_ok & ~values_ok).sum())
+        ok = ts_ok & values_ok
+
+        records = np.zeros(int(ok.sum()), dtype=self.buffers[datatype]._data.dtype)
+        records["system_time"] = fields[ok, 0].astype(np.int64)
+        records["sensor_time"] = fields[ok, 1].astype(np.int64)
+        records["received_time"] = received_time
+        records["values"] = values[ok].astype(np.float64)
+        if len(records) == 0:
+            return len(count_ok)
+
+        # Sensor time must strictly increase within the stream: every record is
+        # compared with the latest time before it, stored samples included.
+        last = self.buffers[datatype].last()
+        latest = np.maximum.accumulate(
+            np.concatenate(
+                (
+                    [np.iinfo(np.int64).min if last is None else last["sensor_time"]],
+                    records["sensor_time"],
+                )
+            )
+        )
+        previous = latest[:-1]
+        monotonic = records["sensor_time"] > previous
+        self.errors["non_monotonic"] += int((~monotonic).sum())
+        records = records[monotonic]
+
+        if datatype == "altitude":
+            no_lock = values[ok][monotonic, 0] == NO_BOTTOM_LOCK
+            self.no_bottom_lock += int(no_lock.sum())
+            records["values"][no_lock] = np.nan
+
+        self.buffers[datatype].extend(records)
+        self.accepted[datatype] += len(records)
+        if self.sink is not None and len(records) > 0:
+            self.sink(datatype, records)
+        return len(count_ok) - len(records)
+
+    def samples(self, datatype):
+        """Stored samples of a data type, oldest first."""
+
+        self.flush()
+        return self.buffers[datatype].view()
+
+    def stream_stats(self, datatype):
+        """Rate, jitter and latency of the stored samples of a data type.
+
+        Rate is in samples per second of sensor time, jitter is the standard
+        deviation of the sensor time between samples, and latency is system time
+        minus sensor time, all in milliseconds.
+        """
+
+        samples = self.samples(datatype)
+        stats = {
+            "received": self.received[datatype],
+            "accepted": self.accepted[datatype],
+            "stored": len(samples),
+            "rate": 0.0,
+            "jitter_ms": 0.0,
+            "latency_ms_mean": 0.0,
+            "latency_ms_p95": 0.0,
+            "latency_ms_max": 0.0,
+        }
+        if len(samples) == 0:
+            return stats
+        latency = samples["system_time"] - samples["sensor_time"]
+        stats["latency_ms_mean"] = float(latency.mean())
+        stats["latency_ms_p95"] = float(np.percentile(latency, 95))
+        stats["latency_ms_max"] = float(latency.max())
+        if len(samples) > 1:
+            intervals = np.diff(samples["sensor_time"])
+            span = samples["sensor_time"][-1] - samples["sensor_time"][0]
+            stats["rate"] = float(1000.0 * (len(samples) - 1) / span)
+            stats["jitter_ms"] = float(intervals.std())
+        return stats
+
+    def stats(self):
+        """Statistics of all the streams and the error counters."""
+
+        self.flush()
+        return {
+            "streams": {
+                datatype: self.stream_stats(datatype) for datatype in NAV_FORMATS
+            },
+            "no_bottom_lock": self.no_bottom_lock,
+            "errors": dict(self.errors),
+        }
@@ -0,0 +1,161 @@
+"""
+Outbound message queue of the BioCam emulator
+
+Messages are queued by priority class so that time requests and command
+acknowledgements are never stuck behind a burst of summaries. The queue can be
+filled from any thread and is drained by the event loop.
+"""
+
+import time
+from collections import deque
+from threading import Lock
+
+# Priority classes, lower values are sent first.
+PRIORITY_TIME = 0
+PRIORITY_ACK = 1
+PRIORITY_STATUS = 2
+PRIORITY_SUMMARY = 3
+
+PRIORITY_NAMES = ("time", "ack", "status", "summary")
+
+
+class MessageOutbox:
+    def __init__(self):
+        """Thread-safe prioritised message queue.
+
+        Every priority class is a FIFO deque. Messages are stored encoded, along
+        with the time they were queued, so that the time they wait before being
+        sent can be accounted for.
+        """
+
+        self._lock = Lock()
+        self._queues = [deque() for _ in PRIORITY_NAMES]
+        self._queued_bytes = 0
+
+        self.enqueued = [0] * len(PRIORITY_NAMES)
+        self.sent = [0] * len(PRIORITY_NAMES)
+        self.sent_bytes = 0
+        self.class_sent_bytes = [0] * len(PRIORITY_NAMES)
+        self.total_wait = [0.0] * len(PRIORITY_NAMES)
+        self.max_wait = [0.0] * len(PRIORITY_NAMES)
+        self.max_depth = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues)
+
+    def put(self, msg, priority=PRIORITY_STATUS):
+        """Queue a message (str or bytes) in the given priority class."""
+
+        if isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        with self._lock:
+            self._queues[priority].append((msg, time.monotonic()))
+            self._queued_bytes += len(msg)
+            self.enqueued[priority] += 1
+            depth = sum(len(q) for q in self._queues)
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def drain(self, budget=None, force_first=False, priorities=None, limit=None):
+        """Pop as many messages as fit in budget bytes, highest priority first.
+
+        :param budget: number of bytes that can be sent now, None for no limit
+        :param force_first: pop the first message even if it exceeds the budget
+        :param priorities: priority classes to drain, all of them by default
+        :param limit: maximum number of messages to pop, None for no limit
+        :return: list of encoded messages, in sending order
+
+        Messages are never split, draining stops at the first message that does
+        not fit in the remaining budget.
+        """
+
+        out = []
+        now = time.monotonic()
+        if priorities is None:
+            priorities = range(len(self._queues))
+        with self._lock:
+            for priority in sorted(priorities):
+                queue = self._queues[priority]
+                while queue:
+                    if limit is not None and len(out) >= limit:
+                        return out
+                    msg, queued_at = queue[0]
+                    if budget is not None and len(msg) > budget:
+                        if out or not force_first:
+                            return out
+                        budget = len(msg)
+                    queue.popleft()
+                    if budget is not None:
+                        budget -= len(msg)
+                    self._account(priority, msg, now - queued_at)
+                    out.append(msg)
+        return out
+
+    def _account(self, priority, msg, wait):
+        self._queued_bytes -= len(msg)
+        self.sent[priority] += 1
+        self.sent_bytes += len(msg)
+        self.class_sent_bytes[priority] += len(msg)
+        self.total_wait[priority] += wait
+        if wait > self.max_wait[priority]:
+            self.max_wait[priority] = wait
+
+    def clear(self, priority):
+        """Drop the queued messages of a priority class, returns how many."""
+
+        with self._lock:
+            queue = self._queues[priority]
+            dropped = len(queue)
+            self._queued_bytes -= sum(len(msg) for msg, _ in queue)
+            queue.clear()
+        return dropped
+
+    def peek_size(self, priorities=None):
+        """Size in bytes of the next message to be sent, None if empty.
+
+        :param priorities: priority classes to look at, all of them by default
+        """
+
+        if priorities is None:
+            priorities = range(len(self._queues))
+        with self._lock:
+            for priority in sorted(priorities):
+                queue = self._queues[priority]
+                if queue:
+                    return len(queue[0][0])
+        return None
+
+    def depth(self, priority=None):
+        """Number of queued messages, in total or for one priority class."""
+
+        with self._lock:
+            if priority is None:
+                return sum(len(q) for q in self._queues)
+            return len(self._queues[priority])
+
+    def stats(self):
+        """Snapshot of the queue depth and wait time counters."""
+
+        with self._lock:
+            now = time.monotonic()
+            classes = {}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                queue = self._queues[priority]
+                sent = self.sent[priority]
+                classes[name] = {
+                    "depth": len(queue),
+                    "enqueued": self.enqueued[priority],
+                    "sent": sent,
+                    "sent_bytes": self.class_sent_bytes[priority],
+                    "mean_wait": self.total_wait[priority] / sent if sent else 0.0,
+                    "max_wait": self.max_wait[priority],
+                    "oldest_wait": now - queue[0][1] if queue else 0.0,
+                }
+            return {
+                "depth": sum(len(q) for q in self._queues),
+                "max_depth": self.max_depth,
+                "queued_bytes": self._queued_bytes,
+                "sent_bytes": self.sent_bytes,
+                "classes": classes,
+            }
@@ -0,0 +1,160 @@
+"""
+Link pacing models
+
+The emulator does not write to its port faster than the modelled link would
+carry the data. A pacer tells how many bytes can be sent right now and how long
+to wait until a given number of bytes can be sent. Rates are given per second
+of the pacer clock, which is the virtual mission clock in the emulator.
+"""
+
+import time
+
+# Largest outbound line: "summary NN " + 2 * 1960 hex characters + "\n"
+MAX_MESSAGE_SIZE = 3932
+
+# Iridium SBD runs at 2400 bit/s on the satellite side.
+IRIDIUM_BITS_PER_SECOND = 2400
+
+
+def serial_bytes_per_second(baudrate, bytesize=8, parity="N", stopbits=1):
+    """Payload bytes per second carried by an asynchronous serial line.
+
+    Every byte is framed with one start bit, the data bits, an optional parity
+    bit and the stop bits, e.g. 57600 baud 8N1 carries 5760 bytes per second.
+    """
+
+    parity_bits = 0 if parity == "N" else 1
+    return baudrate / (1 + bytesize + parity_bits + stopbits)
+
+
+class LinkPacer:
+    """Link without any bandwidth limit."""
+
+    name = "unlimited"
+
+    def __init__(self):
+        self.sent_bytes = 0
+
+    def available(self):
+        """Number of bytes that can be sent now, None if unlimited."""
+
+        return None
+
+    def full(self):
+        """Whether a message larger than the burst size can go out now."""
+
+        return True
+
+    def consume(self, nbytes):
+        """Account for nbytes written to the link."""
+
+        self.sent_bytes += nbytes
+
+    def delay(self, nbytes):
+        """Seconds to wait before nbytes can be sent."""
+
+        return 0.0
+
+
+class TokenBucketPacer(LinkPacer):
+    name = "token_bucket"
+
+    def __init__(self, bytes_per_second, burst=MAX_MESSAGE_SIZE, clock=time.monotonic):
+        """Token bucket pacer.
+
+        :param bytes_per_second: sustained link throughput
+        :param burst: bucket size in bytes
+        :param clock: monotonic time source in seconds
+
+        Messages are never split: a message larger than the bucket is let
+        through when the bucket is full and leaves it in debt, so the average
+        throughput is still bytes_per_second.
+        """
+
+        super().__init__()
+        self.rate = float(bytes_per_second)
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def available(self):
+        self._refill()
+        return max(0, int(self.tokens))
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def consume(self, nbytes):
+        self._refill()
+        self.tokens -= nbytes
+        self.sent_bytes += nbytes
+
+    def delay(self, nbytes):
+        self._refill()
+        missing = min(nbytes, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+
+class SerialLinkPacer(TokenBucketPacer):
+    name = "serial"
+
+    def __init__(self, baudrate=57600, bytesize=8, parity="N", stopbits=1, **kwargs):
+        """Pacer for an RS232 line, including start, parity and stop bits."""
+
+        self.baudrate = baudrate
+        super().__init__(
+            serial_bytes_per_second(baudrate, bytesize, parity, stopbits), **kwargs
+        )
+
+
+def rs232_pacer(**kwargs):
+    """BioCam RS232 link: 57600 baud 8N1."""
+
+    pacer = SerialLinkPacer(57600, **kwargs)
+    pacer.name = "rs232"
+    return pacer
+
+
+def iridium_pacer(**kwargs):
+    """RS232 link followed by an Iridium SBD hop, the satellite is the bottleneck."""
+
+    pacer = TokenBucketPacer(IRIDIUM_BITS_PER_SECOND / 8, burst=340, **kwargs)
+    pacer.name = "iridium"
+    return pacer
+
+
+def unlimited_pacer(**kwargs):
+    """No bandwidth limit."""
+
+    return LinkPacer()
+
+
+LINK_PRESETS = {
+    "unlimited": unlimited_pacer,
+    "rs232": rs232_pacer,
+    "iridium": iridium_pacer,
+}
+
+
+def make_pacer(name, clock=None):
+    """Create a pacer from its preset name.
+
+    :param name: preset name, one of LINK_PRESETS
+    :param clock: monotonic time source in seconds, real time if None
+    """
+
+    kwargs = {}
+    if clock is not None:
+        kwargs["clock"] = clock
+    if name not in LINK_PRESETS:
+        raise ValueError(
+            "Unknown link preset " + name + ", use one of " + ", ".join(LINK_PRESETS)
+        )
+    return LINK_PRESETS[name](**kwargs)
@@ -0,0 +1,113 @@
+"""
+Serial link traffic recording
+
+Every frame (line) received and sent by the emulator is appended to a compact
+binary log, with the time it went through and its direction:
+
+    magic "BCTR" | version u32 | start time f64 | time scale f64  (24 bytes header)
+    time us u64 | direction u8 | length u32 | frame                (for every frame)
+
+Times are microseconds since the start of the recording on the emulator
+monotonic clock, which runs time scale times faster than real time. All the
+integers are little endian. Frames are buffered in memory and written in large
+blocks, so recording costs a struct pack and a copy per frame.
+"""
+
+import struct
+import time
+from pathlib import Path
+
+RECORDING_MAGIC = b"BCTR"
+RECORDING_VERSION = 1
+
+INBOUND = 0
+OUTBOUND = 1
+
+_HEADER = struct.Struct("<4sIdd")
+_FRAME = struct.Struct("<QBI")
+
+
+class TrafficRecordingException(Exception):
+    """Exceptions raised from this module."""
+
+
+class TrafficRecorder:
+    def __init__(self, path, clock=time.monotonic, time_scale=1.0, buffer_size=1 << 16):
+        """Buffered writer of a traffic recording.
+
+        :param path: recording file to write
+        :param clock: monotonic time source in seconds, e.g. the mission clock
+        :param time_scale: how many times faster than real time the clock runs
+        :param buffer_size: bytes kept in memory before they are written
+        """
+
+        self.path = Path(path)
+        self.buffer_size = buffer_size
+        self.frames = 0
+        self._clock = clock
+        self._start = clock()
+        self._buffer = bytearray(
+            _HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, time.time(), time_scale)
+        )
+        self._file = open(self.path, "wb")
+
+    def record(self, direction, frame):
+        """Append a frame, bytes or str, going in the given direction."""
+
+        if self._file is None:
+            return
+        if isinstance(frame, str):
+            frame = frame.encode("ascii", errors="replace")
+        elapsed_us = int((self._clock() - self._start) * 1e6)
+        self._buffer += _FRAME.pack(elapsed_us, direction, len(frame))
+        self._buffer += frame
+        self.frames += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._file is None or not self._buffer:
+            return
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_recording(path):
+    """Read a whole recording.
+
+    Returns the wall clock start time of the recording, the time scale of its
+    clock and a list of (time in seconds of that clock, direction, frame bytes)
+    tuples, in recording order.
+    """
+
+    data = Path(path).read_bytes()
+    if len(data) < _HEADER.size:
+        raise TrafficRecordingException(str(path) + " is not a traffic recording")
+    magic, version, start_time, time_scale = _HEADER.unpack_from(data, 0)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise TrafficRecordingException(str(path) + " is not a version 1 recording")
+    offset = _HEADER.size
+    frames = []
+    while offset + _FRAME.size <= len(data):
+        elapsed_us, direction, length = _FRAME.unpack_from(data, offset)
+        offset += _FRAME.size
+        frame = data[offset : offset + length]
+        if len(frame) < length:
+            # Truncated by a crash, keep the complete frames
+            break
+        offset += length
+        frames.append((elapsed_us / 1e6, direction, frame))
+    return start_time, time_scale, frames
@@ -0,0 +1,190 @@
+"""
+Replay of recorded serial link traffic
+
+The inbound frames of a recording are sent again, at the recorded pace, N times
+faster or as fast as possible, either straight to the command dispatcher of an
+in-process emulator or onto the port of a running one. The acknowledgements the
+emulator sends back are compared with the recorded ones, which turns real
+mission traffic into a regression test.
+"""
+
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+
+from .emulator import BioCamEmulator
+from .recorder import INBOUND, OUTBOUND, read_recording
+from .timesync import TIME_REQUEST
+from .transports import MemoryTransport
+
+# Seconds to wait for the last responses when replaying onto a port
+SETTLE_TIME = 1.0
+
+# Mismatches listed in the report
+MAX_MISMATCHES = 20
+
+
+def _is_ack(frame):
+    return frame.startswith(b"$") and frame != TIME_REQUEST
+
+
+def _pace(start, elapsed, speed, time_scale):
+    """Sleep until the frame recorded at elapsed mission clock seconds is due."""
+
+    if speed is None:
+        return
+    delay = start + elapsed / (time_scale * speed) - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def diff_responses(expected, received):
+    """Compare two lists of response frames, in order."""
+
+    mismatches = []
+    for i, (a, b) in enumerate(zip(expected, received)):
+        if a != b and len(mismatches) < MAX_MISMATCHES:
+            mismatches.append(
+                {
+                    "index": i,
+                    "expected": a.decode(errors="replace"),
+                    "received": b.decode(errors="replace"),
+                }
+            )
+    return {
+        "expected": len(expected),
+        "received": len(received),
+        "matching": sum(a == b for a, b in zip(expected, received)),
+        "missing": max(0, len(expected) - len(received)),
+        "unexpected": max(0, len(received) - len(expected)),
+        "mismatches": mismatches,
+    }
+
+
+def replay_commands(frames, speed=None, emulator=None, time_scale=1.0):
+    """Feed the inbound frames to the command dispatcher of an emulator.
+
+    :param frames: frames of a recording, see read_recording()
+    :param speed: replay speed factor, None for as fast as possible
+    :param emulator: emulator to replay to, a new quiet one by default
+    :param time_scale: time scale of the recording clock
+    :return: list of the acknowledgements sent back
+    """
+
+    own_emulator = emulator is None
+    if own_emulator:
+        emulator = BioCamEmulator(transport=MemoryTransport(), verbose=False)
+    responses = []
+    try:
+        start = time.perf_counter()
+        for elapsed, direction, frame in frames:
+            if direction != INBOUND:
+                continue
+            _pace(start, elapsed, speed, time_scale)
+            response = emulator.check_command(frame.decode("ascii", errors="replace"))
+            if response is not None:
+                responses.append(response.encode())
+    finally:
+        if own_emulator:
+            emulator.close()
+    return responses
+
+
+def replay_port(frames, port, speed=None, settle_time=SETTLE_TIME, time_scale=1.0):
+    """Send the inbound frames onto the port of a running emulator.
+
+    :param frames: frames of a recording, see read_recording()
+    :param port: serial port name or pyserial URL, e.g. socket://host:port
+    :param speed: replay speed factor, None for as fast as possible
+    :param settle_time: seconds to wait for the last responses
+    :param time_scale: time scale of the recording clock
+    :return: list of the acknowledgements received
+    """
+
+    import serial
+
+    responses = []
+    done = threading.Event()
+    link = serial.serial_for_url(port, baudrate=57600, timeout=0.1)
+
+    def read_responses():
+        while not done.is_set():
+            line = link.readline()
+            if line and _is_ack(line):
+                responses.append(line)
+
+    reader = threading.Thread(target=read_responses, daemon=True)
+    reader.start()
+    try:
+        start = time.perf_counter()
+        for elapsed, direction, frame in frames:
+            if direction != INBOUND:
+                continue
+            _pace(start, elapsed, speed, time_scale)
+            link.write(frame)
+        time.sleep(settle_time)
+    finally:
+        done.set()
+        reader.join()
+        link.close()
+    return responses
+
+
+def replay(path, speed=None, port=None):
+    """Replay a recording and diff the acknowledgements.
+
+    :param path: traffic recording
+    :param speed: replay speed factor, None for as fast as possible
+    :param port: port of a running emulator, None to replay in-process
+    :return: report dict
+    """
+
+    _, time_scale, frames = read_recording(path)
+    expected = [f for _, d, f in frames if d == OUTBOUND and _is_ack(f)]
+    start = time.perf_counter()
+    if port is None:
+        received = replay_commands(frames, speed, time_scale=time_scale)
+    else:
+        received = replay_port(frames, port, speed, time_scale=time_scale)
+    report = {
+        "recording": str(path),
+        "frames_in": sum(d == INBOUND for _, d, _ in frames),
+        "frames_out": sum(d == OUTBOUND for _, d, _ in frames),
+        "recorded_duration": frames[-1][0] / time_scale if frames else 0.0,
+        "time_scale": time_scale,
+        "replay_duration": time.perf_counter() - start,
+        "speed": "max" if speed is None else speed,
+    }
+    report.update(diff_responses(expected, received))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a BioCam traffic recording and compare the responses"
+    )
+    parser.add_argument("recording", type=Path, help="traffic recording to replay")
+    parser.add_argument(
+        "--speed",
+        default="1",
+        help="replay speed factor, or max for as fast as possible (default: 1)",
+    )
+    parser.add_argument(
+        "--port",
+        default=None,
+        help="port of a running emulator (device or pyserial URL), the "
+        "recording is replayed in-process if not given",
+    )
+    args = parser.parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+
+    report = replay(args.recording, speed=speed, port=args.port)
+    print(json.dumps(report, indent=2))
+    if report["mismatches"] or report["missing"] or report["unexpected"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+Scripted scenarios
+
+A scenario drives one in-process emulator through a MemoryTransport: it sends
+timed commands and nav streams, then checks the acknowledgements, the operation
+mode transitions (BioCamStateMachine modes 0 to 10), the status reports and the
+summaries sent back. Scenarios are written in YAML (needs PyYAML), JSON or
+Python (a module defining SCENARIOS, a list of scenario dicts):
+
+    name: map then send summaries
+    seed: 1
+    link: rs232             # link preset, see pacing.py
+    time_scale: 1000        # mission seconds per real second
+    matrix:                 # one run per combination of these keys
+      link: [rs232, unlimited]
+    emulator:               # emulator periods and delays, in mission seconds
+      report_status_period: 10
+    steps:                  # at: mission seconds since the start
+      - {at: 0, send: "*bc_start_mapping"}
+      - {at: 5, nav: depth, period: 1, count: 60, values: [12.5]}
+      - {at: 70, expect_state: 4}
+      - {at: 80, send: "*bc_start_summaries -1 -1"}
+    end: 300                # mission seconds the scenario runs for
+    expect:
+      acks: ["$bc_start_mapping", "$bc_start_summaries -1 -1"]
+      states: [4, 9, 10, 1] # in this order, other transitions may come between
+      status: {min_count: 3, last_mode: 1}
+      summaries: {count: 43, done: true, verified: true}
+      nav: {depth: 60}      # accepted samples by data type
+
+The runner executes a list of scenarios, matrices expanded, in a process pool,
+each with its own emulator, transport and event loop, and gathers the results
+and timings into one JSON report:
+
+    biocam_scenarios scenarios/*.yaml --workers 8 --report report.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import runpy
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .clock import VirtualClock
+from .emulator import BioCamEmulator
+from .nav import NAV_FORMATS
+from .pacing import make_pacer
+from .transports import MemoryTransport
+from .verify import SummaryVerifier
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULT_TIME_SCALE = 1000.0
+
+# Mission seconds a scenario runs for after its last step, without an end
+DEFAULT_SETTLE = 60.0
+
+# Real seconds a scenario may run for
+DEFAULT_TIMEOUT = 60.0
+
+# Emulator attributes a scenario can set
+EMULATOR_SETTINGS = (
+    "report_status_period",
+    "request_time_period",
+    "image_counters_period",
+    "compute_summaries_delay",
+    "get_summaries_delay",
+)
+
+
+def load_scenarios(path):
+    """Scenarios of a YAML, JSON or Python file, as a list of dicts."""
+
+    path = Path(path)
+    if path.suffix == ".py":
+        scenarios = runpy.run_path(str(path))["SCENARIOS"]
+    elif path.suffix in (".yaml", ".yml"):
+        if yaml is None:
+            raise ValueError("YAML scenarios need PyYAML, use JSON or Python")
+        with open(path) as f:
+            scenarios = [s for s in yaml.safe_load_all(f) if s is not None]
+        if len(scenarios) == 1 and isinstance(scenarios[0], list):
+            scenarios = scenarios[0]
+    elif path.suffix == ".json":
+        with open(path) as f:
+            scenarios = json.load(f)
+    else:
+        raise ValueError("Unknown scenario format " + path.suffix)
+    if isinstance(scenarios, dict):
+        scenarios = [scenarios]
+    for i, scenario in enumerate(scenarios):
+        scenario.setdefault("name", path.stem + "_" + str(i))
+    return scenarios
+
+
+def expand_matrix(scenario):
+    """One scenario per combination of the values of its matrix."""
+
+    matrix = scenario.get("matrix")
+    if not matrix:
+        return [scenario]
+    keys = sorted(matrix)
+    variants = []
+    for values in itertools.product(*(matrix[k] for k in keys)):
+        params = dict(zip(keys, values))
+        variant = {k: v for k, v in scenario.items() if k != "matrix"}
+        variant.update(params)
+        variant["name"] = (
+            scenario.get("name", "scenario")
+            + "["
+            + ",".join(k + "=" + str(v) for k, v in params.items())
+            + "]"
+        )
+        variant["params"] = params
+        variants.append(variant)
+    return variants
+
+
+def _is_subsequence(expected, observed):
+    observed = iter(observed)
+    return all(any(item == o for o in observed) for item in expected)
+
+
+class ScenarioRun:
+    def __init__(self, scenario):
+        """One run of a scenario, on its own emulator and event loop.
+
+        :param scenario: scenario dict, see the module documentation
+        """
+
+        self.scenario = scenario
+        self.clock = VirtualClock(scenario.get("time_scale", DEFAULT_TIME_SCALE))
+        self.transport = MemoryTransport()
+        summaries = None
+        if "synthetic" in scenario:
+            from .synthetic import SyntheticSummaries
+
+            summaries = SyntheticSummaries(
+                scenario["synthetic"], seed=scenario.get("seed", 0)
+            )
+        elif "summaries" in scenario:
+            summaries = Path(scenario["summaries"])
+        self.emulator = BioCamEmulator(
+            pacer=make_pacer(scenario.get("link", "rs232"), clock=self.clock.monotonic),
+            seed=scenario.get("seed", 0),
+            summaries=summaries,
+            wrap_ids=scenario.get("wrap_ids"),
+            clock=self.clock,
+            transport=self.transport,
+            verbose=False,
+        )
+        for name, value in scenario.get("emulator", {}).items():
+            if name not in EMULATOR_SETTINGS:
+                raise ValueError("Unknown emulator setting " + name)
+            setattr(self.emulator, name, value)
+
+        self.lines = []  # (mission time, line) received by the vehicle side
+        self.states = []
+        self.failures = []
+        self.counts = {}
+        self._buffer = b""
+        self.emulator.mode.add_listener(lambda old, new: self.states.append(new))
+
+    def _client_ready(self):
+        try:
+            data = self.transport.client.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not data:
+            return
+        now = self.clock.monotonic()
+        *lines, self._buffer = (self._buffer + data).split(b"\n")
+        self.lines.extend((now, line) for line in lines)
+
+    def _send(self, line):
+        self.transport.client.sendall(line.encode() + b"\n")
+
+    def _send_nav(self, datatype, values, remaining, period):
+        decimals = NAV_FORMATS[datatype][1]
+        system_time = self.clock.time_ms()
+        self._send(
+            "nav %d %d %s " % (system_time, system_time, datatype)
+            + " ".join("%.*f" % (decimals, v) for v in values)
+        )
+        if remaining > 1:
+            self.emulator.loop.call_later(
+                period, self._send_nav, datatype, values, remaining - 1, period
+            )
+
+    def _expect_state(self, at, state):
+        if self.emulator.mode.state != state:
+            self.failures.append(
+                "state at %gs is %d, expected %d"
+                % (at, self.emulator.mode.state, state)
+            )
+
+    def _schedule(self, step):
+        loop = self.emulator.loop
+        at = step.get("at", 0.0)
+        if "send" in step:
+            loop.call_later(at, self._send, step["send"])
+        elif "nav" in step:
+            datatype = step["nav"]
+            if datatype not in NAV_FORMATS:
+                raise ValueError("Unknown nav data type " + datatype)
+            values = step.get("values", [0.0] * NAV_FORMATS[datatype][0])
+            loop.call_later(
+                at,
+                self._send_nav,
+                datatype,
+                values,
+                step.get("count", 1),
+                step.get("period", 1.0),
+            )
+        elif "expect_state" in step:
+            loop.call_later(at, self._expect_state, at, step["expect_state"])
+        else:
+            raise ValueError("Unknown step " + str(step))
+
+    def run(self):
+        """Run the steps until the end of the scenario, then check it."""
+
+        scenario = self.scenario
+        steps = scenario.get("steps", [])
+        end = scenario.get(
+            "end", max((s.get("at", 0.0) for s in steps), default=0.0) + DEFAULT_SETTLE
+        )
+        timeout = scenario.get("timeout", DEFAULT_TIMEOUT)
+        start = time.perf_counter()
+        self.transport.client.setblocking(False)
+        self.emulator.start()
+        self.emulator.loop.add_reader(self.transport.client, self._client_ready)
+        try:
+            for step in steps:
+                self._schedule(step)
+            while self.clock.monotonic() < end:
+                if time.perf_counter() - start > timeout:
+                    self.failures.append("timed out after %gs" % timeout)
+                    break
+                self.emulator.emulate_step(0.01)
+            self.check(scenario.get("expect", {}))
+        finally:
+            self.emulator.loop.remove_reader(self.transport.client)
+            self.emulator.close()
+        return time.perf_counter() - start
+
+    def check(self, expect):
+        """Add the failed expectations to self.failures."""
+
+        lines = [line.rstrip(b"\r") for _, line in self.lines]
+        acks = [
+            line.decode(errors="replace")
+            for line in lines
+            if line.startswith(b"$") and not line.startswith(b"$time")
+        ]
+        statuses = [line.split(b" ") for line in lines if line.startswith(b"status")]
+        summaries = [line for line in lines if line.startswith(b"summary")]
+
+        if "acks" in expect and not _is_subsequence(expect["acks"], acks):
+            self.failures.append(
+                "acks %s not received in order, got %s" % (expect["acks"], acks)
+            )
+        if "states" in expect and not _is_subsequence(expect["states"], self.states):
+            self.failures.append(
+                "states %s not reached in order, got %s"
+                % (expect["states"], self.states)
+            )
+
+        status = expect.get("status", {})
+        if len(statuses) < status.get("min_count", 0):
+            self.failures.append(
+                "%d status reports, expected at least %d"
+                % (len(statuses), status["min_count"])
+            )
+        if "last_mode" in status:
+            last_mode = int(statuses[-1][1]) if statuses else None
+            if last_mode != status["last_mode"]:
+                self.failures.append(
+                    "last status mode is %s, expected %d"
+                    % (last_mode, status["last_mode"])
+                )
+
+        expected = expect.get("summaries", {})
+        verifier = SummaryVerifier(self.emulator.remote_awareness_data)
+        done = False
+        for line in summaries:
+            done = verifier.add_line(line) or done
+        report = verifier.report()
+        if "count" in expected and report["received_lines"] != expected["count"]:
+            self.failures.append(
+                "%d summaries, expected %d"
+                % (report["received_lines"], expected["count"])
+            )
+        if "done" in expected and done != expected["done"]:
+            self.failures.append(
+                "summary done %sreceived" % ("not " if expected["done"] else "")
+            )
+        if expected.get("verified") and (
+            report["corrupt_ids"] or report["malformed_lines"]
+        ):
+            self.failures.append(
+                "corrupt summaries %s, %d malformed lines"
+                % (report["corrupt_ids"], report["malformed_lines"])
+            )
+
+        for datatype, count in expect.get("nav", {}).items():
+            accepted = self.emulator.nav.accepted.get(datatype, 0)
+            if accepted != count:
+                self.failures.append(
+                    "%d %s nav samples accepted, expected %d"
+                    % (accepted, datatype, count)
+                )
+
+        self.counts = {
+            "acks": len(acks),
+            "status": len(statuses),
+            "summaries": report["received_lines"],
+            "summaries_verified": report["verified"],
+            "transitions": len(self.states),
+        }
+
+
+def run_scenario(scenario):
+    """Run one scenario, return its result as a JSON compatible dict."""
+
+    result = {"name": scenario.get("name"), "params": scenario.get("params", {})}
+    try:
+        run = ScenarioRun(scenario)
+        result["duration"] = run.run()
+        result["mission_time"] = run.clock.monotonic()
+        result["states"] = run.states
+        result["counts"] = run.counts
+        result["failures"] = run.failures
+    except Exception as e:
+        result["failures"] = ["error: " + type(e).__name__ + ": " + str(e)]
+    result["passed"] = not result["failures"]
+    return result
+
+
+def run_scenarios(scenarios, workers=None):
+    """Run scenarios in parallel, one process per worker.
+
+    :param scenarios: scenario dicts, matrices are expanded
+    :param workers: number of processes, the number of CPUs by default, 0 to
+        run them one after the other in this process
+    :return: report with the results in the order of the scenarios
+    """
+
+    scenarios = [v for s in scenarios for v in expand_matrix(s)]
+    start = time.perf_counter()
+    if workers == 0:
+        results = [run_scenario(s) for s in scenarios]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_scenario, scenarios))
+    passed = sum(r["passed"] for r in results)
+    return {
+        "scenarios": len(results),
+        "passed": passed,
+        "failed": len(results) - passed,
+        "workers": workers if workers is not None else os.cpu_count(),
+        "duration": time.perf_counter() - start,
+        "scenario_time": sum(r.get("duration", 0.0) for r in results),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run BioCam emulator scenarios in parallel"
+    )
+    parser.add_argument(
+        "scenarios", type=Path, nargs="+", help="YAML, JSON or Python scenario files"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes, 0 to run in this process (default: number "
+        "of CPUs)",
+    )
+    parser.add_argument(
+        "--report", type=Path, default=None, help="write the JSON report to this file"
+    )
+    args = parser.parse_args()
+
+    scenarios = []
+    for path in args.scenarios:
+        scenarios.extend(load_scenarios(path))
+    report = run_scenarios(scenarios, args.workers)
+    for result in report["results"]:
+        print(
+            "PASS" if result["passed"] else "FAIL",
+            result["name"],
+            "(%.2fs)" % result.get("duration", 0.0),
+        )
+        for failure in result["failures"]:
+            print("   ", failure)
+    print(
+        report["passed"],
+        "passed,",
+        report["failed"],
+        "failed in %.2fs" % report["duration"],
+        "(%.2fs of scenarios)" % report["scenario_time"],
+    )
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Timer scheduler of the BioCam emulator
+
+All the delayed and periodic actions of the emulator (status reports, time
+requests, image counters, summary transfers) are kept in a single heap, which
+the event loop serves from its own thread. No thread is created per timer.
+"""
+
+import heapq
+import itertools
+from threading import Lock
+
+from .clock import VirtualClock
+
+
+class TimerHandle:
+    __slots__ = ("when", "callback", "args", "period", "cancelled")
+
+    def __init__(self, when, callback, args, period=None):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.period = period
+        self.cancelled = False
+
+    def cancel(self):
+        """Prevent any further run of the callback. Safe to call twice."""
+
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self, clock=None, on_new_deadline=None, on_error=None):
+        """Heap of timers.
+
+        :param clock: VirtualClock the deadlines are given in, real time if None
+        :param on_new_deadline: called when a timer earlier than all the others
+            is added, used to wake up the thread waiting for the next deadline
+        :param on_error: called with the callback and the exception when a
+            timer callback raises, the exception propagates if None
+
+        Timers can be added and cancelled from any thread. run_due() must be
+        called by a single thread, which runs the callbacks.
+        """
+
+        if clock is None:
+            clock = VirtualClock()
+        self.clock = clock
+        self.on_new_deadline = on_new_deadline
+        self.on_error = on_error
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._closed = False
+
+        # Lag between the deadline of a timer and the time it actually ran, in
+        # virtual seconds.
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.runs = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for _, _, handle in self._heap if not handle.cancelled)
+
+    def _push(self, handle):
+        with self._lock:
+            if self._closed:
+                handle.cancelled = True
+                return handle
+            heapq.heappush(self._heap, (handle.when, next(self._seq), handle))
+            is_first = self._heap[0][2] is handle
+        if is_first and self.on_new_deadline is not None:
+            self.on_new_deadline()
+        return handle
+
+    def call_at(self, when, callback, *args):
+        """Run callback(*args) at clock time when."""
+
+        return self._push(TimerHandle(when, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds."""
+
+        return self._push(TimerHandle(self.clock.monotonic() + delay, callback, args))
+
+    def call_every(self, period, callback, *args, delay=None):
+        """Run callback(*args) every period seconds.
+
+        The first run happens after delay seconds, one period by default. Runs
+        are scheduled from the previous deadline, so they do not drift.
+        """
+
+        if delay is None:
+            delay = period
+        return self._push(
+            TimerHandle(self.clock.monotonic() + delay, callback, args, period)
+        )
+
+    def next_timeout(self):
+        """Real seconds until the next deadline, None if there are no timers."""
+
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            when = self._heap[0][0]
+        return max(0.0, self.clock.to_real(when - self.clock.monotonic()))
+
+    def run_due(self):
+        """Run the callbacks of all the timers whose deadline has passed."""
+
+        now = self.clock.monotonic()
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    return
+                _, _, handle = heapq.heappop(self._heap)
+                if handle.cancelled:
+                    continue
+                deadline = handle.when
+                if handle.period is not None:
+                    handle.when += handle.period
+                    if handle.when <= now:
+                        # Too far behind, skip the missed runs.
+                        handle.when = now + handle.period
+                    heapq.heappush(self._heap, (handle.when, next(self._seq), handle))
+            self.last_lag = now - deadline
+            if self.last_lag > self.max_lag:
+                self.max_lag = self.last_lag
+            self.runs += 1
+            if self.on_error is None:
+                handle.callback(*handle.args)
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                self.on_error(handle.callback, e)
+
+    def shutdown(self):
+        """Cancel all the timers and refuse new ones."""
+
+        with self._lock:
+            self._closed = True
+            for _, _, handle in self._heap:
+                handle.cancelled = True
+            self._heap = []
@@ -0,0 +1,140 @@
+"""
+Synthetic summary generator
+
+Generates any number of random summaries to load test the topside parser. The
+summary sizes are drawn up front, the summary bytes are generated and
+hex-encoded in blocks with NumPy the first time a block is needed. Every block
+has its own seed, so any summary can be regenerated without generating the
+ones before it, and millions of summaries do not need to fit in memory.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+# Largest summary allowed by the protocol, in bytes.
+MAX_SUMMARY_SIZE = 1960
+
+SIZE_DISTRIBUTIONS = ("uniform", "normal", "fixed", "empirical")
+
+_HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+_HEX_TABLE = np.stack(
+    (_HEX_DIGITS[np.arange(256) >> 4], _HEX_DIGITS[np.arange(256) & 0x0F]), axis=1
+)
+
+
+def hex_encode(data):
+    """Upper case hex encoding of a uint8 array, as a uint8 array twice as long."""
+
+    return _HEX_TABLE[np.asarray(data, dtype=np.uint8)].reshape(-1)
+
+
+class SyntheticSummaries:
+    def __init__(
+        self,
+        count,
+        seed=0,
+        size_distribution="uniform",
+        min_size=0,
+        max_size=MAX_SUMMARY_SIZE,
+        mean_size=None,
+        std_size=None,
+        sizes=None,
+        boundary_cases=True,
+        block_size=4096,
+        cache_blocks=4,
+    ):
+        """Seeded source of random summaries.
+
+        :param count: number of summaries
+        :param seed: seed of the generator, same seed gives the same summaries
+        :param size_distribution: uniform, normal, fixed (always max_size) or
+            empirical (drawn from the sizes argument)
+        :param min_size: smallest summary in bytes
+        :param max_size: largest summary in bytes
+        :param mean_size: mean of the normal distribution (default: midpoint)
+        :param std_size: standard deviation of the normal distribution
+        :param sizes: sample of sizes for the empirical distribution
+        :param boundary_cases: make the first summaries exactly max_size bytes,
+            empty, and one byte long
+        :param block_size: number of summaries generated at once
+        :param cache_blocks: number of generated blocks kept in memory
+
+        Exposes the same interface as SummaryArchive, so it can be used as the
+        source of RemoteAwarenessData.
+        """
+
+        if size_distribution not in SIZE_DISTRIBUTIONS:
+            raise ValueError(
+                "Unknown size distribution "
+                + str(size_distribution)
+                + ", use one of "
+                + ", ".join(SIZE_DISTRIBUTIONS)
+            )
+        self.count = count
+        self.seed = seed
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._blocks = OrderedDict()
+
+        rng = np.random.default_rng(seed)
+        if size_distribution == "uniform":
+            self.sizes = rng.integers(min_size, max_size + 1, size=count)
+        elif size_distribution == "normal":
+            if mean_size is None:
+                mean_size = (min_size + max_size) / 2
+            if std_size is None:
+                std_size = (max_size - min_size) / 6
+            self.sizes = np.rint(rng.normal(mean_size, std_size, size=count))
+        elif size_distribution == "fixed":
+            self.sizes = np.full(count, max_size)
+        else:
+            if sizes is None or len(sizes) == 0:
+                raise ValueError("The empirical distribution needs a sample of sizes")
+            self.sizes = rng.choice(np.asarray(sizes), size=count)
+        self.sizes = np.clip(self.sizes, min_size, max_size).astype(np.int64)
+
+        if boundary_cases:
+            edges = np.array([max_size, 0, 1], dtype=np.int64)[:count]
+            self.sizes[: len(edges)] = edges
+
+        self.offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+
+    def __len__(self):
+        return self.count
+
+    def _block(self, block_idx):
+        block = self._blocks.get(block_idx)
+        if block is not None:
+            self._blocks.move_to_end(block_idx)
+            return block
+        first = block_idx * self.block_size
+        last = min(first + self.block_size, self.count)
+        base = self.offsets[first]
+        rng = np.random.default_rng((self.seed, block_idx))
+        raw = rng.integers(
+            0, 256, size=int(self.offsets[last] - base), dtype=np.uint8
+        ).tobytes()
+        block = (base, raw, hex_encode(np.frombuffer(raw, np.uint8)).tobytes())
+        self._blocks[block_idx] = block
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def raw(self, idx):
+        """Bytes of summary idx."""
+
+        base, raw, _ = self._block(int(idx) // self.block_size)
+        start = int(self.offsets[idx] - base)
+        return raw[start : start + int(self.sizes[idx])]
+
+    def hex(self, idx):
+        """Summary idx as upper case hex bytes."""
+
+        base, _, hex_data = self._block(int(idx) // self.block_size)
+        start = 2 * int(self.offsets[idx] - base)
+        return hex_data[start : start + 2 * int(self.sizes[idx])]
+
+    def close(self):
+        self._blocks.clear()
@@ -0,0 +1,153 @@
+"""
+Status telemetry model
+
+The values of the status messages are drawn from seeded, precomputed mission
+long series, so that a run is reproducible and a status costs a few array
+lookups and one formatting of a fixed-width byte template:
+
+- CPU and camera temperatures drift towards a target that depends on the
+  operation mode (the cameras cool down to ambient when not acquiring, the CPU
+  heats up when computing summaries), plus smoothed noise.
+- Image scores vary slowly while mapping and keep their last value otherwise.
+- The available disk space shrinks with the number of images of each camera.
+
+The series can be shared by several emulators (e.g. a fleet), each one starting
+at a different offset.
+"""
+
+import numpy as np
+
+# status operation_mode number_images_cam0 number_images_cam1 score_cam0
+# score_cam1 cpu_temperature cam0_temperature cam1_temperature
+# available_disk_space, zero padded as in protocol.md
+STATUS_TEMPLATE = b"status %d %08d %08d %05d %05d %02d %02d %02d %013d\n"
+
+MISSION_DURATION = 30 * 24 * 3600  # 30 days
+STATUS_PERIOD = 60
+
+AMBIENT_TEMPERATURE = 8.0  # water temperature inside the housing
+# Target temperatures (cpu, cameras) by operation mode, laser state excluded
+TARGET_TEMPERATURES = {
+    0: (AMBIENT_TEMPERATURE, AMBIENT_TEMPERATURE),  # shut down
+    1: (38.0, AMBIENT_TEMPERATURE),  # idle
+    2: (50.0, 40.0),  # camera calibration
+    3: (50.0, 40.0),  # laser calibration
+    4: (58.0, 44.0),  # mapping
+    9: (75.0, AMBIENT_TEMPERATURE),  # computing summaries
+    10: (45.0, AMBIENT_TEMPERATURE),  # sending summaries
+}
+THERMAL_TIME_CONSTANT = 600.0  # seconds
+
+# Image scores while mapping, mean and spread
+SCORE_CAM0 = (700.0, 150.0)
+SCORE_CAM1 = (6500.0, 750.0)
+
+DISK_CAPACITY = 1_900_000_000_000
+BYTES_PER_IMAGE_CAM0 = 40_000
+BYTES_PER_IMAGE_CAM1 = 1_000_000
+# Logs and navigation data written whatever the mode
+LOG_BYTES_PER_HOUR = 300_000_000
+
+
+def _smoothed_noise(rng, size, window, count):
+    """count series of zero mean, unit variance, slowly varying noise."""
+
+    noise = rng.standard_normal((count, size + window))
+    kernel = np.ones(window) / np.sqrt(window)
+    return np.stack([np.convolve(n, kernel, mode="valid")[:size] for n in noise])
+
+
+class TelemetryModel:
+    def __init__(self, seed=0, duration=MISSION_DURATION, period=STATUS_PERIOD):
+        """Precomputed noise and score series of a whole mission.
+
+        :param seed: seed of the series
+        :param duration: mission seconds covered, the series repeat after
+        :param period: seconds between two status messages
+        """
+
+        self.seed = seed
+        self.period = period
+        self.size = max(1, int(duration // period))
+        rng = np.random.default_rng(seed)
+        # Temperature noise in degrees, smoothed over 10 periods
+        noise = _smoothed_noise(rng, self.size, 10, 3).astype(np.float32)
+        self.cpu_noise, self.cam0_noise, self.cam1_noise = noise * 1.5
+        # Scores, smoothed over 5 periods
+        scores = _smoothed_noise(rng, self.size, 5, 2)
+        self.score_cam0 = np.clip(
+            SCORE_CAM0[0] + SCORE_CAM0[1] * scores[0], 0, 65535
+        ).astype(np.uint16)
+        self.score_cam1 = np.clip(
+            SCORE_CAM1[0] + SCORE_CAM1[1] * scores[1], 0, 65535
+        ).astype(np.uint16)
+        self.alpha = 1.0 - np.exp(-period / THERMAL_TIME_CONSTANT)
+
+
+class StatusTelemetry:
+    def __init__(
+        self,
+        model=None,
+        seed=0,
+        offset=0,
+        disk_capacity=DISK_CAPACITY,
+        period=STATUS_PERIOD,
+    ):
+        """Status values of one BioCam, advanced once per status message.
+
+        :param model: TelemetryModel to read the series from, a new one seeded
+            with seed by default
+        :param seed: seed of the new model
+        :param period: seconds between two status messages of the new model
+        :param offset: index the series are read from first
+        :param disk_capacity: available disk space in bytes before any image
+        """
+
+        if model is None:
+            model = TelemetryModel(seed, period=period)
+        self.model = model
+        self.disk_capacity = disk_capacity
+        self.tick = offset % model.size
+        self.cpu_temperature = TARGET_TEMPERATURES[1][0]
+        self.cam_temperature = AMBIENT_TEMPERATURE
+        self.score_cam0 = 0
+        self.score_cam1 = 0
+        self.ticks = 0
+
+    def next(self, state, num_images_cam0, num_images_cam1):
+        """Advance one status period.
+
+        :param state: operation mode, 1 to 10
+        :return: score_cam0, score_cam1, cpu_temperature, cam0_temperature,
+            cam1_temperature and available_disk_space
+        """
+
+        model = self.model
+        k = self.tick
+        self.tick = (k + 1) % model.size
+        self.ticks += 1
+
+        mode = state - 4 if 5 <= state <= 8 else state
+        target_cpu, target_cam = TARGET_TEMPERATURES.get(mode, TARGET_TEMPERATURES[1])
+        self.cpu_temperature += model.alpha * (target_cpu - self.cpu_temperature)
+        self.cam_temperature += model.alpha * (target_cam - self.cam_temperature)
+        if mode == 4:
+            self.score_cam0 = int(model.score_cam0[k])
+            self.score_cam1 = int(model.score_cam1[k])
+
+        cpu = min(104, max(0, int(self.cpu_temperature + model.cpu_noise[k])))
+        cam0 = min(49, max(0, int(self.cam_temperature + model.cam0_noise[k])))
+        cam1 = min(49, max(0, int(self.cam_temperature + model.cam1_noise[k])))
+        disk = (
+            self.disk_capacity
+            - num_images_cam0 * BYTES_PER_IMAGE_CAM0
+            - num_images_cam1 * BYTES_PER_IMAGE_CAM1
+            - self.ticks * model.period * LOG_BYTES_PER_HOUR // 3600
+        )
+        return self.score_cam0, self.score_cam1, cpu, cam0, cam1, max(0, disk)
+
+
+def format_status(state, num_images_cam0, num_images_cam1, values):
+    """Status line, in bytes, from the mode, image counts and next() values."""
+
+    return STATUS_TEMPLATE % ((state, num_images_cam0, num_images_cam1) + values)
@@ -0,0 +1,140 @@
+"""
+Clock synchronisation measurements
+
+BioCam sets its clock from the vehicle with Cristian's algorithm: it sends
+$time and the vehicle answers *time system_time straight away. Every request is
+stamped when its bytes are written and every reply when its line is framed,
+which gives the round trip time and the estimated offset of the vehicle clock:
+
+    offset = system_time - (request_time + rtt / 2)
+
+Round trip times are measured on the real monotonic clock and the offset
+against the real wall clock, as the vehicle answers with its real time.
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+
+from .nav import RingBuffer
+
+TIME_REQUEST = b"$time\n"
+
+# Edges of the round trip time histogram, in milliseconds
+RTT_BINS_MS = np.concatenate(([0.0], np.logspace(-2, 5, 29)))
+
+# A request not answered within this many seconds is counted as lost
+REPLY_TIMEOUT = 60.0
+
+
+class TimeSync:
+    def __init__(self, capacity=4096, reply_timeout=REPLY_TIMEOUT):
+        """Round trip and offset statistics of the $time / *time exchanges.
+
+        :param capacity: number of exchanges kept for the percentiles
+        :param reply_timeout: seconds after which a request is counted as lost
+        """
+
+        self.reply_timeout = reply_timeout
+        self.samples = RingBuffer(
+            capacity, np.dtype([("rtt_ms", np.float64), ("offset_ms", np.float64)])
+        )
+        self.histogram = np.zeros(len(RTT_BINS_MS), dtype=np.int64)
+        self._outstanding = deque()
+
+        self.requests = 0
+        self.replies = 0
+        self.lost = 0
+        self.unsolicited = 0
+        self.invalid = 0
+
+    def request_sent(self, monotonic=None, wall=None):
+        """Stamp a $time request written to the link."""
+
+        if monotonic is None:
+            monotonic = time.perf_counter()
+        if wall is None:
+            wall = time.time()
+        self.requests += 1
+        self._outstanding.append((monotonic, wall))
+
+    def reply_received(self, system_time, monotonic=None):
+        """Match a *time reply with the latest request waiting for one.
+
+        Replies carry no request ID: a reply answers the latest request, and
+        the older requests still waiting were missed and are counted as lost.
+
+        :param system_time: vehicle time of the reply, 13 digit milliseconds
+        :param monotonic: time.perf_counter() when the reply was framed
+        :return: round trip time and offset in milliseconds, None if invalid
+        """
+
+        if monotonic is None:
+            monotonic = time.perf_counter()
+        if len(system_time) != 13 or not system_time.isdigit():
+            self.invalid += 1
+            return None
+        while (
+            self._outstanding
+            and monotonic - self._outstanding[0][0] > self.reply_timeout
+        ):
+            self._outstanding.popleft()
+            self.lost += 1
+        if not self._outstanding:
+            self.unsolicited += 1
+            return None
+
+        sent, wall = self._outstanding.pop()
+        self.lost += len(self._outstanding)
+        self._outstanding.clear()
+        rtt = monotonic - sent
+        rtt_ms = 1000.0 * rtt
+        offset_ms = int(system_time) - 1000.0 * (wall + rtt / 2)
+        self.replies += 1
+        record = np.array([(rtt_ms, offset_ms)], dtype=self.samples._data.dtype)
+        self.samples.extend(record)
+        self.histogram[np.searchsorted(RTT_BINS_MS, rtt_ms, side="right") - 1] += 1
+        return rtt_ms, offset_ms
+
+    @property
+    def outstanding(self):
+        """Number of requests waiting for a reply."""
+
+        return len(self._outstanding)
+
+    def stats(self):
+        """Counters, round trip percentiles, offset and histogram."""
+
+        samples = self.samples.view()
+        stats = {
+            "requests": self.requests,
+            "replies": self.replies,
+            "outstanding": self.outstanding,
+            "lost": self.lost,
+            "unsolicited": self.unsolicited,
+            "invalid": self.invalid,
+            "histogram": {
+                "edges_ms": RTT_BINS_MS.tolist(),
+                "counts": self.histogram.tolist(),
+            },
+        }
+        if len(samples) == 0:
+            return stats
+        rtt = samples["rtt_ms"]
+        p50, p95, p99 = np.percentile(rtt, [50, 95, 99])
+        stats["rtt_ms"] = {
+            "min": float(rtt.min()),
+            "mean": float(rtt.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(rtt.max()),
+        }
+        offset = samples["offset_ms"]
+        stats["offset_ms"] = {
+            "last": float(offset[-1]),
+            "mean": float(offset.mean()),
+            "std": float(offset.std()),
+        }
+        return stats
@@ -0,0 +1,235 @@
+"""
+Summary transfers
+
+All the bc_start_summaries and bc_get_summaries requests are served by a single
+transfer: the indices they ask for are appended to one queue, skipping the ones
+already waiting to be sent, and the summary lines are generated one by one as
+the link drains the outbox, so only a few summaries are ever queued and a
+bc_stop_summaries takes effect straight away. "summary done" is sent when the
+queue is empty.
+
+Every request keeps its own progress (summaries sent, bytes, duplicates and
+invalid indices skipped) and throughput, in seconds of the mission clock. A
+summary counts as sent once the link has drained it from the outbox, so a
+request finishes when its last line is written, not when it is generated.
+"""
+
+from collections import deque
+
+from .outbox import PRIORITY_SUMMARY
+
+# Summaries kept in the outbox, enough to keep the link busy
+WINDOW = 2
+
+SUMMARY_DONE = b"summary done\n"
+
+
+class SummaryRequest:
+    def __init__(self, request_id, kind, indices, created):
+        """Progress of one summary request.
+
+        :param request_id: number of the request, in order of reception
+        :param kind: "start" (range) or "get" (list)
+        :param indices: requested indices
+        :param created: mission time the request was received
+        """
+
+        self.request_id = request_id
+        self.kind = kind
+        self.indices = indices
+        self.created = created
+        self.state = "waiting"
+        self.started = None
+        self.finished = None
+        self.total = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def stats(self):
+        duration = None
+        throughput = 0.0
+        if self.started is not None and self.finished is not None:
+            duration = self.finished - self.started
+            if duration > 0:
+                throughput = self.sent_bytes / duration
+        return {
+            "id": self.request_id,
+            "kind": self.kind,
+            "state": self.state,
+            "requested": len(self.indices),
+            "total": self.total,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": duration,
+            "bytes_per_second": throughput,
+        }
+
+
+class SummaryTransfer:
+    def __init__(self, store, outbox, loop, flush, window=WINDOW, listener=None):
+        """Merged, lazily generated transfer of the requested summaries.
+
+        :param store: RemoteAwarenessData with the summaries
+        :param outbox: MessageOutbox the summary lines are queued in
+        :param loop: EventLoop running the request delays
+        :param flush: called to write the outbox once summaries are queued
+        :param window: number of summaries kept in the outbox
+        :param listener: called with (event, request) when a request starts
+            ("start"), is complete ("done") or is cancelled ("cancelled"), and
+            with ("idle", None) once "summary done" is queued
+        """
+
+        self.store = store
+        self.outbox = outbox
+        self.loop = loop
+        self.flush = flush
+        self.window = window
+        self.listener = listener
+
+        self.requests = []
+        self._timers = {}  # request id to the timer starting it
+        self._queue = deque()  # (index, request) waiting to be sent
+        self._pending = set()  # indices in self._queue
+        self._queued = deque()  # (request, size) of the lines in the outbox
+        self._stream = None
+        self.sending = False
+
+    def _now(self):
+        return self.loop.clock.monotonic()
+
+    def _notify(self, event, request):
+        if self.listener is not None:
+            self.listener(event, request)
+
+    def request_range(self, start_idx, end_idx, delay=0.0):
+        """Queue the summaries from start_idx to end_idx (excluded) after delay
+        seconds. -1 as start means from the first, -1 as end up to the last.
+        """
+
+        data_len = self.store.len()
+        if start_idx < 0 or start_idx >= data_len:
+            start_idx = 0
+        if end_idx < 0 or end_idx > data_len:
+            end_idx = data_len
+        return self._request("start", range(start_idx, end_idx), delay)
+
+    def request_list(self, indices, delay=0.0):
+        """Queue the summaries of a list of indices after delay seconds."""
+
+        return self._request("get", list(indices), delay)
+
+    def _request(self, kind, indices, delay):
+        request = SummaryRequest(len(self.requests), kind, indices, self._now())
+        self.requests.append(request)
+        self._timers[request.request_id] = self.loop.call_later(
+            delay, self._activate, request
+        )
+        return request
+
+    def _activate(self, request):
+        self._timers.pop(request.request_id, None)
+        data_len = self.store.len()
+        for idx in request.indices:
+            if idx < 0 or idx >= data_len:
+                request.invalid += 1
+            elif idx in self._pending:
+                request.duplicates += 1
+            else:
+                self._pending.add(idx)
+                self._queue.append((idx, request))
+                request.total += 1
+        request.state = "active"
+        request.started = self._now()
+        if self._stream is None:
+            self.sending = True
+            self._stream = self._lines()
+        self._notify("start", request)
+        if request.total == 0:
+            self._finish(request)
+        self.fill()
+        self.flush()
+
+    def _finish(self, request):
+        request.state = "done"
+        request.finished = self._now()
+        self._notify("done", request)
+
+    def _lines(self):
+        """Summary lines of the queued indices, generated when asked for."""
+
+        while True:
+            while self._queue:
+                idx, request = self._queue.popleft()
+                self._pending.discard(idx)
+                yield self.store.line(idx), request
+            yield SUMMARY_DONE, None
+            # Requests activated while "summary done" was queued carry on
+            if not self._queue:
+                return
+
+    def fill(self):
+        """Top the outbox up to window summaries."""
+
+        if self._stream is None:
+            return
+        while self.outbox.depth(PRIORITY_SUMMARY) < self.window:
+            line, request = next(self._stream, (None, None))
+            if line is None:
+                self._stream = None
+                self.sending = False
+                self._notify("idle", None)
+                return
+            self.outbox.put(line, PRIORITY_SUMMARY)
+            self._queued.append((request, len(line)))
+
+    def drained(self, count):
+        """Account for count summary lines drained from the outbox, in order."""
+
+        for _ in range(count):
+            request, size = self._queued.popleft()
+            if request is None:
+                continue
+            request.sent += 1
+            request.sent_bytes += size
+            if request.sent == request.total:
+                self._finish(request)
+
+    def cancel(self):
+        """Cancel the waiting and active requests and drop the queued lines.
+
+        Returns the number of summaries not sent.
+        """
+
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        # Summary lines waiting or in the outbox, "summary done" excluded
+        dropped = len(self._queue) + sum(
+            1 for request, _ in self._queued if request is not None
+        )
+        self.outbox.clear(PRIORITY_SUMMARY)
+        self._queue.clear()
+        self._pending.clear()
+        self._queued.clear()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self.sending = False
+        for request in self.requests:
+            if request.state in ("waiting", "active"):
+                request.state = "cancelled"
+                request.finished = self._now()
+                self._notify("cancelled", request)
+        return dropped
+
+    def stats(self):
+        """Progress of every request."""
+
+        return [request.stats() for request in self.requests]
@@ -0,0 +1,276 @@
+"""
+Transports the BioCam emulator talks through
+
+A transport carries the bytes between the emulator and the vehicle side. It is
+served by an EventLoop: received data is handed to a callback, and writes never
+block, data the other side is not ready for is kept and sent when the transport
+becomes writable.
+
+    pty:    pseudo-terminal pair, the vehicle side opens /dev/pts/N as a serial
+            port
+    tcp:    TCP server, a local stand-in for a serial over IP gateway
+    memory: in-process socket pair, for tests and benchmarks
+"""
+
+import os
+import pty
+import socket
+import tty
+
+# Real seconds between two looks at a pty whose master reported a hang up
+PTY_RETRY_INTERVAL = 1.0
+
+
+class Transport:
+    """Non-blocking transport over a file descriptor.
+
+    Subclasses set self.port and self._fd, the emulator side of the link.
+    """
+
+    def __init__(self):
+        self.port = None
+        self.loop = None
+        self.on_data = None
+        self.on_attach = None
+        self.attached = False
+        self.closed = False
+        self._fd = None
+        self._pending = bytearray()
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def fileno(self):
+        return self._fd
+
+    def open(self, loop, on_data, on_attach=None):
+        """Start serving the transport.
+
+        :param loop: EventLoop serving the transport
+        :param on_data: called with the received bytes
+        :param on_attach: called once, when the vehicle side first shows up: a
+            TCP client connects, or the first bytes are received
+        """
+
+        self.loop = loop
+        self.on_data = on_data
+        self.on_attach = on_attach
+        if self._fd is not None:
+            loop.add_reader(self._fd, self._read_ready)
+
+    def _read_ready(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # Connection reset, or EIO from a pty master whose slave is closed
+            data = b""
+        if data:
+            self.bytes_in += len(data)
+            self._attach()
+            self.on_data(data)
+        else:
+            self._connection_lost()
+
+    def _attach(self):
+        if not self.attached:
+            self.attached = True
+            if self.on_attach is not None:
+                self.on_attach()
+
+    def _connection_lost(self):
+        """The other side closed the link: stop watching the fd, which would
+        otherwise stay readable (at end of file) and spin the event loop.
+        """
+
+        if self._fd is not None:
+            self._unregister(self._fd)
+        self._pending.clear()
+
+    def write(self, data):
+        """Send data, without blocking.
+
+        :return: True if the data was written or queued for the other side,
+            False if it was dropped
+        """
+
+        if self.closed or self._fd is None:
+            return False
+        if self._pending:
+            self._pending += data
+            return True
+        try:
+            written = os.write(self._fd, data)
+        except (BlockingIOError, InterruptedError):
+            written = 0
+        except (BrokenPipeError, ConnectionError):
+            self._connection_lost()
+            return False
+        self.bytes_out += written
+        if written < len(data):
+            self._pending += memoryview(data)[written:]
+            self.loop.add_writer(self._fd, self._write_ready)
+        return True
+
+    def _write_ready(self):
+        if self.closed or self._fd is None:
+            return
+        try:
+            written = os.write(self._fd, self._pending)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (BrokenPipeError, ConnectionError):
+            self._connection_lost()
+            return
+        self.bytes_out += written
+        del self._pending[:written]
+        if not self._pending:
+            self.loop.remove_writer(self._fd)
+
+    @property
+    def pending(self):
+        """Number of bytes waiting for the other side to read."""
+
+        return len(self._pending)
+
+    def _unregister(self, fd):
+        if self.loop is not None:
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._fd is not None:
+            self._unregister(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+class PtyTransport(Transport):
+    def __init__(self):
+        """Pseudo-terminal pair, the emulator owns the master side.
+
+        The vehicle side (or picocom) opens the slave, whose name is in the
+        port attribute. Only one pty pair is used and no forwarding thread is
+        needed, the master is served by the event loop.
+        """
+
+        super().__init__()
+        self._fd, self._slave_fd = pty.openpty()
+        # Raw mode (pass through control characters, no echo) until a client
+        # configures the port itself. The slave fd stays open so that the master
+        # does not hang up when clients disconnect.
+        tty.setraw(self._fd)
+        tty.setraw(self._slave_fd)
+        os.set_blocking(self._fd, False)
+        self.port = os.ttyname(self._slave_fd)
+
+    def _connection_lost(self):
+        # A client may open the slave again, which the master cannot tell: look
+        # at it again after a while rather than on every loop iteration
+        super()._connection_lost()
+        if self.loop is not None and not self.closed:
+            self.loop.call_later(
+                self.loop.clock.to_virtual(PTY_RETRY_INTERVAL), self._rearm
+            )
+
+    def _rearm(self):
+        if not self.closed:
+            self.loop.add_reader(self._fd, self._read_ready)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        os.close(self._slave_fd)
+
+
+class TcpServerTransport(Transport):
+    def __init__(self, host="127.0.0.1", port=0):
+        """TCP server serving one vehicle side client at a time.
+
+        :param host: address to listen on
+        :param port: TCP port to listen on, 0 for any free port
+
+        A new connection replaces the current one. Data sent while no client
+        is connected is dropped, as on a serial line with nothing plugged in,
+        and counted in bytes_dropped.
+        """
+
+        super().__init__()
+        self._server = socket.create_server((host, port))
+        self._server.setblocking(False)
+        self._client = None
+        self.bytes_dropped = 0
+        self.connections = 0
+        host, port = self._server.getsockname()[:2]
+        self.port = "socket://" + host + ":" + str(port)
+
+    def open(self, loop, on_data, on_attach=None):
+        super().open(loop, on_data, on_attach)
+        loop.add_reader(self._server.fileno(), self._accept)
+
+    def _accept(self):
+        try:
+            client, _ = self._server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        self._connection_lost()
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._client = client
+        self._fd = client.fileno()
+        self.connections += 1
+        self.loop.add_reader(self._fd, self._read_ready)
+        self._attach()
+
+    def _connection_lost(self):
+        if self._client is None:
+            return
+        self._unregister(self._fd)
+        self._client.close()
+        self._client = None
+        self._fd = None
+        self._pending.clear()
+
+    def write(self, data):
+        if self._fd is None:
+            self.bytes_dropped += len(data)
+            return False
+        return super().write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._connection_lost()
+        self.closed = True
+        self._unregister(self._server.fileno())
+        self._server.close()
+
+
+class MemoryTransport(Transport):
+    def __init__(self):
+        """In-process duplex link, the vehicle side is the client attribute.
+
+        client is a connected blocking socket, e.g. for tests driving the
+        emulator from another thread with client.sendall() and client.recv().
+        """
+
+        super().__init__()
+        server, self.client = socket.socketpair()
+        server.setblocking(False)
+        self._server = server
+        self._fd = server.fileno()
+        self.port = "memory://" + str(self._fd)
+
+    def close(self):
+        if self.closed:
+            return
+        self._unregister(self._fd)
+        self._fd = None
+        self.closed = True
+        self._server.close()
+        self.client.close()
@@ -0,0 +1,314 @@
+"""
+Topside summary verification
+
+Client playing the vehicle side of a summary transfer: it requests summaries
+from a running emulator, collects the summary lines, decodes them in bulk and
+checks every payload against the sha256 digests of the same summary store (same
+summaries and seed as the emulator). It reports the missing, duplicated and
+corrupt IDs, the throughput, the time to the first summary and the total time.
+
+    biocam_verify /dev/pts/3 --seed 1 --start -1 -1
+    biocam_verify socket://127.0.0.1:4000 --seed 1 --get 3 7 12
+    biocam_verify socket://127.0.0.1:4000 --seed 0 --synthetic 1000
+"""
+
+import argparse
+import binascii
+import hashlib
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+from .emulator import RemoteAwarenessData
+
+# Sequence number appended by the Iridium queue model
+_SEQUENCE = re.compile(rb" #\d+$")
+
+
+def _unhex(hexes):
+    """Decode hex payloads, joined in a single call when they are all valid.
+
+    Returns the list of decoded payloads, None for the invalid ones.
+    """
+
+    try:
+        data = binascii.unhexlify(b"".join(hexes))
+    except (binascii.Error, ValueError):
+        data = None
+    if data is not None and all(len(h) % 2 == 0 for h in hexes):
+        payloads = []
+        offset = 0
+        for h in hexes:
+            size = len(h) // 2
+            payloads.append(data[offset : offset + size])
+            offset += size
+        return payloads
+    payloads = []
+    for h in hexes:
+        try:
+            payloads.append(binascii.unhexlify(h))
+        except (binascii.Error, ValueError):
+            payloads.append(None)
+    return payloads
+
+
+class SummaryVerifier:
+    def __init__(self, store, expected=None):
+        """Checks received summary lines against a summary store.
+
+        :param store: RemoteAwarenessData with the summaries the emulator sends
+        :param expected: indices requested, all the store by default
+        """
+
+        self.store = store
+        if expected is None:
+            expected = range(store.len())
+        self.expected = sorted(set(expected))
+        # Summary ID to {digest: index}, several indices share an ID when the
+        # IDs wrap around
+        self._digests = {}
+        for idx, digest in enumerate(store.digests):
+            self._digests.setdefault(store.summary_id(idx), {})[digest] = idx
+
+        self.lines = []  # (time, ID, hex payload, line size)
+        self.line_bytes = 0
+        self.malformed = 0
+        self.done_time = None
+
+    def add_line(self, line, received_time=None):
+        """Add a received "summary NN HEX" or "summary done" line (bytes).
+
+        Returns True when the line is "summary done".
+        """
+
+        if received_time is None:
+            received_time = time.perf_counter()
+        line = _SEQUENCE.sub(b"", line.rstrip(b"\r\n"))
+        parts = line.split(b" ")
+        if parts[:2] == [b"summary", b"done"]:
+            self.done_time = received_time
+            return True
+        if len(parts) != 3 or not parts[1].isdigit():
+            self.malformed += 1
+            return False
+        self.line_bytes += len(line) + 1
+        self.lines.append((received_time, int(parts[1]), parts[2], len(line) + 1))
+        return False
+
+    def report(self):
+        """Verify the received summaries, in bulk."""
+
+        payloads = _unhex([line[2] for line in self.lines])
+        received = {}
+        corrupt = []
+        for (_, summary_id, _, _), payload in zip(self.lines, payloads):
+            candidates = self._digests.get(summary_id, {})
+            idx = None
+            if payload is not None:
+                idx = candidates.get(hashlib.sha256(payload).hexdigest())
+            if idx is None:
+                corrupt.append(summary_id)
+                continue
+            received[idx] = received.get(idx, 0) + 1
+
+        missing = [i for i in self.expected if i not in received]
+        unexpected = sorted(set(received) - set(self.expected))
+        duplicates = sorted(i for i, n in received.items() if n > 1)
+        report = {
+            "expected": len(self.expected),
+            "received_lines": len(self.lines),
+            "verified": len(received),
+            "missing_ids": [self.store.summary_id(i) for i in missing],
+            "duplicate_ids": [self.store.summary_id(i) for i in duplicates],
+            "corrupt_ids": corrupt,
+            "unexpected_ids": [self.store.summary_id(i) for i in unexpected],
+            "malformed_lines": self.malformed,
+            "bytes": self.line_bytes,
+            "payload_bytes": sum(len(p) for p in payloads if p is not None),
+            "complete": not missing and not corrupt,
+        }
+        if len(self.lines) > 1:
+            span = self.lines[-1][0] - self.lines[0][0]
+            if span > 0:
+                # The first line marks the start of the transfer
+                report["bytes_per_second"] = (self.line_bytes - self.lines[0][3]) / span
+        return report
+
+
+def _parse_state(line):
+    parts = line.split(b" ")
+    if parts[0] == b"status" and len(parts) > 1 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+
+def run_transfer(port, verifier, command, timeout=600.0, compute_delay=None):
+    """Send a summary request to a running emulator and collect the summaries.
+
+    :param port: serial port name or pyserial URL of the emulator
+    :param verifier: SummaryVerifier fed with the received lines
+    :param command: request, e.g. b"*bc_start_summaries -1 -1\\n"
+    :param timeout: seconds to wait for "summary done"
+    :param compute_delay: real seconds the emulator computes summaries (state
+        9) before sending them (state 10), used to time the first summary when
+        no status message shows the transition
+    :return: timing dict, in seconds
+    """
+
+    import serial
+
+    link = serial.serial_for_url(port, baudrate=57600, timeout=0.5)
+    timing = {}
+    try:
+        link.reset_input_buffer()
+        start = time.perf_counter()
+        link.write(command)
+        verb = command.split(b" ")[0].rstrip(b"\n")[1:]
+        transition = None
+        first_summary = None
+        state = None
+        while time.perf_counter() - start < timeout:
+            line = link.readline()
+            now = time.perf_counter()
+            if not line:
+                continue
+            if line.startswith(b"$" + verb):
+                timing["ack"] = now - start
+            elif line.startswith(b"status"):
+                new_state = _parse_state(line)
+                if state == 9 and new_state == 10 and transition is None:
+                    transition = now
+                state = new_state
+            elif line.startswith(b"summary"):
+                if first_summary is None:
+                    first_summary = now
+                if verifier.add_line(line, now):
+                    break
+        end = time.perf_counter()
+    finally:
+        link.close()
+
+    timing["total"] = end - start
+    if first_summary is not None:
+        timing["first_summary"] = first_summary - start
+        if transition is None and compute_delay is not None and "ack" in timing:
+            transition = start + timing["ack"] + compute_delay
+        if transition is not None:
+            timing["first_summary_after_transition"] = first_summary - transition
+    if verifier.done_time is not None and first_summary is not None:
+        timing["transfer"] = verifier.done_time - first_summary
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Request summaries from a BioCam emulator and verify them"
+    )
+    parser.add_argument("port", help="serial port or pyserial URL of the emulator")
+    parser.add_argument(
+        "--summaries",
+        type=Path,
+        default=None,
+        help="summary folder or archive the emulator sends (default: bundled "
+        "data folder)",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="COUNT",
+        default=None,
+        help="the emulator sends COUNT generated summaries",
+    )
+    parser.add_argument(
+        "--synthetic-sizes",
+        choices=["uniform", "normal", "fixed"],
+        default="uniform",
+        help="size distribution of the generated summaries (default: uniform)",
+    )
+    parser.add_argument(
+        "--seed", type=int, required=True, help="seed the emulator was started with"
+    )
+    parser.add_argument(
+        "--wrap-ids",
+        action="store_true",
+        default=None,
+        help="the emulator wraps the IDs (default: only with --synthetic)",
+    )
+    request = parser.add_mutually_exclusive_group()
+    request.add_argument(
+        "--start",
+        type=int,
+        nargs=2,
+        metavar=("FIRST", "END"),
+        default=[-1, -1],
+        help="request a range with bc_start_summaries (default: -1 -1, all)",
+    )
+    request.add_argument(
+        "--get",
+        type=int,
+        nargs="+",
+        metavar="INDEX",
+        help="request a list with bc_get_summaries",
+    )
+    parser.add_argument(
+        "--compute-delay",
+        type=float,
+        default=20.0,
+        help="real seconds the emulator computes summaries before sending them "
+        "(default: 20, divide by the emulator time scale)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="seconds to wait for the transfer (default: 600)",
+    )
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        from .synthetic import SyntheticSummaries
+
+        # The emulator sends generated summaries in order
+        store = RemoteAwarenessData(
+            SyntheticSummaries(
+                args.synthetic, seed=args.seed, size_distribution=args.synthetic_sizes
+            ),
+            seed=args.seed,
+            shuffle=False,
+            wrap_ids=args.wrap_ids,
+        )
+    else:
+        if args.summaries is None:
+            args.summaries = Path(__file__).parent / "data"
+        store = RemoteAwarenessData(
+            args.summaries, seed=args.seed, wrap_ids=args.wrap_ids
+        )
+    if args.get is not None:
+        expected = [i for i in args.get if 0 <= i < store.len()]
+        command = b"*bc_get_summaries " + " ".join(map(str, args.get)).encode()
+        compute_delay = None
+    else:
+        first, end = args.start
+        if first < 0 or first >= store.len():
+            first = 0
+        if end < 0 or end > store.len():
+            end = store.len()
+        expected = range(first, end)
+        command = b"*bc_start_summaries %d %d" % tuple(args.start)
+        compute_delay = args.compute_delay
+
+    verifier = SummaryVerifier(store, expected)
+    timing = run_transfer(
+        args.port, verifier, command + b"\n", args.timeout, compute_delay
+    )
+    report = verifier.report()
+    report["timing"] = timing
+    print(json.dumps(report, indent=2))
+    if not report["complete"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,12 +20,23 @@
 
 import os
 import pty
+import queue
 import sys
 import tty
-from selectors import EVENT_READ
+from selectors import EVENT_READ, EVENT_WRITE
 from selectors import DefaultSelector as Selector
 from threading import Thread
 
+# Size of the reusable read buffer.
+READ_SIZE = 65536
+
+# Bytes waiting for a destination above which its sources are not read, so
+# that a slow reader holds the writers back instead of growing the buffers.
+MAX_PENDING = 1 << 20
+
+# Bytes of every sampled chunk printed when debugging.
+TRACE_BYTES = 80
+
 
 class VirtualSerialPortException(Exception):
     """Exceptions raised from this module."""
@@ -35,12 +46,26 @@ not_opened = VirtualSerialPortException("ports are not yet opened")
 
 
 class VirtualSerialPorts:
-    def __init__(self, num_ports: int, loopback: bool = False, debug: bool = False):
+    def __init__(
+        self,
+        num_ports: int,
+        loopback: bool = False,
+        debug: bool = False,
+        route=None,
+        debug_sample: int = 1,
+        max_pending: int = MAX_PENDING,
+    ):
         """Class for managing virtual serial ports.
 
         :param num_ports: number of ports to create
         :param loopback: whether to echo data back to the sender
-        :param debug: whether to print debugging info to stdout
+        :param debug: whether to print debugging info to stderr
+        :param route: optional fan-out filter, called with the indices of the
+            source and destination ports, data is only forwarded when it
+            returns True
+        :param debug_sample: print one chunk out of debug_sample when debugging
+        :param max_pending: bytes waiting for a destination above which the
+            ports sending to it are not read until it catches up
 
         Can be used as a context manager which will create the ports, start the
         processing, and return the ports on entry; and close and remove the
@@ -56,16 +81,28 @@ class VirtualSerialPorts:
                 s1.write(b'hello')
                 print(s2.read())
 
+        Forwarding never blocks: data a destination is not ready for is kept
+        and written when it becomes writable, and debug output is printed by a
+        separate thread.
         """
 
         self.num_ports = num_ports
         self.loopback = loopback
         self.debug = debug
+        self.route = route
+        self.debug_sample = max(1, debug_sample)
+        self.max_pending = max_pending
         self.running = False
 
         self._thread = None
+        self._trace_thread = None
+        self._trace_queue = None
         self._master_files = None
+        self._slave_fds = None
         self._slave_names = None
+        self._destinations = None
+        self._pending = None
+        self.counters = None
 
     def __enter__(self):
         self.open()
@@ -81,6 +118,7 @@ class VirtualSerialPorts:
 
         self.close()
         self._master_files = {}  # Dict of master fd to master file object.
+        self._slave_fds = {}  # Dict of master fd to slave fd.
         self._slave_names = {}  # Dict of master fd to slave name.
         for _ in range(self.num_ports):
             master_fd, slave_fd = pty.openpty()
@@ -94,9 +132,34 @@ class VirtualSerialPorts:
             # dict.
             self._master_files[master_fd] = open(master_fd, "r+b", buffering=0)
 
-            # Get the os-visible name (e.g. /dev/pts/1) and store in dict.
+            # Get the os-visible name (e.g. /dev/pts/1) and store in dict. The
+            # slave stays open so that the master does not hang up when clients
+            # disconnect.
+            self._slave_fds[master_fd] = slave_fd
             self._slave_names[master_fd] = os.ttyname(slave_fd)
 
+        # Destinations of every port, with the fan-out filter applied.
+        fds = list(self._master_files)
+        self._destinations = {}
+        for i, src in enumerate(fds):
+            self._destinations[src] = [
+                dst
+                for j, dst in enumerate(fds)
+                if (self.loopback or dst != src)
+                and (self.route is None or self.route(i, j))
+            ]
+        self._pending = {fd: bytearray() for fd in fds}
+        self.counters = {
+            self._slave_names[fd]: {
+                "bytes_in": 0,
+                "chunks_in": 0,
+                "bytes_out": 0,
+                "chunks_out": 0,
+                "max_pending": 0,
+            }
+            for fd in fds
+        }
+
     def close(self):
         """Close ports."""
 
@@ -104,7 +167,10 @@ class VirtualSerialPorts:
         if self._master_files is not None:
             for f in self._master_files.values():
                 f.close()
+            for fd in self._slave_fds.values():
+                os.close(fd)
         self._master_files = None
+        self._slave_fds = None
         self._slave_names = None
 
     def process(self):
@@ -116,26 +182,132 @@ class VirtualSerialPorts:
             raise not_opened
 
         self.running = True
+        buffer = bytearray(READ_SIZE)
+        view = memoryview(buffer)
+        sample = 0
 
         with Selector() as selector:
             # Add all file descriptors to selector.
-            for fd in self._master_files.keys():
-                selector.register(fd, EVENT_READ)
+            registered = {}
+            self._update_events(selector, registered)
 
             while self.running:
                 for key, events in selector.select(timeout=0.1):
+                    fd = key.fileobj
+                    if events & EVENT_WRITE:
+                        self._write_pending(fd)
                     if not events & EVENT_READ:
                         continue
 
-                    data = self._master_files[key.fileobj].read()
+                    try:
+                        n = self._master_files[fd].readinto(buffer)
+                    except OSError:
+                        # EIO while no client has the slave open.
+                        continue
+                    if not n:
+                        continue
+                    data = view[:n]
+                    counters = self.counters[self._slave_names[fd]]
+                    counters["bytes_in"] += n
+                    counters["chunks_in"] += 1
                     if self.debug:
-                        print(self._slave_names[key.fileobj], data, file=sys.stderr)
+                        sample += 1
+                        if sample >= self.debug_sample:
+                            sample = 0
+                            self._trace(fd, data)
 
                     # Write to master files. If loopback is False, don't write
                     # to the sending file.
-                    for fd, f in self._master_files.items():
-                        if self.loopback or fd != key.fileobj:
-                            f.write(data)
+                    for dst in self._destinations[fd]:
+                        self._forward(dst, data)
+                self._update_events(selector, registered)
+        self._stop_trace()
+
+    def _forward(self, fd, data):
+        """Write data to a master, keeping what it cannot take now."""
+
+        pending = self._pending[fd]
+        counters = self.counters[self._slave_names[fd]]
+        counters["chunks_out"] += 1
+        if pending:
+            pending += data
+        else:
+            try:
+                written = os.write(fd, data)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            counters["bytes_out"] += written
+            if written < len(data):
+                pending += data[written:]
+        counters["max_pending"] = max(counters["max_pending"], len(pending))
+
+    def _write_pending(self, fd):
+        pending = self._pending[fd]
+        if not pending:
+            return
+        try:
+            written = os.write(fd, pending)
+        except (BlockingIOError, InterruptedError):
+            return
+        self.counters[self._slave_names[fd]]["bytes_out"] += written
+        del pending[:written]
+
+    def _update_events(self, selector, registered):
+        """Watch the masters with pending data for writing, and stop reading
+        the ones whose destinations are too far behind."""
+
+        for fd, destinations in self._destinations.items():
+            events = 0
+            if all(len(self._pending[dst]) < self.max_pending for dst in destinations):
+                events |= EVENT_READ
+            if self._pending[fd]:
+                events |= EVENT_WRITE
+            current = registered.get(fd, 0)
+            if events == current:
+                continue
+            if not events:
+                selector.unregister(fd)
+            elif not current:
+                selector.register(fd, events)
+            else:
+                selector.modify(fd, events)
+            registered[fd] = events
+
+    def _trace(self, fd, data):
+        """Hand a chunk over to the debug printing thread, never blocking."""
+
+        if self._trace_thread is None:
+            self._trace_queue = queue.Queue(maxsize=1024)
+            self._trace_thread = Thread(target=self._print_traces, daemon=True)
+            self._trace_thread.start()
+        try:
+            self._trace_queue.put_nowait(
+                (self._slave_names[fd], len(data), bytes(data[:TRACE_BYTES]))
+            )
+        except queue.Full:
+            pass
+
+    def _print_traces(self):
+        while True:
+            trace = self._trace_queue.get()
+            if trace is None:
+                return
+            name, size, data = trace
+            print(name, size, data, file=sys.stderr)
+
+    def _stop_trace(self):
+        if self._trace_thread is None:
+            return
+        self._trace_queue.put(None)
+        self._trace_thread.join()
+        self._trace_thread = None
+
+    def pending(self):
+        """Number of bytes waiting to be written to every port."""
+
+        if self._pending is None:
+            raise not_opened
+        return {self._slave_names[fd]: len(p) for fd, p in self._pending.items()}
 
     def start(self):
         """Start running in background thread. Stop and restarts if already
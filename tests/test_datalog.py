@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from biocam_emulator.datalog import ColumnarLogWriter, DataLogException, load_log
+from biocam_emulator.emulator import BioCamEmulator
+from biocam_emulator.pacing import make_pacer
+from biocam_emulator.transports import MemoryTransport
+
+
+def test_rows_are_written_on_close(tmp_path):
+    writer = ColumnarLogWriter(tmp_path, log_format="npz")
+    writer.append_row("status", time_ms=1, mode=4)
+    writer.append_row("status", time_ms=2, mode=1)
+    writer.close()
+
+    assert list(load_log(tmp_path)["status"]["mode"]) == [4, 1]
+
+
+def test_writer_errors_stop_logging_and_are_raised_on_close(tmp_path, capsys):
+    writer = ColumnarLogWriter(tmp_path, log_format="npz", max_chunk_rows=1)
+    # Not a structured array, the writer thread fails on it
+    writer.append("nav_depth", np.zeros(1))
+    writer._thread.join(5.0)
+
+    writer.append_row("status", time_ms=1, mode=4)
+    assert writer.rows_dropped == 1
+    assert "logging stopped" in capsys.readouterr().err
+    with pytest.raises(DataLogException):
+        writer.close()
+
+
+def test_summary_requests_log_their_completion(tmp_path):
+    emulator = BioCamEmulator(
+        pacer=make_pacer("unlimited"),
+        transport=MemoryTransport(),
+        verbose=False,
+        seed=0,
+        datalog=ColumnarLogWriter(tmp_path, log_format="npz"),
+    )
+    emulator.get_summaries_delay = 0
+    emulator.start()
+    emulator.transport.client.sendall(b"*bc_get_summaries 1 2\n")
+    for _ in range(10):
+        emulator.emulate_step(0.01)
+    emulator.close()
+
+    summaries = load_log(tmp_path)["summaries"]
+    assert list(summaries["event"]) == ["get", "done"]
+    assert list(summaries["count"]) == [2, 2]
+    assert summaries["sent_bytes"][1] == sum(
+        len(emulator.remote_awareness_data.line(i)) for i in (1, 2)
+    )
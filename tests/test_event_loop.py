@@ -0,0 +1,32 @@
+import os
+
+from biocam_emulator.event_loop import EventLoop
+
+
+def _fail():
+    raise RuntimeError("bad callback")
+
+
+def test_callback_errors_do_not_stop_the_loop():
+    loop = EventLoop()
+    errors = []
+    loop.exception_handler = lambda callback, e: errors.append(str(e))
+    ran = []
+    read_fd, write_fd = os.pipe()
+    try:
+        loop.call_later(0, _fail)
+        loop.call_later(0, ran.append, "timer")
+        loop.call_soon_threadsafe(_fail)
+        loop.call_soon_threadsafe(ran.append, "soon")
+        loop.add_reader(read_fd, _fail)
+        os.write(write_fd, b"x")
+        loop.run_once(0)
+
+        assert sorted(ran) == ["soon", "timer"]
+        assert errors == ["bad callback"] * 3
+        assert loop.callback_errors == 3
+    finally:
+        loop.remove_reader(read_fd)
+        os.close(read_fd)
+        os.close(write_fd)
+        loop.close()
@@ -0,0 +1,38 @@
+from biocam_emulator.framing import LineFramer
+
+
+def _feed(framer, data):
+    return [bytes(frame) for frame in framer.feed(data)]
+
+
+def test_partial_lines_are_kept_until_complete():
+    framer = LineFramer()
+
+    assert _feed(framer, b"*bc_start") == []
+    assert framer.partial == len(b"*bc_start")
+    assert _feed(framer, b"_mapping\nnav 17") == [b"*bc_start_mapping"]
+    assert framer.partial == len(b"nav 17")
+    assert _feed(framer, b"00\n\n*time 1\n") == [b"nav 1700", b"", b"*time 1"]
+    assert framer.partial == 0
+    assert framer.frames == 4
+
+
+def test_oversize_lines_are_counted_and_dropped():
+    framer = LineFramer(max_line_length=8, buffer_size=16)
+
+    assert _feed(framer, b"12345678\n123456789\nshort\n") == [b"12345678", b"short"]
+    assert framer.errors["oversize"] == 1
+
+    # Spread over several chunks, counted once and skipped up to its newline
+    assert _feed(framer, b"abcdefghijk") == []
+    assert _feed(framer, b"lmnopqrstuvwxyz") == []
+    assert _feed(framer, b"0123\nok\n") == [b"ok"]
+    assert framer.errors["oversize"] == 2
+    assert framer.frames == 3
+
+
+def test_lines_that_are_not_ascii_are_counted():
+    framer = LineFramer()
+
+    assert list(framer.lines(b"\xff\xfe\n*bc_shutdown\n")) == ["*bc_shutdown"]
+    assert framer.errors["decode"] == 1
@@ -0,0 +1,58 @@
+from biocam_emulator.emulator import BioCamEmulator
+from biocam_emulator.iridium import IridiumLink
+from biocam_emulator.outbox import PRIORITY_ACK, PRIORITY_STATUS
+from biocam_emulator.pacing import make_pacer
+from biocam_emulator.transports import MemoryTransport
+
+
+def _emulator(link_stage):
+    emulator = BioCamEmulator(
+        pacer=make_pacer("unlimited"),
+        transport=MemoryTransport(),
+        verbose=False,
+        link_stage=link_stage,
+        lazy_summaries=True,
+    )
+    emulator.start()
+    emulator.transport.client.settimeout(1.0)
+    return emulator
+
+
+def test_acks_bypass_the_stage_and_a_full_stage_holds_the_outbox():
+    stage = IridiumLink(queue_size=2, loss_probability=0.0, latency_mean=1e6, seed=0)
+    emulator = _emulator(stage)
+    try:
+        for i in range(5):
+            emulator.send("status %d\n" % i, PRIORITY_STATUS)
+        emulator.send("$bc_start_mapping\n", PRIORITY_ACK)
+        emulator.emulate_step(0)
+
+        assert emulator.transport.client.recv(1024) == b"$bc_start_mapping\n"
+        assert len(stage) == 2
+        assert stage.dropped["queue_full"] == 0
+        assert emulator.message_outbox.depth(PRIORITY_STATUS) == 3
+    finally:
+        emulator.close()
+
+
+def test_outbox_drains_into_the_stage_as_it_frees_up():
+    stage = IridiumLink(
+        queue_size=2, loss_probability=0.0, latency_mean=0.0, latency_std=0.0, seed=0
+    )
+    emulator = _emulator(stage)
+    try:
+        for i in range(5):
+            emulator.send("status %d\n" % i, PRIORITY_STATUS)
+        for _ in range(100):
+            if stage.delivered == 5:
+                break
+            emulator.emulate_step(0.01)
+        received = b""
+        while received.count(b"\n") < 5:
+            received += emulator.transport.client.recv(1024)
+
+        assert received == b"".join(b"status %d\n" % i for i in range(5))
+        assert stage.delivered == 5
+        assert stage.dropped["queue_full"] == 0
+    finally:
+        emulator.close()
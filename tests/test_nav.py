@@ -0,0 +1,38 @@
+from biocam_emulator.nav import NavIngest
+
+
+def _depth(sensor_time):
+    return "1700000000000 %013d depth 12.500" % sensor_time
+
+
+def test_sensor_time_stays_monotonic_across_batches():
+    nav = NavIngest()
+    nav.add(_depth(100))
+    nav.flush()
+    nav.add(_depth(50))
+    nav.add(_depth(60))
+    nav.flush()
+
+    assert list(nav.samples("depth")["sensor_time"]) == [100]
+    assert nav.errors["non_monotonic"] == 2
+
+
+def test_short_lines_count_as_field_count():
+    nav = NavIngest()
+    nav.add("1700000000000")
+    nav.add("1700000000000 1700000000000 depth")
+    nav.add("1700000000000 1700000000000 sonar 1.000")
+    nav.flush()
+
+    assert nav.errors["field_count"] == 2
+    assert nav.errors["unknown_datatype"] == 1
+
+
+def test_values_with_several_minus_signs_count_as_value_format():
+    nav = NavIngest()
+    nav.add("1700000000000 0000000000100 depth --1.000")
+    nav.add("1700000000000 0000000000200 depth -1.000")
+    nav.flush()
+
+    assert list(nav.samples("depth")["values"][:, 0]) == [-1.0]
+    assert nav.errors["value_format"] == 1
@@ -0,0 +1,63 @@
+from biocam_emulator.outbox import (
+    PRIORITY_ACK,
+    PRIORITY_STATUS,
+    PRIORITY_SUMMARY,
+    PRIORITY_TIME,
+    MessageOutbox,
+)
+
+
+def test_drain_sends_higher_priorities_first_and_keeps_fifo_order():
+    outbox = MessageOutbox()
+    outbox.put(b"summary 00 AA\n", PRIORITY_SUMMARY)
+    outbox.put(b"status 1\n", PRIORITY_STATUS)
+    outbox.put("$bc_start_mapping\n", PRIORITY_ACK)
+    outbox.put(b"summary 01 BB\n", PRIORITY_SUMMARY)
+    outbox.put(b"$time\n", PRIORITY_TIME)
+
+    assert outbox.drain() == [
+        b"$time\n",
+        b"$bc_start_mapping\n",
+        b"status 1\n",
+        b"summary 00 AA\n",
+        b"summary 01 BB\n",
+    ]
+    assert len(outbox) == 0
+
+
+def test_drain_stops_at_the_first_message_over_the_budget():
+    outbox = MessageOutbox()
+    outbox.put(b"$time\n", PRIORITY_TIME)  # 6 bytes
+    outbox.put(b"status 1\n", PRIORITY_STATUS)  # 9 bytes
+    outbox.put(b"x\n", PRIORITY_SUMMARY)  # 2 bytes
+
+    # Messages are never split nor reordered to fill the budget
+    assert outbox.drain(budget=10) == [b"$time\n"]
+    assert outbox.peek_size() == 9
+    assert outbox.drain(budget=5) == []
+    assert outbox.drain(budget=11) == [b"status 1\n", b"x\n"]
+    assert outbox.stats()["queued_bytes"] == 0
+
+
+def test_force_first_lets_one_oversize_message_through():
+    outbox = MessageOutbox()
+    outbox.put(b"summary 00 " + b"AB" * 100 + b"\n", PRIORITY_SUMMARY)
+    outbox.put(b"summary 01 CD\n", PRIORITY_SUMMARY)
+
+    msgs = outbox.drain(budget=10, force_first=True)
+    assert len(msgs) == 1 and msgs[0].startswith(b"summary 00")
+    assert outbox.depth(PRIORITY_SUMMARY) == 1
+
+
+def test_drain_selected_priorities_up_to_a_limit():
+    outbox = MessageOutbox()
+    outbox.put(b"$time\n", PRIORITY_TIME)
+    for i in range(3):
+        outbox.put(b"status %d\n" % i, PRIORITY_STATUS)
+
+    assert outbox.drain(priorities=(PRIORITY_STATUS,), limit=2) == [
+        b"status 0\n",
+        b"status 1\n",
+    ]
+    assert outbox.depth(PRIORITY_TIME) == 1
+    assert outbox.peek_size((PRIORITY_STATUS, PRIORITY_SUMMARY)) == len(b"status 2\n")
@@ -0,0 +1,18 @@
+import pytest
+
+from biocam_emulator.emulator import RemoteAwarenessData
+from biocam_emulator.synthetic import SyntheticSummaries
+
+
+def test_synthetic_summary_ids_wrap_by_default():
+    store = RemoteAwarenessData(SyntheticSummaries(150), seed=0, shuffle=False)
+
+    assert store.wrap_ids
+    assert store.line(99).startswith(b"summary 99 ")
+    assert store.line(100).startswith(b"summary 00 ")
+
+
+def test_unwrapped_synthetic_summaries_above_100_are_rejected():
+    RemoteAwarenessData(SyntheticSummaries(100), seed=0, wrap_ids=False)
+    with pytest.raises(ValueError):
+        RemoteAwarenessData(SyntheticSummaries(101), seed=0, wrap_ids=False)
@@ -0,0 +1,40 @@
+from biocam_emulator.emulator import BioCamEmulator
+from biocam_emulator.pacing import make_pacer
+from biocam_emulator.timesync import TimeSync
+from biocam_emulator.transports import TcpServerTransport
+
+REPLY = "1700000000000"
+
+
+def test_reply_matches_latest_request_after_a_missed_one():
+    sync = TimeSync()
+    sync.request_sent(monotonic=0.0, wall=0.0)
+    # No reply to the first request, the second one is answered at once
+    sync.request_sent(monotonic=0.2, wall=0.2)
+    rtt_ms, _ = sync.reply_received(REPLY, monotonic=0.201)
+    assert abs(rtt_ms - 1.0) < 1e-6
+    assert sync.lost == 1
+
+    sync.request_sent(monotonic=0.4, wall=0.4)
+    rtt_ms, _ = sync.reply_received(REPLY, monotonic=0.401)
+    assert abs(rtt_ms - 1.0) < 1e-6
+    assert sync.lost == 1
+    assert sync.outstanding == 0
+
+
+def test_requests_dropped_by_the_transport_are_not_stamped():
+    emulator = BioCamEmulator(
+        pacer=make_pacer("unlimited"),
+        transport=TcpServerTransport(),
+        verbose=False,
+        lazy_summaries=True,
+    )
+    emulator.start()
+    try:
+        emulator.request_time()
+        emulator.emulate_step(0)
+        assert emulator.transport.bytes_dropped == len(b"$time\n")
+        assert emulator.timesync.requests == 0
+        assert emulator.timesync.outstanding == 0
+    finally:
+        emulator.close()
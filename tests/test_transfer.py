@@ -0,0 +1,87 @@
+from biocam_emulator.emulator import RemoteAwarenessData
+from biocam_emulator.event_loop import EventLoop
+from biocam_emulator.outbox import PRIORITY_SUMMARY, MessageOutbox
+from biocam_emulator.synthetic import SyntheticSummaries
+from biocam_emulator.transfer import SUMMARY_DONE, SummaryTransfer
+
+
+class _Link:
+    def __init__(self, count=10, window=2):
+        self.loop = EventLoop()
+        self.outbox = MessageOutbox()
+        self.events = []
+        self.transfer = SummaryTransfer(
+            RemoteAwarenessData(SyntheticSummaries(count), seed=0, shuffle=False),
+            self.outbox,
+            self.loop,
+            flush=lambda: None,
+            window=window,
+            listener=self.on_event,
+        )
+
+    def on_event(self, event, request):
+        self.events.append((event, None if request is None else request.request_id))
+
+    def send(self, count=None):
+        """Drain up to count summary lines, as the link would, return their IDs."""
+
+        ids = []
+        while count is None or len(ids) < count:
+            msgs = self.outbox.drain(limit=1)
+            if not msgs:
+                break
+            self.transfer.drained(len(msgs))
+            self.transfer.fill()
+            ids.append("done" if msgs[0] == SUMMARY_DONE else int(msgs[0].split()[1]))
+        return ids
+
+
+def test_requests_are_merged_without_duplicates():
+    link = _Link()
+    first = link.transfer.request_range(0, 5)
+    second = link.transfer.request_list([3, 4, 7, 42])
+    link.loop.run_once(0)
+
+    assert link.send() == [0, 1, 2, 3, 4, 7, "done"]
+    assert (first.total, first.sent, first.state) == (5, 5, "done")
+    assert (second.total, second.duplicates, second.invalid) == (1, 2, 1)
+    assert second.state == "done"
+    assert link.events[-1] == ("idle", None)
+
+
+def test_only_a_window_of_summaries_is_queued():
+    link = _Link(count=10, window=3)
+    request = link.transfer.request_range(-1, -1)
+    link.loop.run_once(0)
+
+    assert link.outbox.depth(PRIORITY_SUMMARY) == 3
+    assert link.send(4) == [0, 1, 2, 3]
+    assert link.outbox.depth(PRIORITY_SUMMARY) == 3
+    assert request.sent == 4 and request.state == "active"
+
+
+def test_cancel_drops_the_queued_summaries_and_waiting_requests():
+    link = _Link(count=10)
+    active = link.transfer.request_range(-1, -1)
+    waiting = link.transfer.request_list([1, 2], delay=60.0)
+    link.loop.run_once(0)
+    link.send(3)
+
+    assert link.transfer.cancel() == 7
+    assert link.outbox.depth() == 0
+    assert (active.state, active.sent) == ("cancelled", 3)
+    assert waiting.state == "cancelled"
+    assert not link.transfer.sending
+    assert ("cancelled", waiting.request_id) in link.events
+    assert link.send() == []
+
+
+def test_cancel_does_not_count_summary_done():
+    link = _Link(count=3)
+    link.transfer.request_range(-1, -1)
+    link.loop.run_once(0)
+
+    assert link.send(2) == [0, 1]
+    # The last summary and "summary done" are in the outbox
+    assert link.outbox.depth(PRIORITY_SUMMARY) == 2
+    assert link.transfer.cancel() == 1